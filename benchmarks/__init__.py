@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for smetana (run as scripts, see each module)."""
@@ -0,0 +1,217 @@
+"""
+Reference implementation of community merging, as it was before organism fragments were cached and shallow-copied
+(every organism object is deep-copied into the merged model).
+
+It is only kept to benchmark and test the current implementation against (tests import it as benchmarks.baseline).
+The function takes the Community as its only argument, and fills the same organism lookups as
+Community.generate_merged_model.
+"""
+
+from copy import deepcopy
+from math import inf
+
+from reframed.core.cbmodel import CBModel, CBReaction
+from reframed.core.model import Compartment, Metabolite, ReactionType
+from smetana.legacy import CommunityNameMapping, _id_pattern, _name_pattern
+
+
+def generate_merged_model(community):
+    """ Merge the organisms of a Community, as done before merged models were built from cached fragments. """
+
+    def _copy_object(obj, org_id, compartment=None):
+        new_obj = deepcopy(obj)
+        new_obj.id = _id_pattern(obj.id, org_id)
+        new_obj.name = _name_pattern(obj.name, org_id)
+        if compartment:
+            new_obj.compartment = compartment
+
+        return new_obj
+
+    models_missing_biomass = [m.id for m in community._organisms.values() if not m.biomass_reaction]
+    if models_missing_biomass:
+        raise RuntimeError("Biomass reaction not found in models: {}".format("', '".join(models_missing_biomass)))
+
+    merged_model = CBModel(community.id)
+
+    organisms_biomass_metabolites = {}
+    community_metabolite_exchange_lookup = {}
+
+    for org_id, model in community._organisms.items():
+        community._organisms_reactions[org_id] = []
+        community._organisms_exchange_reactions[org_id] = {}
+        community._organisms_biomass_reactions[org_id] = {}
+        exchanged_metabolites = {m_id for r_id in model.get_exchange_reactions()
+                                 for m_id in model.reactions[r_id].stoichiometry}
+        #
+        # Create additional extracellular compartment
+        #
+        if not community._merge_extracellular_compartments:
+            pool_compartment = Compartment('pool', 'common pool')
+            merged_model.add_compartment(pool_compartment)
+            export_pool_compartment = Compartment('pool_blacklist', 'blacklisted metabolite pool')
+            merged_model.add_compartment(export_pool_compartment)
+
+        for c_id, comp in model.compartments.items():
+            if not comp.external or not community._merge_extracellular_compartments:
+                new_comp = _copy_object(comp, org_id)
+                merged_model.add_compartment(new_comp)
+            elif c_id not in merged_model.compartments:
+                merged_model.add_compartment(deepcopy(comp))
+
+        for m_id, met in model.metabolites.items():
+            if not model.compartments[met.compartment].external or not community._merge_extracellular_compartments:
+                new_met = _copy_object(met, org_id, _id_pattern(met.compartment, org_id))
+                merged_model.add_metabolite(new_met)
+            elif m_id not in merged_model.metabolites:
+                merged_model.add_metabolite(deepcopy(met))
+
+            m_blacklisted = met.id in community._exchanged_metabolites_blacklist
+
+            if met.id in exchanged_metabolites and not community._merge_extracellular_compartments:
+                #
+                # For blacklisted metabolites create a separate pool from which metabolites can not be reuptaken
+                #
+                if m_blacklisted and community._interacting:
+                    pool_id = _id_pattern(m_id, "pool_blacklist")
+                    if pool_id not in merged_model.metabolites:
+                        new_met = _copy_object(met, "pool_blacklist", "pool_blacklist")
+                        merged_model.add_metabolite(new_met)
+
+                        exch_id = _id_pattern("R_EX_" + m_id, "pool_blacklist")
+                        exch_name = _name_pattern(met.name, "pool (blacklist) exchange")
+                        blk_rxn = CBReaction(exch_id, name=exch_name, reversible=False,
+                                             reaction_type=ReactionType.SINK)
+                        blk_rxn.stoichiometry[pool_id] = -1.0
+                        community_metabolite_exchange_lookup[new_met.id] = exch_id
+                        merged_model.add_reaction(blk_rxn)
+
+                pool_id = _id_pattern(m_id, "pool")
+                if pool_id not in merged_model.metabolites:
+                    new_met = _copy_object(met, "pool", "pool")
+                    merged_model.add_metabolite(new_met)
+
+                    exch_id = _id_pattern("R_EX_" + m_id, "pool")
+                    exch_name = _name_pattern(met.name, "pool exchange")
+                    new_rxn = CBReaction(exch_id, name=exch_name, reversible=True,
+                                         reaction_type=ReactionType.EXCHANGE)
+                    new_rxn.stoichiometry[pool_id] = -1.0
+                    community_metabolite_exchange_lookup[new_met.id] = exch_id
+                    merged_model.add_reaction(new_rxn)
+
+        for r_id, rxn in model.reactions.items():
+
+            is_exchange = rxn.reaction_type == ReactionType.EXCHANGE
+
+            if not is_exchange or not community._merge_extracellular_compartments:
+                new_rxn = _copy_object(rxn, org_id)
+
+                for m_id, coeff in rxn.stoichiometry.items():
+                    m_blacklisted = m_id in community._exchanged_metabolites_blacklist
+                    if (not model.compartments[model.metabolites[m_id].compartment].external
+                            or not community._merge_extracellular_compartments):
+                        del new_rxn.stoichiometry[m_id]
+                        new_id = _id_pattern(m_id, org_id)
+                        new_rxn.stoichiometry[new_id] = coeff
+
+                    if is_exchange:
+                        new_rxn.reaction_type = ReactionType.OTHER
+                        if (model.compartments[model.metabolites[m_id].compartment].external
+                                and not community._merge_extracellular_compartments):
+                            # TODO: if m_id in community._exchanged_metabolites_blacklist:
+                            pool_id = _id_pattern(m_id, "pool")
+                            new_rxn.stoichiometry[pool_id] = -coeff
+                            cnm = CommunityNameMapping(
+                                organism_reaction=new_rxn.id,
+                                original_reaction=r_id,
+                                organism_metabolite=new_id,
+                                extracellular_metabolite=pool_id,
+                                original_metabolite=m_id,
+                                community_exchange_reaction=community_metabolite_exchange_lookup[pool_id])
+                            community._organisms_exchange_reactions[org_id][new_rxn.id] = cnm
+
+                            if not community.interacting:
+                                sink_rxn = CBReaction('Sink_{}'.format(new_id), reaction_type=ReactionType.SINK,
+                                                      reversible=False)
+                                sink_rxn.stoichiometry = {new_id: -1}
+                                sink_rxn.lb = 0.0
+                                merged_model.add_reaction(sink_rxn)
+                            elif m_blacklisted:
+                                pool_blacklist_id = _id_pattern(m_id, "pool_blacklist")
+                                blacklist_export_rxn = CBReaction('R_EX_BLACKLIST_{}'.format(new_id),
+                                                                  reaction_type=ReactionType.OTHER,
+                                                                  reversible=False)
+                                blacklist_export_rxn.stoichiometry = {new_id: -1, pool_blacklist_id: 1}
+                                blacklist_export_rxn.lb = 0.0
+                                merged_model.add_reaction(blacklist_export_rxn)
+
+                if is_exchange and not community._merge_extracellular_compartments:
+                    new_rxn.reversible = True
+                    new_rxn.lb = -inf
+                    new_rxn.ub = inf if community.interacting and not m_blacklisted else 0.0
+
+                if rxn.id == model.biomass_reaction:
+                    new_rxn.reversible = False
+
+                if community._create_biomass and rxn.id == model.biomass_reaction:
+                    new_rxn.objective = False
+
+                    # Add biomass metabolite to biomass equation
+                    m_id = _id_pattern('Biomass', org_id)
+                    name = _name_pattern('Community biomass', org_id)
+                    comp = 'pool'
+                    biomass_met = Metabolite(m_id, name, comp)
+                    merged_model.add_metabolite(biomass_met)
+                    new_rxn.stoichiometry[m_id] = 1
+                    organisms_biomass_metabolites[org_id] = m_id
+
+                    sink_rxn = CBReaction('Sink_biomass_{}'.format(org_id), reaction_type=ReactionType.SINK,
+                                          reversible=False)
+                    sink_rxn.stoichiometry = {m_id: -1}
+                    sink_rxn.lb = 0.0
+                    merged_model.add_reaction(sink_rxn)
+
+                community._organisms_reactions[org_id].append(new_rxn.id)
+                merged_model.add_reaction(new_rxn)
+
+            else:
+                if is_exchange and community._merge_extracellular_compartments:
+                    community._organisms_exchange_reactions[org_id][rxn.id] = CommunityNameMapping(
+                        organism_reaction=r_id,
+                        original_reaction=r_id,
+                        extracellular_metabolite=list(rxn.stoichiometry.keys())[0],
+                        original_metabolite=list(rxn.stoichiometry.keys())[0],
+                        organism_metabolite=None)
+                    community._organisms_reactions[org_id].append(rxn.id)
+
+                if r_id in merged_model.reactions:
+                    continue
+
+                new_rxn = deepcopy(rxn)
+                new_rxn.reaction_type = ReactionType.EXCHANGE
+                if rxn.id == model.biomass_reaction and community._create_biomass:
+                    new_rxn.reversible = False
+                    new_rxn.objective = False
+
+                    m_id = _id_pattern('Biomass', org_id)
+                    name = _name_pattern('Biomass', org_id)
+                    comp = 'pool'
+                    biomass_met = Metabolite(m_id, name, comp)
+                    merged_model.add_metabolite(biomass_met)
+                    new_rxn.stoichiometry[m_id] = 1
+                    organisms_biomass_metabolites[org_id] = m_id
+
+                merged_model.add_reaction(new_rxn)
+
+            if r_id == model.biomass_reaction:
+                community._organisms_biomass_reactions[org_id] = new_rxn.id
+
+    if community._create_biomass:
+        biomass_rxn = CBReaction('R_Community_Growth', name="Community Growth",
+                                 reversible=False, reaction_type=ReactionType.SINK, objective=1.0)
+        for org_biomass in organisms_biomass_metabolites.values():
+            biomass_rxn.stoichiometry[org_biomass] = -1
+
+        merged_model.add_reaction(biomass_rxn)
+        merged_model.biomass_reaction = biomass_rxn.id
+
+    return merged_model
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""
+Benchmark community merging (Community.generate_merged_model).
+
+Synthetic communities are built by replicating the test models (tests/data/ec_*_ko.xml) under new ids.
+As a reference, the script also times the previous implementation (benchmarks/baseline.py), which deep-copied every
+organism object into the merged model.
+
+Usage (from the repository root, with smetana installed or in PYTHONPATH):
+    python benchmarks/merge.py [-n 2 5 10 20 50] [-r REPEATS] [-o results.json]
+"""
+
+import argparse
+import glob
+import json
+import os
+from time import perf_counter
+
+from reframed import load_cbmodel
+from smetana.legacy import Community
+
+from baseline import generate_merged_model as baseline_merged_model
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+
+def replicate_models(n, pattern='ec_*_ko.xml'):
+    """ Create n organism models by replicating the test models under new ids. """
+
+    filenames = sorted(glob.glob(os.path.join(DATA_DIR, pattern)))
+    base_models = [load_cbmodel(filename, flavor='fbc2') for filename in filenames]
+    models = []
+
+    for i in range(n):
+        model = base_models[i % len(base_models)].copy()
+        model.id = '{}_{}'.format(model.id, i + 1)
+        models.append(model)
+
+    return models
+
+
+def time_call(func, repeats):
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main(sizes, repeats):
+    results = []
+
+    for n in sizes:
+        models = replicate_models(n)
+        merge_time = time_call(lambda: Community('bench', models, copy_models=False).generate_merged_model(), repeats)
+        baseline_time = time_call(lambda: baseline_merged_model(Community('bench', models, copy_models=False)),
+                                  repeats)
+
+        results.append({
+            'organisms': n,
+            'merge_time': merge_time,
+            'baseline_time': baseline_time,
+            'speedup': baseline_time / merge_time,
+        })
+
+        print('{:>4} organisms: merge {:.3f}s, baseline {:.3f}s ({:.1f}x)'.format(
+            n, merge_time, baseline_time, baseline_time / merge_time))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark community merging.")
+    parser.add_argument('-n', type=int, nargs='+', default=[2, 5, 10, 20, 50], help="Community sizes.")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help="Repetitions per size (best time is reported).")
+    parser.add_argument('-o', '--output', help="Save results to JSON file.")
+    args = parser.parse_args()
+
+    data = main(args.n, args.repeats)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+Benchmark pairwise mode (--pairwise) against running the same pairs from a communities file.
+
+Synthetic organisms are built by replicating the test models (tests/data/ec_*_ko.xml) under new ids, and saved as
+SBML files. For each number of organisms, the script times merging every pair (and the variant used by SCS), which
+is what pairwise mode speeds up: with a communities file the fragment cache keeps at most 100 fragments (so with
+many organisms they are built again for most pairs), while pairwise mode builds the fragments of every organism
+once, before running the pairs (see interface.warm_fragments). Models are loaded before starting the timer.
+
+With --run, the whole run (global mode on M9) is also timed both ways, and the results are checked to be the same.
+
+Usage (from the repository root, with smetana installed or in PYTHONPATH):
+    python benchmarks/pairwise.py [-n 20 50] [-r REPEATS] [--run] [--solver cplex] [-o results.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from time import perf_counter
+
+from reframed import save_cbmodel, set_default_solver
+from smetana.interface import build_cache, main as run_smetana, pairwise_communities, warm_fragments
+from smetana.legacy import Community, FragmentCache
+
+from merge import replicate_models, time_call, DATA_DIR
+
+
+def save_models(models, model_dir):
+    filenames = []
+    for model in models:
+        filename = os.path.join(model_dir, model.id + '.xml')
+        save_cbmodel(model, filename, flavor='fbc2')
+        filenames.append(filename)
+    return filenames
+
+
+def merge_pairs(model_cache, org_ids, fragment_cache):
+    for comm_id, organisms in pairwise_communities(org_ids):
+        models = [model_cache.get_model(org_id, reset_id=True) for org_id in organisms]
+        community = Community(comm_id, models, copy_models=False, fragment_cache=fragment_cache)
+        community.merged
+        community.variant(create_biomass=False).merged
+
+
+def time_run(filenames, output, **kwargs):
+    start = perf_counter()
+    run_smetana(filenames, output=output, mode='global', media='M9', mediadb=os.path.join(DATA_DIR, 'media_db.tsv'),
+                exclude=os.path.join(DATA_DIR, 'inorganic.txt'), **kwargs)
+    elapsed = perf_counter() - start
+
+    with open(output + '_global.tsv') as f:
+        return elapsed, f.read()
+
+
+def main(sizes, repeats, run):
+    results = []
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        for n in sizes:
+            model_dir = os.path.join(tmpdir, str(n))
+            os.makedirs(model_dir)
+            filenames = save_models(replicate_models(n), model_dir)
+            model_cache = build_cache(filenames)
+            org_ids = model_cache.get_ids()
+            for org_id in org_ids:
+                model_cache.get_model(org_id, reset_id=True)
+
+            def communities_file():
+                merge_pairs(model_cache, org_ids, FragmentCache(100))
+
+            def pairwise():
+                fragment_cache = FragmentCache(max(100, 2 * n))
+                warm_fragments(model_cache, fragment_cache, org_ids, 'detailed')
+                merge_pairs(model_cache, org_ids, fragment_cache)
+
+            entry = {
+                'organisms': n,
+                'pairs': n * (n - 1) // 2,
+                'communities_merge_time': time_call(communities_file, repeats),
+                'pairwise_merge_time': time_call(pairwise, repeats),
+            }
+            entry['merge_speedup'] = entry['communities_merge_time'] / entry['pairwise_merge_time']
+
+            print('{:>4} organisms ({} pairs): merge with communities file {:.3f}s, pairwise {:.3f}s ({:.1f}x)'.format(
+                n, entry['pairs'], entry['communities_merge_time'], entry['pairwise_merge_time'],
+                entry['merge_speedup']))
+
+            if run:
+                communities = os.path.join(model_dir, 'communities.tsv')
+                with open(communities, 'w') as f:
+                    for comm_id, organisms in pairwise_communities(org_ids):
+                        f.writelines('{}\t{}\n'.format(comm_id, org_id) for org_id in organisms)
+
+                time1, output1 = time_run(filenames, os.path.join(model_dir, 'communities'), communities=communities)
+                time2, output2 = time_run(filenames, os.path.join(model_dir, 'pairwise'), pairwise=True)
+                entry.update({'communities_run_time': time1, 'pairwise_run_time': time2,
+                              'run_speedup': time1 / time2, 'identical_results': output1 == output2})
+
+                print('{:>4} organisms ({} pairs): run with communities file {:.3f}s, pairwise {:.3f}s ({:.1f}x), '
+                      'identical results: {}'.format(n, entry['pairs'], time1, time2, time1 / time2,
+                                                     output1 == output2))
+
+            results.append(entry)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark pairwise mode.")
+    parser.add_argument('-n', type=int, nargs='+', default=[20, 50], help="Number of organisms.")
+    parser.add_argument('-r', '--repeats', type=int, default=1, help="Repetitions per size (best time is reported).")
+    parser.add_argument('--run', action='store_true', help="Also time whole runs (global mode, M9 medium).")
+    parser.add_argument('--solver', help="Change default solver.")
+    parser.add_argument('-o', '--output', help="Save results to JSON file.")
+    args = parser.parse_args()
+
+    if args.solver:
+        set_default_solver(args.solver)
+
+    data = main(args.n, args.repeats, args.run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the MILP formulations of the species coupling score (sc_score).
+
+The 'full' formulation switches off every reaction of an absent organism with big-M constraints, the 'exchange'
+formulation only gates the exchange reactions with the pool (using indicator constraints if the solver supports
+them). For each community size the script reports the running time of both formulations and checks that the
+scores are identical.
+
+Usage (from the repository root, with smetana installed or in PYTHONPATH):
+    python benchmarks/sc_score.py [-n 2 4 8] [-r REPEATS] [-s SOLUTIONS] [--solver cplex] [-o results.json]
+"""
+
+import argparse
+import json
+
+from reframed import Environment, set_default_solver
+from smetana.legacy import Community
+from smetana.smetana import sc_score
+
+from merge import replicate_models, time_call
+
+FORMULATIONS = ['full', 'exchange']
+
+
+def same_scores(scores1, scores2, tol=1e-9):
+    if scores1.keys() != scores2.keys():
+        return False
+
+    for org_id, values1 in scores1.items():
+        values2 = scores2[org_id]
+        if values1 is None or values2 is None:
+            if values1 is not values2:
+                return False
+        elif any(abs(values1[o] - values2[o]) > tol for o in values1):
+            return False
+
+    return True
+
+
+def main(sizes, repeats, n_solutions):
+    results = []
+
+    for n in sizes:
+        models = replicate_models(n)
+        community = Community('bench', models, copy_models=False)
+        env = Environment.complete(community.merged)
+        entry = {'organisms': n}
+        scores = {}
+
+        for formulation in FORMULATIONS:
+            def run():
+                scores[formulation] = sc_score(community, environment=env, n_solutions=n_solutions, verbose=False,
+                                               formulation=formulation)
+            entry['{}_time'.format(formulation)] = time_call(run, repeats)
+
+        entry['speedup'] = entry['full_time'] / entry['exchange_time']
+        entry['identical_scores'] = same_scores(scores['full'], scores['exchange'])
+        results.append(entry)
+
+        print('{:>4} organisms: full {:.3f}s, exchange {:.3f}s ({:.1f}x), identical scores: {}'.format(
+            n, entry['full_time'], entry['exchange_time'], entry['speedup'], entry['identical_scores']))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark sc_score formulations.")
+    parser.add_argument('-n', type=int, nargs='+', default=[2, 4, 8], help="Community sizes.")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help="Repetitions per size (best time is reported).")
+    parser.add_argument('-s', '--solutions', type=int, default=100, help="Number of alternative solutions.")
+    parser.add_argument('--solver', help="Change default solver.")
+    parser.add_argument('-o', '--output', help="Save results to JSON file.")
+    args = parser.parse_args()
+
+    if args.solver:
+        set_default_solver(args.solver)
+
+    data = main(args.n, args.repeats, args.solutions)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
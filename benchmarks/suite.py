@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+Benchmark suite for community merging and the SMETANA scores.
+
+Synthetic communities of increasing size are built by replicating the test models (tests/data/ec_*_ko.xml) under new
+ids, and simulated on the M9 medium (tests/data/media_db.tsv). For each community size, the following stages are
+timed separately: generate_merged_model, minimal_environment, mip_score, mro_score, mu_score, mp_score and sc_score.
+Except for generate_merged_model, the community is built and merged before starting the timer.
+
+For each stage the script reports the best wall time over the repetitions, the number of optimization problems
+solved (and their status), and the peak memory allocated by Python (measured in a separate run, since tracing
+allocations slows everything down). Results are saved as JSON, so they can be compared across versions.
+
+Usage (from the repository root, with smetana installed or in PYTHONPATH):
+    python benchmarks/suite.py [-n 2 4 8 16] [-r REPEATS] [-s STAGE ...] [--solver cplex] [-o results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import tracemalloc
+from time import perf_counter
+
+from reframed import Environment, set_default_solver, solver_instance
+import smetana
+from smetana.interface import load_media_db
+from smetana.legacy import Community
+from smetana.profiling import SolverStats
+from smetana.smetana import mip_score, mro_score, mu_score, mp_score, sc_score, minimal_environment
+
+from merge import replicate_models, DATA_DIR
+
+
+# each stage does its setup (outside the timer) and returns the call to be timed
+
+def merged_community(models):
+    community = Community('bench', models, copy_models=False)
+    community.merged
+    return community
+
+
+def merge_stage(models, env):
+    return lambda: Community('bench', models, copy_models=False).generate_merged_model()
+
+
+def score_stage(func, **kwargs):
+    def stage(models, env):
+        community = merged_community(models)
+        return lambda: func(community, environment=env, **kwargs)
+    return stage
+
+
+def environment_stage(models, env):
+    community = merged_community(models)
+    return lambda: minimal_environment(community, verbose=False, max_uptake=10.0 * len(models))
+
+
+STAGES = {
+    'merge': merge_stage,
+    'minimal_environment': environment_stage,
+    'mip': score_stage(mip_score, verbose=False),
+    'mro': score_stage(mro_score, verbose=False),
+    'mu': score_stage(mu_score, verbose=False),
+    'mp': score_stage(mp_score),
+    'sc': score_stage(sc_score, verbose=False),
+}
+
+
+def run_stage(stage, models, env, repeats):
+    times = []
+    call = stage(models, env)
+
+    with SolverStats() as stats:
+        for _ in range(repeats):
+            start = perf_counter()
+            call()
+            times.append(perf_counter() - start)
+
+    call = stage(models, env)
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'time': min(times),
+        'solves': stats.solves // repeats,
+        'status': {status: count // repeats for status, count in stats.status.items()},
+        'peak_memory_mb': peak / (1024 * 1024),
+    }
+
+
+def main(sizes, repeats, stages, medium='M9'):
+    media_db = load_media_db(os.path.join(DATA_DIR, 'media_db.tsv'))
+    results = []
+
+    for n in sizes:
+        models = replicate_models(n)
+        env = Environment.from_compounds(media_db[medium], fmt_func=lambda x: "R_EX_M_{}_e_pool".format(x),
+                                         max_uptake=10.0 * n)
+
+        for name in stages:
+            entry = {'organisms': n, 'stage': name}
+            entry.update(run_stage(STAGES[name], models, env, repeats))
+            results.append(entry)
+
+            print('{:>4} organisms, {:<20} {:8.3f}s {:6d} solves {:8.1f} MB'.format(
+                n, name, entry['time'], entry['solves'], entry['peak_memory_mb']))
+
+    return {
+        'smetana_version': smetana.__version__,
+        'python_version': platform.python_version(),
+        'solver': type(solver_instance()).__name__,
+        'medium': medium,
+        'repeats': repeats,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark community merging and SMETANA scores.")
+    parser.add_argument('-n', type=int, nargs='+', default=[2, 4, 8, 16], help="Community sizes.")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help="Repetitions per stage (best time is reported).")
+    parser.add_argument('-s', '--stages', nargs='+', choices=list(STAGES), default=list(STAGES),
+                        help="Stages to run (default: all).")
+    parser.add_argument('--solver', help="Change default solver.")
+    parser.add_argument('-o', '--output', help="Save results to JSON file.")
+    args = parser.parse_args()
+
+    if args.solver:
+        set_default_solver(args.solver)
+
+    data = main(args.n, args.repeats, args.stages)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
@@ -8,7 +8,7 @@ from setuptools import setup, find_packages
 with open('README.rst') as readme_file:
     readme = readme_file.read()
 
-requirements = ["reframed>=1.6.0", "pandas>=2.0.0"]
+requirements = ["reframed>=1.6.0", "pandas>=2.0.0", "numpy"]
 
 test_requirements = requirements + ['cplex']
 
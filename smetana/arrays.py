@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class CommunityArrays(object):
+    """
+    Array-backed representation of a merged community model.
+
+    Stores the stoichiometric matrix in CSR format (rows are metabolites, columns are reactions, both in the order of
+    the merged model), the flux bound vectors, and index arrays for the columns, reactions and exchange reactions of
+    each organism and for the exchange reactions of the community pool. Organism columns are given as index arrays
+    (not as blocks), since the reactions of an organism are not contiguous in the merged model (e.g. its biomass sink).
+
+    The arrays are built from the merged model (once per community) and used to process flux vectors of the whole
+    community at once (e.g. splitting them by organism). Solver problems are still built by reframed from the merged
+    model: the arrays are not loaded into the solvers.
+    """
+
+    def __init__(self, community):
+        """
+        Args:
+            community (Community): microbial community (the arrays represent its merged model)
+        """
+        model = community.merged
+
+        self.reactions = list(model.reactions.keys())
+        self.metabolites = list(model.metabolites.keys())
+        self.reaction_index = {r_id: j for j, r_id in enumerate(self.reactions)}
+        met_index = {m_id: i for i, m_id in enumerate(self.metabolites)}
+
+        n_cols = len(self.reactions)
+        self.lb = np.empty(n_cols)
+        self.ub = np.empty(n_cols)
+        rows, cols, data = [], [], []
+        reaction_organisms = community.reaction_organisms
+        columns = {org_id: [] for org_id in community.organisms}
+
+        for j, (r_id, rxn) in enumerate(model.reactions.items()):
+            org_id = reaction_organisms.get(r_id)
+            if org_id is not None:
+                columns[org_id].append(j)
+            self.lb[j] = rxn.lb
+            self.ub[j] = rxn.ub
+            for m_id, coeff in rxn.stoichiometry.items():
+                rows.append(met_index[m_id])
+                cols.append(j)
+                data.append(coeff)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(rows, kind='stable')
+        self.indices = np.asarray(cols, dtype=np.int64)[order]
+        self.data = np.asarray(data, dtype=float)[order]
+        self.indptr = np.zeros(len(self.metabolites) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.metabolites)), out=self.indptr[1:])
+
+        self.organism_columns = {org_id: np.asarray(index, dtype=np.int64) for org_id, index in columns.items()}
+        self.organism_reactions = {}
+        self.organism_exchanges = {}
+        self.biomass_reactions = {}
+
+        for org_id, rxns in community.organisms_reactions.items():
+            self.organism_reactions[org_id] = np.asarray([self.reaction_index[r_id] for r_id in rxns], dtype=np.int64)
+
+        for org_id, exchange_rxns in community.organisms_exchange_reactions.items():
+            self.organism_exchanges[org_id] = np.asarray([self.reaction_index[r_id] for r_id in exchange_rxns],
+                                                         dtype=np.int64)
+
+        for org_id, r_id in community.organisms_biomass_reactions.items():
+            if r_id in self.reaction_index:
+                self.biomass_reactions[org_id] = self.reaction_index[r_id]
+
+        self.pool_exchanges = np.asarray([self.reaction_index[r_id] for r_id in model.get_exchange_reactions()],
+                                         dtype=np.int64)
+
+    @property
+    def shape(self):
+        return len(self.metabolites), len(self.reactions)
+
+    def row(self, i):
+        """ Coefficients of one metabolite, as a dict of reaction id to coefficient (in reaction order). """
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return {self.reactions[j]: float(coeff) for j, coeff in zip(self.indices[start:end], self.data[start:end])}
@@ -0,0 +1,108 @@
+from time import perf_counter
+
+from smetana.session import add_solve_hook, remove_solve_hook, set_time_limit, hit_time_limit
+
+
+class TimeLimitExceeded(Exception):
+    """ Raised when the time budget of a community runs out. """
+    pass
+
+
+class TimeBudget(object):
+    """
+    Enforces time limits on the optimization problems of a community (used as a context manager).
+
+    While active, every problem solved by a solver built with session.new_solver gets a time limit: the per-solve
+    limit, or the time left in the community budget if that is shorter. The limit is removed again after each solve.
+    Once the community budget runs out, any further solve raises TimeLimitExceeded. Solves that stop because they
+    reached their time limit (according to the solver status) are counted in *timeouts*.
+    """
+
+    def __init__(self, solve_limit=None, total_limit=None):
+        """
+        Args:
+            solve_limit (float): time limit for each problem, in seconds (optional)
+            total_limit (float): time budget for all problems together, in seconds (optional)
+        """
+        self.solve_limit = solve_limit
+        self.total_limit = total_limit
+        self.timeouts = 0
+        self.reasons = []
+        self._start = None
+        self._limited = set()
+
+    @property
+    def remaining(self):
+        """ Time left in the budget, in seconds (None if there is no budget). """
+        if self.total_limit is None or self._start is None:
+            return None
+        return self.total_limit - (perf_counter() - self._start)
+
+    @property
+    def exhausted(self):
+        remaining = self.remaining
+        return remaining is not None and remaining <= 0
+
+    def start(self):
+        """ Start the budget clock and the time limits (same as entering the context). """
+        self._start = perf_counter()
+        add_solve_hook(self)
+
+    def stop(self):
+        """ Remove the time limits (same as exiting the context). """
+        remove_solve_hook(self)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def before_solve(self, solver):
+        limit = self.solve_limit
+        remaining = self.remaining
+
+        if remaining is not None:
+            if remaining <= 0:
+                raise TimeLimitExceeded()
+            limit = remaining if limit is None else min(limit, remaining)
+
+        if limit is not None:
+            set_time_limit(solver, limit)
+            self._limited.add(id(solver))
+
+    def after_solve(self, solver, solution):
+        if id(solver) not in self._limited:
+            return
+
+        self._limited.discard(id(solver))
+
+        if solution is not None and hit_time_limit(solver, solution):
+            self.timeouts += 1
+
+        set_time_limit(solver, None)
+
+    def call(self, name, func):
+        """ Call *func* (without arguments), recording a reason if any of its solves reached a time limit.
+
+        Args:
+            name (str): name of the computation (e.g. score name), used in the reason
+
+        Returns:
+            tuple: result of *func*, and True if it was computed without reaching a time limit
+        """
+
+        timeouts = self.timeouts
+        value = func()
+
+        if self.timeouts > timeouts:
+            self.reasons.append('{}: time limit'.format(name))
+            return value, False
+
+        return value, True
+
+    def pop_reason(self):
+        """ Collect (and clear) the reasons recorded so far, as a single string. """
+        reason, self.reasons = '; '.join(self.reasons), []
+        return reason
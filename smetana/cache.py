@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from smetana import __version__
+
+
+_MISSING = object()
+
+
+def file_digest(filename, block_size=1 << 20):
+    """ SHA-256 digest of the contents of a file. """
+
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Content-addressed on-disk cache of scoring results.
+
+    Results are stored under a hash of the model files of the community members, the environment and the scoring
+    parameters, so re-running the same community on the same medium with the same options skips all the
+    optimization problems (no solver is even created). Changing any model file invalidates its entries.
+
+    When the cache grows above *max_size*, the least recently used entries are removed. The cache can be shared by
+    multiple processes (entries are written atomically, and the size is read from the directory before evicting).
+
+    Entries are stored with pickle, and loading them can run arbitrary code: only use cache directories written by
+    smetana that you trust (never a directory that other users can write to).
+    """
+
+    def __init__(self, cache_dir, model_files, max_size=1024, digests=None):
+        """
+        Args:
+            cache_dir (str): cache directory (created if it does not exist)
+            model_files (dict): model file of each organism id
+            max_size (float): maximum cache size in MB (default: 1024)
+            digests (dict): known digests of model files, by organism id (optional)
+        """
+        self.cache_dir = cache_dir
+        self.model_files = model_files
+        self.max_size = int(max_size * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._digests = dict(digests) if digests else {}
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entries(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def _digest(self, org_id):
+        if org_id not in self._digests:
+            self._digests[org_id] = file_digest(self.model_files[org_id])
+        return self._digests[org_id]
+
+    def key(self, score, organisms, environment, params):
+        """ Compute the key of a scoring call.
+
+        Args:
+            score (str): score name
+            organisms (list): organism ids of the community members
+            environment (Environment): metabolic environment (optional)
+            params (dict): scoring parameters (must be JSON serializable)
+
+        Returns:
+            str: cache key
+        """
+
+        bounds = sorted((r_id, list(bound)) for r_id, bound in environment.items()) if environment else []
+
+        data = {
+            'version': __version__,
+            'score': score,
+            'models': sorted((org_id, self._digest(org_id)) for org_id in organisms),
+            'environment': bounds,
+            'params': params,
+        }
+
+        text = json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, key, default=None):
+        """ Get a cached result (marking it as recently used), or *default* if it is not in the cache. """
+
+        path = self._path(key)
+
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, value):
+        """ Store a result in the cache. """
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+
+        # other processes may write to the same directory: its size is only known from the directory listing
+        entries = list(self._entries())
+        if sum(size for _, size, _ in entries) > self.max_size:
+            self.evict(entries)
+
+    def evict(self, entries=None):
+        """ Remove the least recently used entries until the cache is below 90% of its maximum size.
+
+        Args:
+            entries (list): current entries as (path, size, mtime) tuples (default: read from the directory)
+        """
+
+        if entries is None:
+            entries = self._entries()
+
+        entries = sorted(entries, key=lambda x: x[2])
+        total = sum(size for _, size, _ in entries)
+        target = 0.9 * self.max_size
+
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def cached(self, score, organisms, environment, params, func, budget=None):
+        """ Get a result from the cache, or compute it with *func* and store it.
+
+        Args:
+            score (str): score name
+            organisms (list): organism ids of the community members
+            environment (Environment): metabolic environment (optional)
+            params (dict): scoring parameters
+            func (function): computes the result (called without arguments)
+            budget (TimeBudget): time budget; results that reach a time limit are not stored (optional)
+
+        Returns:
+            result
+        """
+
+        key = self.key(score, organisms, environment, params)
+        value = self.get(key, _MISSING)
+
+        if value is _MISSING:
+            value, complete = budget.call(score, func) if budget is not None else (func(), True)
+            if complete:
+                self.put(key, value)
+
+        return value
+
+
+def cached(cache, score, organisms, environment, params, func, budget=None):
+    """ Call *func* through a result cache and a time budget (either can be None).
+
+    If a time limit is reached while computing the result, a reason is recorded in the budget, and the result (which
+    may be None, or a partial result) is not stored in the cache.
+    """
+
+    if cache is None:
+        return budget.call(score, func)[0] if budget is not None else func()
+
+    return cache.cached(score, organisms, environment, params, func, budget)
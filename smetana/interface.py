@@ -4,11 +4,20 @@ import os
 import glob
 import pandas as pd
 from collections import OrderedDict
+from multiprocessing import Pool
 from reframed import Environment
 from .smetana import mip_score, mro_score, sc_score, mp_score, mu_score, minimal_environment
 from random import sample
+from itertools import combinations
 from reframed.io.cache import ModelCache
-from smetana.legacy import Community
+from smetana.legacy import Community, FragmentCache
+from smetana.session import SolverSession
+from smetana.parallel import OrganismPool
+from smetana.cache import ResultCache, cached
+from smetana.profiling import Profiler, profiled
+from smetana.budget import TimeBudget, TimeLimitExceeded
+from smetana.store import ModelStore, SBMLLoader, BoundedModelCache
+from smetana.output import ResultWriter, Checkpoint
 from math import inf
 
 
@@ -25,7 +34,25 @@ def extract_id_from_filepath(filepath):
     return organism_id
 
 
-def build_cache(models, flavor=None):
+def _post_process(model):
+    if 'R_ATPM' in model.reactions:
+        model.reactions.R_ATPM.lb = 0
+
+
+def build_cache(models, flavor=None, max_models=None, max_size=None):
+    """ Build the model cache for a list of SBML files (or a model store).
+
+    If *max_models* or *max_size* (in MB) are given, the number of models kept in memory is bounded, and the least
+    recently used models are evicted first. Models read from a store are always kept in memory (within these limits),
+    since the store rebuilds them on every access.
+    """
+
+    bounded = max_models is not None or max_size is not None
+
+    if len(models) == 1 and ModelStore.is_store(models[0]):
+        source = ModelStore(models[0], post_processing=_post_process)
+        return BoundedModelCache(source, max_models, max_size)
+
     ids = [extract_id_from_filepath(model) for model in models]
 
     if not flavor:
@@ -33,31 +60,52 @@ def build_cache(models, flavor=None):
 
     load_args = {'flavor': flavor}
 
-    def post_process(model):
-        if 'R_ATPM' in model.reactions:
-            model.reactions.R_ATPM.lb = 0
+    if bounded:
+        source = SBMLLoader(ids, models, load_args=load_args, post_processing=_post_process)
+        return BoundedModelCache(source, max_models, max_size)
+
+    return ModelCache(ids, models, load_args=load_args, post_processing=_post_process)
+
+
+def order_communities(comm_dict):
+    """ Sort communities so that communities sharing members are run consecutively (increases model cache hits).
 
-    return ModelCache(ids, models, load_args=load_args, post_processing=post_process)
+    Args:
+        comm_dict (dict): organisms of each community
 
+    Returns:
+        OrderedDict: same communities in the new order
+    """
 
-def load_communities(models, communities, other, flavor):
+    return OrderedDict(sorted(comm_dict.items(), key=lambda item: (sorted(item[1]), item[0])))
+
+
+def find_models(models):
     if len(models) == 1 and '*' in models[0]:
         pattern = models[0]
         models = glob.glob(pattern)
         if len(models) == 0:
             raise RuntimeError("No files found: {}".format(pattern))
 
+    return models
+
+
+def load_communities(models, communities, other, flavor, max_models=None, max_size=None):
+    models = find_models(models)
+
     if other is not None:
         df = pd.read_csv(other, header=None)
         other_models = set(df[0])
     else:
         other_models = set()
 
-    model_cache = build_cache(models, flavor)
+    model_cache = build_cache(models, flavor, max_models, max_size)
 
     if communities is not None:
         df = pd.read_csv(communities, sep='\t', header=None, dtype=str)
         comm_dict = OrderedDict((name, group[1].tolist()) for name, group in df.groupby(0))
+        if isinstance(model_cache, BoundedModelCache) and model_cache.bounded:
+            comm_dict = order_communities(comm_dict)
     else:
         comm_dict = {'all': model_cache.get_ids()}
 
@@ -69,6 +117,47 @@ def load_communities(models, communities, other, flavor):
     return model_cache, comm_dict, other_models
 
 
+def pairwise_communities(org_ids):
+    """ Enumerate all pairwise communities of a list of organisms (without storing them).
+
+    Args:
+        org_ids (list): organism ids
+
+    Returns:
+        generator: (community id, organisms) tuples
+    """
+
+    for org1, org2 in combinations(org_ids, 2):
+        yield '{}_{}'.format(org1, org2), [org1, org2]
+
+
+# merging variants of a community used by each mode (global: MIP, other modes: SCS and biotic perturbations)
+_MODE_VARIANTS = {'global': [{}, {'interacting': False}]}
+_DEFAULT_VARIANTS = [{}, {'create_biomass': False}]
+
+
+def warm_fragments(model_cache, fragment_cache, org_ids, mode):
+    """ Build the fragments (namespaced merged model parts, with their exchange reactions) of each organism up front.
+
+    Fragments only depend on the organism and the merging variant, so in pairwise mode they are built once per
+    organism before the pairs are run (for each variant used by *mode*), instead of while merging the first pairs.
+
+    Args:
+        model_cache: model cache
+        fragment_cache (FragmentCache): fragment cache (must hold all the fragments)
+        org_ids (list): organism ids
+        mode (str): run mode
+    """
+
+    variants = _MODE_VARIANTS.get(mode, _DEFAULT_VARIANTS)
+
+    for org_id in org_ids:
+        model = model_cache.get_model(org_id, reset_id=True)
+        community = Community(org_id, [model], copy_models=False, fragment_cache=fragment_cache)
+        for options in variants:
+            community.variant(**options).get_fragment(org_id, model)
+
+
 def load_media_db(filename, sep='\t', medium_col='medium', compound_col='compound'):
     """ Load media library file. """
 
@@ -105,16 +194,37 @@ def load_media(media, mediadb, exclude, other):
     return media, media_db, excluded_mets, other_mets
 
 
-def define_environment(medium, media_db, community, mode, aerobic, verbose, min_mol_weight, use_lp):
+def get_medium_id(medium, mode):
+    if medium:
+        return medium
+    elif mode == "global":
+        return 'complete'
+    else:
+        return 'minimal'
+
+
+def medium_environment(medium, media_db, size):
+    """ Environment for a medium from the media library (for a community with *size* members). """
+
+    fmt_func = lambda x: "R_EX_M_{}_e_pool".format(x)
+    return Environment.from_compounds(media_db[medium], fmt_func=fmt_func, max_uptake=10.0 * size)
+
+
+def environment_params(medium_id, aerobic, min_mol_weight, use_lp):
+    """ Parameters that identify a complete or minimal environment in the result cache. """
+    return {'medium': medium_id, 'aerobic': aerobic, 'min_mol_weight': min_mol_weight, 'use_lp': use_lp}
+
+
+def define_environment(medium, media_db, community, mode, aerobic, verbose, min_mol_weight, use_lp, cache=None,
+                       budget=None):
     max_uptake = 10.0 * len(community.organisms)
+    medium_id = get_medium_id(medium, mode)
 
     if medium:
-        fmt_func = lambda x: "R_EX_M_{}_e_pool".format(x)
-        env = Environment.from_compounds(media_db[medium], fmt_func=fmt_func, max_uptake=max_uptake)
-        medium_id = medium
-    elif mode == "global":
+        return medium_id, medium_environment(medium, media_db, len(community.organisms))
+
+    def complete():
         env = Environment.complete(community.merged, max_uptake=max_uptake)
-        medium_id = 'complete'
 
         if aerobic is not None and aerobic:
             env["R_EX_M_o2_e_pool"] = (-max_uptake, inf)
@@ -122,23 +232,70 @@ def define_environment(medium, media_db, community, mode, aerobic, verbose, min_
         if aerobic is not None and not aerobic:
             env["R_EX_M_o2_e_pool"] = (0, inf)
 
-    else:
-        env = minimal_environment(community, aerobic, verbose=verbose, min_mol_weight=min_mol_weight,
-                                  use_lp=use_lp, max_uptake=max_uptake)
-        medium_id = "minimal"
+        return env
+
+    def minimal():
+        return minimal_environment(community, aerobic, verbose=verbose, min_mol_weight=min_mol_weight,
+                                   use_lp=use_lp, max_uptake=max_uptake)
+
+    params = environment_params(medium_id, aerobic, min_mol_weight, use_lp)
+    env = cached(cache, 'environment', list(community.organisms), None, params,
+                 complete if mode == "global" else minimal, budget)
 
     return medium_id, env
 
 
-def run_global(comm_id, community, organisms, medium_id, excluded_mets, env, verbose, min_mol_weight, use_lp, debug):
+def cached_environment(cache, organisms, medium, media_db, mode, aerobic, min_mol_weight, use_lp):
+    """ Get the environment of a community without loading it (from the result cache, unless it is a named medium).
+
+    Returns:
+        Environment: environment (None if it is not in the cache)
+    """
+
+    if medium:
+        return medium_environment(medium, media_db, len(organisms))
+
+    params = environment_params(get_medium_id(medium, mode), aerobic, min_mol_weight, use_lp)
+    return cache.get(cache.key('environment', organisms, None, params))
+
+
+def score_params(mode, excluded_mets, min_mol_weight, use_lp, scs_args=None, mus_args=None, ignore_coupling=False):
+    """ Scores calculated for a block of results, with the parameters that identify them in the result cache.
+
+    Returns:
+        dict: parameters of each score
+    """
+
+    if mode == "global":
+        params = {'min_mol_weight': min_mol_weight, 'use_lp': use_lp, 'exclude': sorted(excluded_mets)}
+        return {'mip': params, 'mro': params}
+
+    scores = {} if ignore_coupling else {'scs': scs_args or {}}
+    scores['mus'] = dict(mus_args or {}, min_mol_weight=min_mol_weight)
+    scores['mps'] = {}
+
+    return scores
+
+
+def block_cached(cache, organisms, env, scores):
+    """ Check if all the scores of a block of results (as given by *score_params*) are in the result cache. """
+    return all(cache.key(score, organisms, env, params) in cache for score, params in scores.items())
+
+
+def run_global(comm_id, community, organisms, medium_id, excluded_mets, env, verbose, min_mol_weight, use_lp, debug,
+               workers=None, cache=None, profiler=None, budget=None):
     global_data = []
     debug_data = []
+    members = list(organisms)
+    params = score_params("global", excluded_mets, min_mol_weight, use_lp)
 
     if verbose:
         print('Running MIP for community {} on medium {}...'.format(comm_id, medium_id))
 
-    mip, extras = mip_score(community, environment=env, verbose=verbose,
-                            min_mol_weight=min_mol_weight, use_lp=use_lp, exclude=excluded_mets)
+    with profiled(profiler, comm_id, medium_id, 'mip'):
+        mip, extras = cached(cache, 'mip', members, env, params['mip'], lambda: mip_score(
+            community, environment=env, verbose=verbose, min_mol_weight=min_mol_weight, use_lp=use_lp,
+            exclude=excluded_mets), budget)
 
     if mip is None:
         mip = 'n/a'
@@ -152,8 +309,10 @@ def run_global(comm_id, community, organisms, medium_id, excluded_mets, env, ver
     if verbose:
         print('Running MRO for community {} on medium {}...'.format(comm_id, medium_id))
 
-    mro, extras = mro_score(community, environment=env, verbose=verbose,
-                            min_mol_weight=min_mol_weight, use_lp=use_lp, exclude=excluded_mets)
+    with profiled(profiler, comm_id, medium_id, 'mro'):
+        mro, extras = cached(cache, 'mro', members, env, params['mro'], lambda: mro_score(
+            community, environment=env, verbose=verbose, min_mol_weight=min_mol_weight, use_lp=use_lp,
+            exclude=excluded_mets, workers=workers), budget)
 
     if mro is None:
         mro = 'n/a'
@@ -165,35 +324,81 @@ def run_global(comm_id, community, organisms, medium_id, excluded_mets, env, ver
             org_medium = ','.join(sorted(values))
             debug_data.append((comm_id, medium_id, 'mro', org, org_medium))
 
-    global_data.append((comm_id, medium_id, len(organisms), mip, mro))
+    if budget is None:
+        global_data.append((comm_id, medium_id, len(organisms), mip, mro))
+    else:
+        global_data.append((comm_id, medium_id, len(organisms), mip, mro, budget.pop_reason()))
 
     return global_data, debug_data
 
 
-def run_detailed(comm_id, community, medium_id, excluded_mets, env, verbose, min_mol_weight, ignore_coupling):
+def run_detailed(comm_id, community, medium_id, excluded_mets, env, verbose, min_mol_weight, ignore_coupling,
+                 session=None, scs_args=None, workers=None, cache=None, profiler=None, budget=None, mus_args=None,
+                 organisms=None):
     smt_data = []
 
+    if scs_args is None:
+        scs_args = {}
+
+    if mus_args is None:
+        mus_args = {}
+
+    # with the member ids given, the community is only used for the scores missing from the cache
+    members = list(community.organisms) if organisms is None else list(organisms)
+    params = score_params("detailed", excluded_mets, min_mol_weight, None, scs_args, mus_args, ignore_coupling)
+
     exclude_bigg = {'M_{}_e'.format(x) for x in excluded_mets}
 
     if not ignore_coupling:
         if verbose:
             print('Running SCS for community {} on medium {}...'.format(comm_id, medium_id))
 
-        scs = sc_score(community, environment=env, verbose=verbose)
+        def run_scs():
+            stats = {}
+            scores = sc_score(community, environment=env, verbose=verbose, session=session, stats=stats,
+                              workers=workers, **scs_args)
+            return scores, stats
+
+        with profiled(profiler, comm_id, medium_id, 'scs'):
+            scs, scs_stats = cached(cache, 'scs', members, env, params['scs'], run_scs, budget)
+
+        if verbose and scs_stats:
+            n_solutions = [x['solutions'] for x in scs_stats.values()]
+            sizes = [x[key] for x in scs_stats.values() for key in ('min_donors', 'max_donors') if x[key] is not None]
+            print('SCS: used {}-{} solutions per organism (donor set size {}-{})'.format(
+                min(n_solutions), max(n_solutions), min(sizes, default='n/a'), max(sizes, default='n/a')))
 
     if verbose:
         print('Running MUS for community {} on medium {}...'.format(comm_id, medium_id))
 
-    mus = mu_score(community, environment=env, verbose=verbose,
-                   min_mol_weight=min_mol_weight)
+    def run_mus():
+        stats = {}
+        scores = mu_score(community, environment=env, verbose=verbose, min_mol_weight=min_mol_weight,
+                          session=session, workers=workers, stats=stats, **mus_args)
+        return scores, stats
+
+    with profiled(profiler, comm_id, medium_id, 'mus'):
+        mus, mus_stats = cached(cache, 'mus', members, env, params['mus'], run_mus, budget)
+
+    if verbose and mus_stats:
+        n_solutions = [x['solutions'] for x in mus_stats.values()]
+        print('MUS: used {}-{} solutions per organism'.format(min(n_solutions), max(n_solutions)))
 
     if verbose:
         print('Running MPS for community {} on medium {}...'.format(comm_id, medium_id))
 
-    mps = mp_score(community, environment=env)
+    def run_mps():
+        stats = {}
+        scores = mp_score(community, environment=env, session=session, stats=stats)
+        return scores, stats
 
-    pairs = [(org1, org2) for org1 in community.organisms
-             for org2 in community.organisms if org1 != org2]
+    with profiled(profiler, comm_id, medium_id, 'mps'):
+        mps, mps_stats = cached(cache, 'mps', members, env, params['mps'], run_mps, budget)
+
+    if verbose:
+        print('MPS: solved {lps} LPs ({lps_saved} saved)'.format(**mps_stats))
+
+    pairs = [(org1, org2) for org1 in members for org2 in members if org1 != org2]
 
     for org1, org2 in pairs:
         if not ignore_coupling and scs[org1] is None:
@@ -215,16 +420,85 @@ def run_detailed(comm_id, community, medium_id, excluded_mets, env, verbose, min
             else:
                 scs_o1_o2 = scs[org1][org2]
                 smt = scs_o1_o2 * mus_o1_met * mps_o2_met
-            smt_data.append((comm_id, medium_id, org1, org2, met, scs_o1_o2, mus_o1_met, mps_o2_met, smt))
+            entry = (comm_id, medium_id, org1, org2, met, scs_o1_o2, mus_o1_met, mps_o2_met, smt)
+
+            if scs_args.get('convergence_tol') is not None:
+                entry += (None if ignore_coupling else scs_stats[org1]['solutions'],)
+
+            if mus_args.get('convergence_tol') is not None:
+                entry += (mus_stats[org1]['solutions'],)
+
+            smt_data.append(entry)
+
+    if budget is not None:
+        reason = budget.pop_reason()
+        if reason and not smt_data:
+            n_extra = len(extra_columns("detailed", scs_args, mus_args))
+            return timeout_entries("detailed", comm_id, medium_id, len(members), reason, n_extra)
+        smt_data = [entry + (reason,) for entry in smt_data]
 
     return smt_data
 
 
-def run_abiotic(comm_id, sense, community, medium_id, excluded_mets, env, verbose, min_mol_weight, other_mets, n, p,
-                ignore_coupling):
+def extra_columns(mode, scs_args=None, mus_args=None, budgets=False):
+    """ Optional result columns (appended to the standard ones) used with the given options. """
+
+    columns = []
+
+    if mode != "global" and scs_args and scs_args.get('convergence_tol') is not None:
+        columns.append('scs_solutions')
+
+    if mode != "global" and mus_args and mus_args.get('convergence_tol') is not None:
+        columns.append('mus_solutions')
+
+    if budgets:
+        columns.append('reason')
+
+    return columns
+
+
+def timeout_entries(mode, comm_id, medium_id, size, reason, n_extra=0):
+    """ Placeholder result entries for a block that could not be scored within the time budget (*n_extra* is the
+    number of optional columns before the reason). """
+
+    padding = (None,) * n_extra
+
+    if mode == "global":
+        return [(comm_id, medium_id, size, 'n/a', 'n/a') + padding + (reason,)]
+
+    return [(comm_id, medium_id, None, None, None, 'n/a', 'n/a', 'n/a', 'n/a') + padding + (reason,)]
+
+
+def run_block(budget, mode, comm_id, medium_id, size, func, n_extra=0):
+    """ Calculate a block of results (with *func*) within the time budget of the community (if any).
+
+    Returns:
+        tuple: entries and debug entries (placeholders if the community budget runs out)
+    """
+
+    if budget is None:
+        return func()
+
+    if not budget.exhausted:
+        try:
+            return func()
+        except TimeLimitExceeded:
+            pass
+
+    budget.pop_reason()
+    return timeout_entries(mode, comm_id, medium_id, size, 'community time limit', n_extra), []
+
+
+def abiotic_perturbations(sense, community, medium_id, excluded_mets, env, verbose, other_mets, n, p):
+    """ Generate abiotic perturbations as (perturbation id, environment) pairs.
+
+    The first pair is the unperturbed environment (with perturbation id None). Perturbed environments are derived
+    from the complete medium by only adding (or removing) the exchange reactions of the perturbed compounds.
+    """
 
     medium = set(env.get_compounds(fmt_func=lambda x: x[7:-7]))
     max_uptake = 10.0 * len(community.organisms)
+    exchange_id = lambda x: f"R_EX_M_{x}_e_pool"
 
     if sense == 'add':
         modified = sorted(other_mets - (medium | excluded_mets))
@@ -234,7 +508,7 @@ def run_abiotic(comm_id, sense, community, medium_id, excluded_mets, env, verbos
         n_extra_cpds = 2*p
         modified = sample(modified, n_extra_cpds)
         medium = medium | set(modified)
-        env = Environment.from_compounds(medium, fmt_func=lambda x: f"R_EX_M_{x}_e_pool",  max_uptake=max_uptake)
+        env = Environment.from_compounds(medium, fmt_func=exchange_id,  max_uptake=max_uptake)
 
     if len(modified) < p:
         raise RuntimeError("Insufficient compounds ({}) to perform ({}) perturbations.".format(len(modified), p))
@@ -249,33 +523,38 @@ def run_abiotic(comm_id, sense, community, medium_id, excluded_mets, env, verbos
         if verbose:
             print('Running {} random abiotic perturbations with {} compounds...'.format(n, p))
 
-    data = run_detailed(comm_id, community, medium_id, excluded_mets, env, False, min_mol_weight, ignore_coupling)
+    yield None, env
+
+    reference = Environment.from_compounds(medium, fmt_func=exchange_id, max_uptake=max_uptake)
 
     for i in range(n):
         if do_all:
-            if sense == 'add':
-                new_compounds = list(medium) + [modified[i]]
-            if sense == 'rm':
-                new_compounds = medium - {modified[i]}
+            changed = [modified[i]]
             new_id = "{}_{}".format(medium_id, modified[i])
         else:
+            changed = sample(modified, p)
+            new_id = "{}_{}".format(medium_id, i + 1)
+
+        new_env = Environment()
+        new_env.update(reference)
+
+        for cpd in changed:
             if sense == 'add':
-                new_compounds = list(medium) + sample(modified, p)
+                new_env[exchange_id(cpd)] = (-max_uptake, inf)
             if sense == 'rm':
-                new_compounds = medium - set(sample(modified, p))
-            new_id = "{}_{}".format(medium_id, i + 1)
+                new_env.pop(exchange_id(cpd), None)
 
-        new_env = Environment.from_compounds(new_compounds, fmt_func=lambda x: f"R_EX_M_{x}_e_pool",
-                                             max_uptake=max_uptake)
-        entries = run_detailed(comm_id, community, new_id, excluded_mets, new_env, False, min_mol_weight,
-                               ignore_coupling)
-        data.extend(entries)
+        yield new_id, new_env
 
-    return data
 
+def biotic_perturbations(comm_id, community, verbose, other_models, model_cache, n, p):
+    """ Generate biotic perturbations as (perturbation id, community) pairs.
+
+    The first pair is the unperturbed community (with perturbation id None). Perturbed communities are obtained by
+    appending the inserted species to the merged model of the original community, which are removed again once the
+    caller asks for the next perturbation (so the yielded community is only valid until then).
+    """
 
-def run_biotic(comm_id, community, medium_id, excluded_mets, env, verbose, min_mol_weight, other_models, model_cache,
-               n, p, ignore_coupling):
     inserted = sorted(other_models - set(community.organisms))
 
     if len(inserted) < p:
@@ -292,100 +571,304 @@ def run_biotic(comm_id, community, medium_id, excluded_mets, env, verbose, min_m
         if verbose:
             print('Running {} random biotic perturbations with {} species...'.format(n, p))
 
-    data = run_detailed(comm_id, community, medium_id, excluded_mets, env, False, min_mol_weight, ignore_coupling)
+    yield None, community
+
+    base = community.variant(create_biomass=False)
+    base.merged
 
     for i in range(n):
         if do_all:
-            new_species = list(community.organisms) + [inserted[i]]
+            new_species = [inserted[i]]
             new_id = "{}_{}".format(comm_id, inserted[i])
         else:
-            new_species = list(community.organisms) + sample(inserted, p)
+            new_species = sample(inserted, p)
             new_id = "{}_{}".format(comm_id, i + 1)
 
-        comm_models = [model_cache.get_model(org_id, reset_id=True) for org_id in new_species]
-        new_community = Community(comm_id, comm_models, copy_models=False, create_biomass=False)
-        entries = run_detailed(new_id, new_community, medium_id, excluded_mets, env, False, min_mol_weight,
-                               ignore_coupling)
-        data.extend(entries)
+        for org_id in new_species:
+            base.add_organism(model_cache.get_model(org_id, reset_id=True), copy=False, incremental=True)
+
+        try:
+            yield new_id, base
+        finally:
+            for org_id in reversed(new_species):
+                base.remove_organism(org_id, incremental=True)
+
+
+def run_community(comm_id, organisms, model_cache, mode, media, media_db, excluded_mets, other_mets, other_models,
+                  aerobic, verbose, min_mol_weight, use_lp, debug, n, p, ignore_coupling, done=None,
+                  fragment_cache=None, scs_args=None, organism_processes=1, cache=None, profiler=None,
+                  solve_time_limit=None, community_time_limit=None, mus_args=None):
+    """ Run all media (and perturbations) for one community.
+
+    Yields (key, entries, debug_entries) as each block is finished, where key is a (community, medium, perturbation)
+    tuple. Blocks whose key is in *done* are skipped. Organism fragments are reused through *fragment_cache*.
+    With *organism_processes* > 1, the per-organism problems of the community are solved by a pool of workers.
+    Scores found in the result *cache* (if given) are not recalculated, and in global or detailed mode the community
+    is only loaded (and merged) once a block of results is not fully cached.
+    If a *profiler* is given, the time (and solver calls) of each stage are recorded in it.
+    With time limits (per solve and/or for the whole community, in seconds), scores that reach a limit are reported
+    as n/a (or their best partial result) with the reason in an extra column, and the run moves on.
+    """
+
+    if done is None:
+        done = set()
+
+    if mode in ("global", "detailed"):
+        keys = {(comm_id, get_medium_id(medium, mode), '') for medium in media}
+        if keys <= done:
+            return
+
+    def load_community():
+        if verbose:
+            print("Loading community: " + comm_id)
+
+        with profiled(profiler, comm_id, None, 'load'):
+            comm_models = [model_cache.get_model(org_id, reset_id=True) for org_id in organisms]
 
-    return data
+        community = Community(comm_id, comm_models, copy_models=False, fragment_cache=fragment_cache)
 
+        if profiler is not None:
+            # merge now (instead of lazily in the first score) to profile it separately
+            with profiler.stage(comm_id, None, 'merge'):
+                community.merged
 
-def export_results(mode, output, data, debug_data, zeros):
-    prefix = output + '_' if output else ''
+        workers = OrganismPool(community, organism_processes) if organism_processes > 1 else None
+        return community, workers
 
-    if mode == "global":
+    # with a result cache, blocks of global or detailed results are first looked up without loading the community
+    lazy = cache is not None and mode in ("global", "detailed")
+    community, workers = (None, None) if lazy else load_community()
+    session = SolverSession()
 
-        df = pd.DataFrame(data, columns=['community', 'medium', 'size', "mip", "mro"])
-        df.to_csv(prefix + 'global.tsv', sep='\t', index=False)
+    budget = None
+    if solve_time_limit is not None or community_time_limit is not None:
+        budget = TimeBudget(solve_time_limit, community_time_limit)
+        budget.start()
 
-        if len(debug_data) > 0:
-            df = pd.DataFrame(debug_data, columns=['community', 'medium', 'key1', "key2", "data"])
-            df.to_csv(prefix + 'debug.tsv', sep='\t', index=False)
+    n_extra = len(extra_columns(mode, scs_args, mus_args))
 
-    else:
+    try:
+        for medium in media:
+            medium_id = get_medium_id(medium, mode)
+
+            if mode in ("global", "detailed") and (comm_id, medium_id, '') in done:
+                continue
+
+            env = None
+            if community is None:
+                env = cached_environment(cache, organisms, medium, media_db, mode, aerobic, min_mol_weight, use_lp)
+                scores = score_params(mode, excluded_mets, min_mol_weight, use_lp, scs_args, mus_args, ignore_coupling)
+                if env is None or not block_cached(cache, organisms, env, scores):
+                    community, workers = load_community()
+
+            timeouts = budget.timeouts if budget is not None else 0
+
+            if env is None:
+                try:
+                    with profiled(profiler, comm_id, medium_id, 'environment'):
+                        medium_id, env = define_environment(medium, media_db, community, mode, aerobic, verbose,
+                                                            min_mol_weight, use_lp, cache, budget)
+                except TimeLimitExceeded:
+                    env = None
+
+            if budget is not None and (budget.exhausted or budget.timeouts > timeouts):
+                budget.pop_reason()
+                reason = 'community time limit' if budget.exhausted else 'environment: time limit'
+                entries = timeout_entries(mode, comm_id, medium_id, len(organisms), reason, n_extra)
+                yield (comm_id, medium_id, ''), entries, []
+                continue
 
-        columns = ['community', 'medium', 'receiver', 'donor', 'compound', 'scs', 'mus', 'mps', 'smetana']
-        df = pd.DataFrame(data, columns=columns)
+            if mode == "global":
+                entries, debug_entries = run_block(budget, mode, comm_id, medium_id, len(organisms), lambda: run_global(
+                    comm_id, community, organisms, medium_id, excluded_mets, env, verbose, min_mol_weight, use_lp,
+                    debug, workers, cache, profiler, budget))
+                yield (comm_id, medium_id, ''), entries, debug_entries if debug else []
 
-        if not zeros:
-            df = df.query('smetana > 0')
+            if mode == "detailed":
+                entries, _ = run_block(budget, mode, comm_id, medium_id, len(organisms), lambda: (run_detailed(
+                    comm_id, community, medium_id, excluded_mets, env, verbose, min_mol_weight, ignore_coupling,
+                    session, scs_args, workers, cache, profiler, budget, mus_args, organisms), []), n_extra)
+                yield (comm_id, medium_id, ''), entries, []
+
+            if mode in ("abiotic", "abiotic-rm"):
+                sense = 'add' if mode == "abiotic" else 'rm'
+                perturbations = abiotic_perturbations(sense, community, medium_id, excluded_mets, env, verbose,
+                                                      other_mets, n, p)
+                for new_id, new_env in perturbations:
+                    key = (comm_id, medium_id, new_id or '')
+                    if key in done:
+                        continue
+                    # problems stay loaded, only the bounds of the perturbed compounds change
+                    entries, _ = run_block(budget, mode, comm_id, new_id or medium_id, len(organisms), lambda: (
+                        run_detailed(comm_id, community, new_id or medium_id, excluded_mets, new_env, False,
+                                     min_mol_weight, ignore_coupling, session, scs_args, workers, cache, profiler,
+                                     budget, mus_args), []), n_extra)
+                    yield key, entries, []
 
-        df.to_csv(prefix + 'detailed.tsv', sep='\t', index=False)
+            if mode == "biotic":
+                perturbations = biotic_perturbations(comm_id, community, verbose, other_models, model_cache, n, p)
+                for new_id, new_community in perturbations:
+                    key = (comm_id, medium_id, new_id or '')
+                    if key in done:
+                        continue
+                    # perturbed communities change the merged model of the base variant in place, so the problems
+                    # loaded for it (in the session or in the workers) cannot be reused
+                    base = new_id is None
+                    entries, _ = run_block(budget, mode, new_id or comm_id, medium_id, len(organisms), lambda: (
+                        run_detailed(new_id or comm_id, new_community, medium_id, excluded_mets, env, False,
+                                     min_mol_weight, ignore_coupling, session if base else None, scs_args,
+                                     workers if base else None, cache, profiler, budget, mus_args), []), n_extra)
+                    yield key, entries, []
+    finally:
+        if budget is not None:
+            budget.stop()
+        if workers is not None:
+            workers.close()
+
+
+_worker_cache = None
+_worker_fragments = None
+_worker_args = None
+_worker_profiler = None
+
+
+def _init_worker(models, flavor, run_args, max_fragments=100, cache_args=None, profile=False, max_fragments_mb=None,
+                 warm=None):
+    global _worker_cache, _worker_fragments, _worker_args, _worker_profiler
+    _worker_cache = build_cache(models, flavor, **(cache_args or {}))
+    _worker_fragments = FragmentCache(max_fragments, max_fragments_mb)
+    if warm:
+        warm_fragments(_worker_cache, _worker_fragments, warm, run_args['mode'])
+    _worker_args = run_args
+    _worker_profiler = Profiler() if profile else None
+
+
+def _run_blocks(results, profiler):
+    """ Attach the timings recorded by *profiler* (if any) to each block yielded by run_community. """
+
+    for key, entries, debug_entries in results:
+        timings = profiler.pop() if profiler is not None else []
+        yield key, entries, debug_entries, timings
+
+
+def _run_worker(job):
+    comm_id, organisms = job
+    results = run_community(comm_id, organisms, _worker_cache, fragment_cache=_worker_fragments,
+                            profiler=_worker_profiler, **_worker_args)
+    return list(_run_blocks(results, _worker_profiler))
 
 
 def main(models, communities=None, mode=None, output=None, flavor=None, media=None, mediadb=None, aerobic=None,
          zeros=False,verbose=False, min_mol_weight=False, use_lp=False, exclude=None, debug=False,
-         other=None, n=1, p=1, ignore_coupling=False):
+         other=None, n=1, p=1, ignore_coupling=False, processes=1, chunksize=None, resume=False, checkpoint=False,
+         scs_pool=False, pool_size=100, pool_gap=0.5, seed=None, scs_formulation='full', organism_processes=1,
+         pairwise=False, cache_dir=None, cache_size=1024, max_models=None, max_models_size=None, profile=False,
+         solve_time_limit=None, community_time_limit=None, scs_tol=None, scs_window=10, mus_tol=None, mus_window=10,
+         mus_max_solutions=100, max_fragments_size=None):
+
+    models = find_models(models)
 
     other_models = other if mode == "biotic" else None
-    model_cache, comm_dict, other_models = load_communities(models, communities, other_models, flavor)
+
+    cache_args = {'max_models': max_models, 'max_size': max_models_size}
+    model_cache, comm_dict, other_models = load_communities(models, communities, other_models, flavor, **cache_args)
 
     other_mets = other if mode == "abiotic" or mode == 'abiotic-rm' else None
     media, media_db, excluded_mets, other_mets = load_media(media, mediadb, exclude, other_mets)
 
-    data = []
-    debug_data = []
-
-    for comm_id, organisms in list(comm_dict.items()):
-
-        if verbose:
-            print("Loading community: " + comm_id)
-
-        comm_models = [model_cache.get_model(org_id, reset_id=True) for org_id in organisms]
-        community = Community(comm_id, comm_models, copy_models=False)
-
-        for medium in media:
-
-            medium_id, env = define_environment(medium, media_db, community, mode, aerobic, verbose, min_mol_weight, use_lp)
+    run_args = {
+        'mode': mode, 'media': media, 'media_db': media_db, 'excluded_mets': excluded_mets,
+        'other_mets': other_mets, 'other_models': other_models, 'aerobic': aerobic, 'verbose': verbose,
+        'min_mol_weight': min_mol_weight, 'use_lp': use_lp, 'debug': debug, 'n': n, 'p': p,
+        'ignore_coupling': ignore_coupling,
+        'scs_args': {'use_pool': scs_pool, 'n_solutions': pool_size, 'pool_gap': pool_gap, 'seed': seed,
+                     'formulation': scs_formulation, 'convergence_tol': scs_tol, 'convergence_window': scs_window},
+        'mus_args': {'n_solutions': mus_max_solutions, 'convergence_tol': mus_tol, 'convergence_window': mus_window},
+        'organism_processes': organism_processes,
+        'solve_time_limit': solve_time_limit,
+        'community_time_limit': community_time_limit,
+    }
+
+    budgets = solve_time_limit is not None or community_time_limit is not None
+
+    if cache_dir is not None:
+        if isinstance(getattr(model_cache, 'source', model_cache), ModelStore):
+            model_files, digests = {}, model_cache.digests()
+        else:
+            model_files, digests = {extract_id_from_filepath(model): model for model in models}, None
+        run_args['cache'] = ResultCache(cache_dir, model_files, max_size=cache_size, digests=digests)
 
-            if mode == "global":
-                entries, debug_entries = run_global(comm_id, community, organisms, medium_id, excluded_mets, env,
-                                                    verbose, min_mol_weight, use_lp, debug)
+    if pairwise:
+        if communities is not None:
+            raise RuntimeError('Pairwise mode can not be used with a communities file.')
 
-            if mode == "detailed":
-                entries = run_detailed(comm_id, community, medium_id, excluded_mets, env, verbose, min_mol_weight,
-                                       ignore_coupling)
+        # every organism takes part in many pairs: keep the models and fragments of all organisms in memory
+        # (one fragment per merging variant), and build the fragments before running the pairs
+        org_ids = model_cache.get_ids()
+        jobs = pairwise_communities(org_ids)
+        n_jobs = len(org_ids) * (len(org_ids) - 1) // 2
+        max_fragments = max(100, len(_MODE_VARIANTS.get(mode, _DEFAULT_VARIANTS)) * len(org_ids))
+        warm = org_ids
 
-            if mode == "abiotic":
-                entries = run_abiotic(comm_id, 'add', community, medium_id, excluded_mets, env, verbose, min_mol_weight,
-                                      other_mets, n, p, ignore_coupling)
+        if verbose:
+            print('Running {} pairwise communities of {} organisms...'.format(n_jobs, len(org_ids)))
+    else:
+        jobs = list(comm_dict.items())
+        n_jobs = len(jobs)
+        max_fragments = 100
+        warm = None
+
+    # the checkpoint file is only written when asked for (resuming keeps extending it)
+    checkpoint = Checkpoint(output, resume, enabled=checkpoint or resume)
+    writer = ResultWriter(mode, output, zeros, offsets=checkpoint.offsets, profile=profile,
+                          extra_columns=extra_columns(mode, run_args['scs_args'], run_args['mus_args'], budgets))
+
+    if resume:
+        run_args['done'] = checkpoint.done
+        if verbose:
+            print('Resuming run: skipping {} finished entries...'.format(len(checkpoint)))
 
-            if mode == "abiotic-rm":
-                entries = run_abiotic(comm_id, 'rm', community, medium_id, excluded_mets, env, verbose, min_mol_weight,
-                                       other_mets, n, p, ignore_coupling)
+    if processes is not None and processes > 1 and organism_processes > 1:
+        raise RuntimeError('Communities and organisms can not be run in parallel at the same time.')
 
-            if mode == "biotic":
-                entries = run_biotic(comm_id, community, medium_id, excluded_mets, env, verbose, min_mol_weight,
-                                     other_models, model_cache, n, p, ignore_coupling)
+    if budgets and organism_processes > 1:
+        raise RuntimeError('Time limits can not be used when organisms are run in parallel.')
 
-            data.extend(entries)
+    if processes is not None and processes > 1 and n_jobs > 1:
+        processes = min(processes, n_jobs)
 
-            if debug:
-                debug_data.extend(debug_entries)
+        if chunksize is None:
+            chunksize = max(1, n_jobs // (4 * processes))
 
-    export_results(mode, output, data, debug_data, zeros)
+        if verbose:
+            print('Running {} communities on {} processes...'.format(n_jobs, processes))
+
+        # each worker loads its own model cache once; imap keeps results in submission order
+        with writer, checkpoint, Pool(processes, initializer=_init_worker,
+                                      initargs=(models, flavor, run_args, max_fragments, cache_args, profile,
+                                                max_fragments_size, warm)) as pool:
+            for results in pool.imap(_run_worker, jobs, chunksize=chunksize):
+                for key, entries, debug_entries, timings in results:
+                    writer.write(entries, debug_entries, timings)
+                    checkpoint.add(key, writer.tell())
+    else:
+        fragment_cache = FragmentCache(max_fragments, max_fragments_size)
+        profiler = Profiler() if profile else None
+        if warm:
+            warm_fragments(model_cache, fragment_cache, warm, mode)
+        with writer, checkpoint:
+            for comm_id, organisms in jobs:
+                results = run_community(comm_id, organisms, model_cache, fragment_cache=fragment_cache,
+                                        profiler=profiler, **run_args)
+                for key, entries, debug_entries, timings in _run_blocks(results, profiler):
+                    writer.write(entries, debug_entries, timings)
+                    checkpoint.add(key, writer.tell())
+
+    if verbose and cache_dir is not None and run_args['cache'].hits + run_args['cache'].misses > 0:
+        print('Result cache: {} hits, {} misses'.format(run_args['cache'].hits, run_args['cache'].misses))
+
+    if verbose and isinstance(model_cache, BoundedModelCache) and model_cache.hits + model_cache.misses > 0:
+        print('Model cache: {} hits, {} misses'.format(model_cache.hits, model_cache.misses))
 
     if verbose:
         print('Done.')
-
@@ -1,10 +1,60 @@
 from collections import OrderedDict
+import numpy as np
 from reframed.core.cbmodel import CBModel, CBReaction
 from reframed.core.model import Compartment, Metabolite, ReactionType
 from reframed.core.model import AttrOrderedDict
 from warnings import warn
-from copy import deepcopy
+from copy import copy, deepcopy
 from math import inf
+from smetana.arrays import CommunityArrays
+
+
+def _id_pattern(object_id, organism_id):
+    return "{}_{}".format(object_id, organism_id)
+
+
+def _name_pattern(object_name, organism_name):
+    return "{} ({})".format(object_name, organism_name)
+
+
+def _clone(obj, new_id, new_name, compartment=None):
+    """ Shallow copy of a model object (compartment, metabolite or reaction) under a new id.
+
+    Mutable attributes (metadata, regulators and gene-protein-reaction rules) are copied, so the clone never shares
+    state with the original model. The stoichiometry of reactions is rebuilt by the caller.
+    """
+    new_obj = copy(obj)
+    new_obj.id = new_id
+    new_obj.name = new_name
+    new_obj.metadata = obj.metadata.copy()
+
+    if compartment:
+        new_obj.compartment = compartment
+
+    if hasattr(obj, 'stoichiometry'):
+        new_obj.regulators = obj.regulators.copy()
+        if obj.gpr is not None:
+            new_obj.gpr = deepcopy(obj.gpr)
+
+    return new_obj
+
+
+def _copy_reaction(rxn):
+    """ Copy of a fragment reaction for a merged model (attributes and stoichiometry can then be changed freely). """
+    new_rxn = copy(rxn)
+    new_rxn.stoichiometry = OrderedDict(rxn.stoichiometry)
+    new_rxn.metadata = rxn.metadata.copy()
+    new_rxn.regulators = rxn.regulators.copy()
+    if rxn.gpr is not None:
+        new_rxn.gpr = deepcopy(rxn.gpr)
+    return new_rxn
+
+
+def _copy_object(obj):
+    """ Copy of a fragment compartment or metabolite for a merged model (attributes can then be changed freely). """
+    new_obj = copy(obj)
+    new_obj.metadata = obj.metadata.copy()
+    return new_obj
 
 
 class CommunityNameMapping(object):
@@ -37,6 +87,105 @@ class CommunityNameMapping(object):
                                self.community_exchange_reaction)
 
 
+(COMPARTMENT, METABOLITE, REACTION, POOL, POOL_BLACKLIST,
+ SHARED_COMPARTMENT, SHARED_METABOLITE, SHARED_REACTION) = range(8)
+
+
+class OrganismFragment(object):
+    """
+    Namespaced (renamed) objects of a single organism, ready to be stitched into a merged community model.
+
+    The items list keeps the insertion order of the merged model. Fragments only depend on the organism model and
+    the community flags, so they can be reused across communities (see FragmentCache).
+    """
+
+    def __init__(self, org_id):
+        self.org_id = org_id
+        self.items = []
+        self.reactions = []
+        self.exchange_reactions = {}
+        self.biomass_reaction = None
+        self.biomass_metabolite = None
+
+
+def estimate_fragment_size(fragment):
+    """ Rough estimate of the memory used by a fragment (in bytes), on the same scale as store.estimate_model_size. """
+
+    size = 0
+
+    for kind, obj in fragment.items:
+        if kind == REACTION:
+            size += 2000 + 200 * len(obj.stoichiometry)
+        elif kind == SHARED_REACTION:
+            size += 2000 + 200 * len(obj[0].stoichiometry)
+        elif kind in (METABOLITE, SHARED_METABOLITE, POOL, POOL_BLACKLIST):
+            size += 1000
+
+    return size
+
+
+class FragmentCache(object):
+    """
+    LRU cache of organism fragments shared by multiple communities.
+
+    Fragments are keyed by organism id and community flags, so models are assumed not to change while cached.
+    The least recently used fragments are evicted when their number or their estimated size exceeds the limits.
+    """
+
+    def __init__(self, max_size=100, max_mb=None):
+        """
+        Args:
+            max_size (int): maximum number of fragments kept in memory (default: 100)
+            max_mb (float): maximum (estimated) size of fragments kept in memory, in MB (optional)
+        """
+        self.max_size = max_size
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb is not None else None
+        self._fragments = OrderedDict()
+        self._sizes = {}
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        fragment = self._fragments.get(key)
+
+        if fragment is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._fragments.move_to_end(key)
+
+        return fragment
+
+    def add(self, key, fragment):
+        if key in self._fragments:
+            self._total -= self._sizes[key]
+
+        self._fragments[key] = fragment
+        self._fragments.move_to_end(key)
+        self._sizes[key] = estimate_fragment_size(fragment)
+        self._total += self._sizes[key]
+
+        # the most recently added fragment is always kept
+        while len(self._fragments) > 1 and (len(self._fragments) > self.max_size or
+                                            (self.max_bytes is not None and self._total > self.max_bytes)):
+            old_key, _ = self._fragments.popitem(last=False)
+            self._total -= self._sizes.pop(old_key)
+
+    @property
+    def size(self):
+        """ Estimated size of the fragments in memory (in bytes). """
+        return self._total
+
+    def clear(self):
+        self._fragments.clear()
+        self._sizes.clear()
+        self._total = 0
+
+    def __len__(self):
+        return len(self._fragments)
+
+
 class Community(object):
     """
     This class implements a microbial community model.
@@ -47,7 +196,7 @@ class Community(object):
 
     def __init__(self, community_id, models=None, copy_models=True,
                  merge_extracellular_compartments=False, create_biomass=True, interacting=True,
-                 exchanged_metabolites_blacklist=set()):
+                 exchanged_metabolites_blacklist=set(), fragment_cache=None):
         """
 
         Args:
@@ -60,6 +209,7 @@ class Community(object):
             interacting (bool): If true models will be able to exchange metabolites. Otherwise all produced metabolites will go to sink
             exchanged_metabolites_blacklist (set): List of metabolites that can not be exchanged between species. This is done
              by separating 'pool' (uptake) compartment and 'pool' ('export') compartments for certain metabolites.
+            fragment_cache (FragmentCache): reuse organism fragments across communities (optional)
         """
 
         if not interacting and merge_extracellular_compartments:
@@ -74,7 +224,12 @@ class Community(object):
         self._interacting = interacting
         self._organisms_exchange_reactions = {}
         self._organisms_biomass_reactions = {}
+        self._reaction_organisms = {}
         self._exchanged_metabolites_blacklist = set(exchanged_metabolites_blacklist)
+        self._fragment_cache = fragment_cache
+        self._variants = {}
+        self._arrays = None
+        self._extensions = []
 
         if models is not None:
             for model in models:
@@ -172,6 +327,19 @@ class Community(object):
 
         return self._organisms_biomass_reactions
 
+    @property
+    def reaction_organisms(self):
+        """
+        Returns dictionary with the organism of each organism-specific reaction in the merged model (shared
+        reactions, such as the pool exchange reactions, are not included)
+
+        Returns: dict
+        """
+        if not self._merged_model:
+            self._merged_model = self.generate_merged_model()
+
+        return self._reaction_organisms
+
     @property
     def merge_extracellular_compartments(self):
         """
@@ -204,6 +372,16 @@ class Community(object):
 
         return self._merged_model
 
+    @property
+    def arrays(self):
+        """
+        Array representation of the merged model (CSR stoichiometry, bounds and index arrays), built on demand.
+        Returns: CommunityArrays
+        """
+        if self._arrays is None:
+            self._arrays = CommunityArrays(self)
+        return self._arrays
+
     @property
     def organisms(self):
         """
@@ -215,19 +393,41 @@ class Community(object):
     def __str__(self):
         return '\n'.join(self._organisms.keys())
 
+    def __getstate__(self):
+        # the fragment cache is shared with other communities, don't send it to worker processes
+        state = self.__dict__.copy()
+        state['_fragment_cache'] = None
+        return state
+
     def _clear_merged_model(self):
         self._merged_model = None
         self._organisms_exchange_reactions = {}
         self._organisms_reactions = {}
+        self._reaction_organisms = {}
+        self._variants = {}
+        self._arrays = None
+        self._extensions = []
 
-    def add_organism(self, model, copy=True):
+    def add_organism(self, model, copy=True, incremental=False):
         """ Add an organism to this community.
 
+        With *incremental*, the organism is appended to the current merged model (and linked to the existing pool)
+        instead of discarding the merged model. It can then be removed again (see *remove_organism*), restoring the
+        previous merged model, which is useful to test the insertion of species in a community.
+
         Args:
             model (CBModel): model of the organism
             copy (bool): create a copy of the given model (default: True)
+            incremental (bool): extend the current merged model (default: False)
 
         """
+        if incremental and self._merged_model is not None and model.id not in self._organisms:
+            if copy:
+                model = model.copy()
+            self._extend_merged_model(model)
+            self._organisms[model.id] = model
+            return
+
         self._clear_merged_model()
 
         if model.id in self._organisms:
@@ -238,13 +438,23 @@ class Community(object):
 
             self._organisms[model.id] = model
 
-    def remove_organism(self, organism):
+    def remove_organism(self, organism, incremental=False):
         """ Remove an organism from this community
 
+        With *incremental*, if the organism was the last one added incrementally, its reactions and metabolites are
+        removed from the current merged model (restoring the merged model before it was added). Otherwise the
+        merged model is discarded.
+
         Args:
             organism (str): organism id
+            incremental (bool): update the current merged model (default: False)
 
         """
+        if incremental and self._extensions and self._extensions[-1][0] == organism:
+            self._retract_merged_model()
+            del self._organisms[organism]
+            return
+
         self._clear_merged_model()
 
         if organism not in self._organisms:
@@ -253,21 +463,6 @@ class Community(object):
             del self._organisms[organism]
 
     def generate_merged_model(self):
-        def _id_pattern(object_id, organism_id):
-            return "{}_{}".format(object_id, organism_id)
-
-        def _name_pattern(object_name, organism_name):
-            return "{} ({})".format(object_name, organism_name)
-
-        def _copy_object(obj, org_id, compartment=None):
-            new_obj = deepcopy(obj)
-            new_obj.id = _id_pattern(obj.id, org_id)
-            new_obj.name = _name_pattern(obj.name, org_id)
-            if compartment:
-                new_obj.compartment = compartment
-
-            return new_obj
-
         models_missing_biomass = [m.id for m in self._organisms.values() if not m.biomass_reaction]
         if models_missing_biomass:
             raise RuntimeError("Biomass reaction not found in models: {}".format("', '".join(models_missing_biomass)))
@@ -275,176 +470,14 @@ class Community(object):
         merged_model = CBModel(self.id)
 
         organisms_biomass_metabolites = {}
-        community_metabolite_exchange_lookup = {}
 
-        for org_id, model in self._organisms.items():
-            self._organisms_reactions[org_id] = []
-            self._organisms_exchange_reactions[org_id] = {}
-            self._organisms_biomass_reactions[org_id] = {}
-            exchanged_metabolites = {m_id for r_id in model.get_exchange_reactions()
-                                     for m_id in model.reactions[r_id].stoichiometry}
-            #
-            # Create additional extracellular compartment
-            #
-            if not self._merge_extracellular_compartments:
-                pool_compartment = Compartment('pool', 'common pool')
-                merged_model.add_compartment(pool_compartment)
-                export_pool_compartment = Compartment('pool_blacklist', 'blacklisted metabolite pool')
-                merged_model.add_compartment(export_pool_compartment)
-
-            for c_id, comp in model.compartments.items():
-                if not comp.external or not self._merge_extracellular_compartments:
-                    new_comp = _copy_object(comp, org_id)
-                    merged_model.add_compartment(new_comp)
-                elif c_id not in merged_model.compartments:
-                    merged_model.add_compartment(deepcopy(comp))
-
-            for m_id, met in model.metabolites.items():
-                if not model.compartments[met.compartment].external or not self._merge_extracellular_compartments:
-                    new_met = _copy_object(met, org_id, _id_pattern(met.compartment, org_id))
-                    merged_model.add_metabolite(new_met)
-                elif m_id not in merged_model.metabolites:
-                    merged_model.add_metabolite(deepcopy(met))
-
-                m_blacklisted = met.id in self._exchanged_metabolites_blacklist
-
-                if met.id in exchanged_metabolites and not self._merge_extracellular_compartments:
-                    #
-                    # For blacklisted metabolites create a separate pool from which metabolites can not be reuptaken
-                    #
-                    if m_blacklisted and self._interacting:
-                        pool_id = _id_pattern(m_id, "pool_blacklist")
-                        if pool_id not in merged_model.metabolites:
-                            new_met = _copy_object(met, "pool_blacklist", "pool_blacklist")
-                            merged_model.add_metabolite(new_met)
-
-                            exch_id = _id_pattern("R_EX_" + m_id, "pool_blacklist")
-                            exch_name = _name_pattern(met.name, "pool (blacklist) exchange")
-                            blk_rxn = CBReaction(exch_id, name=exch_name, reversible=False,
-                                                 reaction_type=ReactionType.SINK)
-                            blk_rxn.stoichiometry[pool_id] = -1.0
-                            community_metabolite_exchange_lookup[new_met.id] = exch_id
-                            merged_model.add_reaction(blk_rxn)
-
-                    pool_id = _id_pattern(m_id, "pool")
-                    if pool_id not in merged_model.metabolites:
-                        new_met = _copy_object(met, "pool", "pool")
-                        merged_model.add_metabolite(new_met)
-
-                        exch_id = _id_pattern("R_EX_" + m_id, "pool")
-                        exch_name = _name_pattern(met.name, "pool exchange")
-                        new_rxn = CBReaction(exch_id, name=exch_name, reversible=True,
-                                             reaction_type=ReactionType.EXCHANGE)
-                        new_rxn.stoichiometry[pool_id] = -1.0
-                        community_metabolite_exchange_lookup[new_met.id] = exch_id
-                        merged_model.add_reaction(new_rxn)
-
-            for r_id, rxn in model.reactions.items():
-
-                is_exchange = rxn.reaction_type == ReactionType.EXCHANGE
-
-                if not is_exchange or not self._merge_extracellular_compartments:
-                    new_rxn = _copy_object(rxn, org_id)
-
-                    for m_id, coeff in rxn.stoichiometry.items():
-                        m_blacklisted = m_id in self._exchanged_metabolites_blacklist
-                        if (not model.compartments[model.metabolites[m_id].compartment].external
-                                or not self._merge_extracellular_compartments):
-                            del new_rxn.stoichiometry[m_id]
-                            new_id = _id_pattern(m_id, org_id)
-                            new_rxn.stoichiometry[new_id] = coeff
-
-                        if is_exchange:
-                            new_rxn.reaction_type = ReactionType.OTHER
-                            if (model.compartments[model.metabolites[m_id].compartment].external
-                                    and not self._merge_extracellular_compartments):
-                                # TODO: if m_id in self._exchanged_metabolites_blacklist:
-                                pool_id = _id_pattern(m_id, "pool")
-                                new_rxn.stoichiometry[pool_id] = -coeff
-                                cnm = CommunityNameMapping(
-                                    organism_reaction=new_rxn.id,
-                                    original_reaction=r_id,
-                                    organism_metabolite=new_id,
-                                    extracellular_metabolite=pool_id,
-                                    original_metabolite=m_id,
-                                    community_exchange_reaction=community_metabolite_exchange_lookup[pool_id])
-                                self._organisms_exchange_reactions[org_id][new_rxn.id] = cnm
-
-                                if not self.interacting:
-                                    sink_rxn = CBReaction('Sink_{}'.format(new_id), reaction_type=ReactionType.SINK,
-                                                          reversible=False)
-                                    sink_rxn.stoichiometry = {new_id: -1}
-                                    sink_rxn.lb = 0.0
-                                    merged_model.add_reaction(sink_rxn)
-                                elif m_blacklisted:
-                                    pool_blacklist_id = _id_pattern(m_id, "pool_blacklist")
-                                    blacklist_export_rxn = CBReaction('R_EX_BLACKLIST_{}'.format(new_id),
-                                                                      reaction_type=ReactionType.OTHER,
-                                                                      reversible=False)
-                                    blacklist_export_rxn.stoichiometry = {new_id: -1, pool_blacklist_id: 1}
-                                    blacklist_export_rxn.lb = 0.0
-                                    merged_model.add_reaction(blacklist_export_rxn)
-
-                    if is_exchange and not self._merge_extracellular_compartments:
-                        new_rxn.reversible = True
-                        new_rxn.lb = -inf
-                        new_rxn.ub = inf if self.interacting and not m_blacklisted else 0.0
-
-                    if rxn.id == model.biomass_reaction:
-                        new_rxn.reversible = False
-
-                    if self._create_biomass and rxn.id == model.biomass_reaction:
-                        new_rxn.objective = False
-
-                        # Add biomass metabolite to biomass equation
-                        m_id = _id_pattern('Biomass', org_id)
-                        name = _name_pattern('Community biomass', org_id)
-                        comp = 'pool'
-                        biomass_met = Metabolite(m_id, name, comp)
-                        merged_model.add_metabolite(biomass_met)
-                        new_rxn.stoichiometry[m_id] = 1
-                        organisms_biomass_metabolites[org_id] = m_id
-
-                        sink_rxn = CBReaction('Sink_biomass_{}'.format(org_id), reaction_type=ReactionType.SINK,
-                                              reversible=False)
-                        sink_rxn.stoichiometry = {m_id: -1}
-                        sink_rxn.lb = 0.0
-                        merged_model.add_reaction(sink_rxn)
-
-                    self._organisms_reactions[org_id].append(new_rxn.id)
-                    merged_model.add_reaction(new_rxn)
-
-                else:
-                    if is_exchange and self._merge_extracellular_compartments:
-                        self._organisms_exchange_reactions[org_id][rxn.id] = CommunityNameMapping(
-                            organism_reaction=r_id,
-                            original_reaction=r_id,
-                            extracellular_metabolite=list(rxn.stoichiometry.keys())[0],
-                            original_metabolite=list(rxn.stoichiometry.keys())[0],
-                            organism_metabolite=None)
-                        self._organisms_reactions[org_id].append(rxn.id)
-
-                    if r_id in merged_model.reactions:
-                        continue
-
-                    new_rxn = deepcopy(rxn)
-                    new_rxn.reaction_type = ReactionType.EXCHANGE
-                    if rxn.id == model.biomass_reaction and self._create_biomass:
-                        new_rxn.reversible = False
-                        new_rxn.objective = False
-
-                        m_id = _id_pattern('Biomass', org_id)
-                        name = _name_pattern('Biomass', org_id)
-                        comp = 'pool'
-                        biomass_met = Metabolite(m_id, name, comp)
-                        merged_model.add_metabolite(biomass_met)
-                        new_rxn.stoichiometry[m_id] = 1
-                        organisms_biomass_metabolites[org_id] = m_id
-
-                    merged_model.add_reaction(new_rxn)
+        if self._organisms and not self._merge_extracellular_compartments:
+            merged_model.add_compartment(Compartment('pool', 'common pool'))
+            merged_model.add_compartment(Compartment('pool_blacklist', 'blacklisted metabolite pool'))
 
-                if r_id == model.biomass_reaction:
-                    self._organisms_biomass_reactions[org_id] = new_rxn.id
+        for org_id, model in self._organisms.items():
+            fragment = self.get_fragment(org_id, model)
+            self._stitch_fragment(merged_model, fragment, organisms_biomass_metabolites)
 
         if self._create_biomass:
             biomass_rxn = CBReaction('R_Community_Growth', name="Community Growth",
@@ -457,6 +490,319 @@ class Community(object):
 
         return merged_model
 
+    def _extend_merged_model(self, model):
+        """ Append one organism to the current merged model (recording what was added, so it can be reverted). """
+
+        if not model.biomass_reaction:
+            raise RuntimeError("Biomass reaction not found in models: {}".format(model.id))
+
+        merged_model = self._merged_model
+        org_id = model.id
+        organisms_biomass_metabolites = {}
+        added = []
+
+        fragment = self.get_fragment(org_id, model)
+        self._stitch_fragment(merged_model, fragment, organisms_biomass_metabolites, added)
+
+        growth_rxn = None
+        if self._create_biomass and org_id in organisms_biomass_metabolites:
+            growth_rxn = merged_model.reactions[merged_model.biomass_reaction]
+            new_growth_rxn = copy(growth_rxn)
+            new_growth_rxn.stoichiometry = OrderedDict(growth_rxn.stoichiometry)
+            new_growth_rxn.stoichiometry[organisms_biomass_metabolites[org_id]] = -1
+            merged_model.remove_reaction(growth_rxn.id)
+            merged_model.add_reaction(new_growth_rxn)
+            merged_model.biomass_reaction = new_growth_rxn.id
+
+        # cached variants are extended as well, instead of being merged again when requested
+        for variant in self._variants.values():
+            variant.add_organism(model, copy=False, incremental=True)
+
+        self._extensions.append((org_id, added, growth_rxn, self._arrays, set(self._variants)))
+        self._arrays = None
+
+    def _retract_merged_model(self):
+        """ Remove the last organism appended with *_extend_merged_model* from the merged model. """
+
+        org_id, added, growth_rxn, arrays, extended = self._extensions.pop()
+        merged_model = self._merged_model
+
+        reactions = [obj_id for kind, obj_id in added if kind == REACTION]
+        metabolites = [obj_id for kind, obj_id in added if kind == METABOLITE]
+        compartments = [obj_id for kind, obj_id in added if kind == COMPARTMENT]
+
+        merged_model.remove_reactions(reactions)
+        merged_model.remove_metabolites(metabolites)
+        for c_id in compartments:
+            merged_model.remove_compartment(c_id)
+
+        if growth_rxn is not None:
+            merged_model.remove_reaction(growth_rxn.id)
+            merged_model.add_reaction(growth_rxn)
+            merged_model.biomass_reaction = growth_rxn.id
+
+        for r_id in reactions:
+            self._reaction_organisms.pop(r_id, None)
+
+        del self._organisms_reactions[org_id]
+        del self._organisms_exchange_reactions[org_id]
+        del self._organisms_biomass_reactions[org_id]
+
+        self._arrays = arrays
+
+        # variants requested after the extension include the organism: discard them
+        self._variants = {key: variant for key, variant in self._variants.items() if key in extended}
+        for variant in self._variants.values():
+            variant.remove_organism(org_id, incremental=True)
+
+    def get_fragment(self, org_id, model):
+        """ Get the namespaced fragment of an organism (from the fragment cache if available).
+
+        Args:
+            org_id (str): organism id
+            model (CBModel): organism model
+
+        Returns:
+            OrganismFragment: organism fragment
+        """
+
+        if self._fragment_cache is None:
+            return self._build_fragment(org_id, model)
+
+        key = (org_id, self._interacting, self._merge_extracellular_compartments, self._create_biomass,
+               frozenset(self._exchanged_metabolites_blacklist))
+        fragment = self._fragment_cache.get(key)
+
+        if fragment is None:
+            fragment = self._build_fragment(org_id, model)
+            self._fragment_cache.add(key, fragment)
+
+        return fragment
+
+    def _build_fragment(self, org_id, model):
+        """ Create the (renamed) compartments, metabolites and reactions of one organism.
+
+        New objects are shallow clones of the original ones (only the attributes that change are rebuilt), and
+        renamed ids are computed once per organism. Objects shared with other organisms (pool metabolites and
+        exchange reactions) are recorded as fragment items and only created when the fragment is stitched.
+        """
+
+        merge_ext = self._merge_extracellular_compartments
+        blacklist = self._exchanged_metabolites_blacklist
+
+        fragment = OrganismFragment(org_id)
+        items = fragment.items
+        exchanged_metabolites = {m_id for r_id in model.get_exchange_reactions()
+                                 for m_id in model.reactions[r_id].stoichiometry}
+
+        external = {c_id: comp.external for c_id, comp in model.compartments.items()}
+        met_external = {m_id: external[met.compartment] for m_id, met in model.metabolites.items()}
+        renamed = {m_id: not met_external[m_id] or not merge_ext for m_id in model.metabolites}
+        new_met_ids = {m_id: _id_pattern(m_id, org_id) for m_id in model.metabolites}
+
+        for c_id, comp in model.compartments.items():
+            if not comp.external or not merge_ext:
+                new_comp = _clone(comp, _id_pattern(c_id, org_id), _name_pattern(comp.name, org_id))
+                items.append((COMPARTMENT, new_comp))
+            else:
+                items.append((SHARED_COMPARTMENT, _clone(comp, c_id, comp.name)))
+
+        for m_id, met in model.metabolites.items():
+            if renamed[m_id]:
+                new_met = _clone(met, new_met_ids[m_id], _name_pattern(met.name, org_id),
+                                 _id_pattern(met.compartment, org_id))
+                items.append((METABOLITE, new_met))
+            else:
+                items.append((SHARED_METABOLITE, _clone(met, m_id, met.name)))
+
+            m_blacklisted = m_id in blacklist
+
+            if m_id in exchanged_metabolites and not merge_ext:
+                #
+                # For blacklisted metabolites create a separate pool from which metabolites can not be reuptaken
+                #
+                if m_blacklisted and self._interacting:
+                    pool_id = _id_pattern(m_id, "pool_blacklist")
+                    new_met = _clone(met, pool_id, _name_pattern(met.name, "pool_blacklist"), "pool_blacklist")
+                    exch_id = _id_pattern("R_EX_" + m_id, "pool_blacklist")
+                    exch_name = _name_pattern(met.name, "pool (blacklist) exchange")
+                    items.append((POOL_BLACKLIST, (new_met, exch_id, exch_name)))
+
+                pool_id = _id_pattern(m_id, "pool")
+                new_met = _clone(met, pool_id, _name_pattern(met.name, "pool"), "pool")
+                exch_id = _id_pattern("R_EX_" + m_id, "pool")
+                exch_name = _name_pattern(met.name, "pool exchange")
+                items.append((POOL, (new_met, exch_id, exch_name)))
+
+        for r_id, rxn in model.reactions.items():
+
+            is_exchange = rxn.reaction_type == ReactionType.EXCHANGE
+
+            if not is_exchange or not merge_ext:
+                new_rxn = _clone(rxn, _id_pattern(r_id, org_id), _name_pattern(rxn.name, org_id))
+                stoichiometry = OrderedDict(rxn.stoichiometry)
+                new_rxn.stoichiometry = stoichiometry
+
+                for m_id, coeff in rxn.stoichiometry.items():
+                    m_blacklisted = m_id in blacklist
+                    if renamed[m_id]:
+                        del stoichiometry[m_id]
+                        new_id = new_met_ids[m_id]
+                        stoichiometry[new_id] = coeff
+
+                    if is_exchange:
+                        new_rxn.reaction_type = ReactionType.OTHER
+                        if met_external[m_id] and not merge_ext:
+                            # TODO: if m_id in self._exchanged_metabolites_blacklist:
+                            pool_id = _id_pattern(m_id, "pool")
+                            stoichiometry[pool_id] = -coeff
+                            cnm = CommunityNameMapping(
+                                organism_reaction=new_rxn.id,
+                                original_reaction=r_id,
+                                organism_metabolite=new_id,
+                                extracellular_metabolite=pool_id,
+                                original_metabolite=m_id,
+                                community_exchange_reaction=_id_pattern("R_EX_" + m_id, "pool"))
+                            fragment.exchange_reactions[new_rxn.id] = cnm
+
+                            if not self.interacting:
+                                sink_rxn = CBReaction('Sink_{}'.format(new_id), reaction_type=ReactionType.SINK,
+                                                      reversible=False)
+                                sink_rxn.stoichiometry = {new_id: -1}
+                                sink_rxn.lb = 0.0
+                                items.append((REACTION, sink_rxn))
+                            elif m_blacklisted:
+                                pool_blacklist_id = _id_pattern(m_id, "pool_blacklist")
+                                blacklist_export_rxn = CBReaction('R_EX_BLACKLIST_{}'.format(new_id),
+                                                                  reaction_type=ReactionType.OTHER,
+                                                                  reversible=False)
+                                blacklist_export_rxn.stoichiometry = {new_id: -1, pool_blacklist_id: 1}
+                                blacklist_export_rxn.lb = 0.0
+                                items.append((REACTION, blacklist_export_rxn))
+
+                if is_exchange and not merge_ext:
+                    new_rxn.reversible = True
+                    new_rxn.lb = -inf
+                    new_rxn.ub = inf if self.interacting and not m_blacklisted else 0.0
+
+                if r_id == model.biomass_reaction:
+                    new_rxn.reversible = False
+                    fragment.biomass_reaction = new_rxn.id
+
+                if self._create_biomass and r_id == model.biomass_reaction:
+                    new_rxn.objective = False
+
+                    # Add biomass metabolite to biomass equation
+                    m_id = _id_pattern('Biomass', org_id)
+                    name = _name_pattern('Community biomass', org_id)
+                    comp = 'pool'
+                    biomass_met = Metabolite(m_id, name, comp)
+                    items.append((METABOLITE, biomass_met))
+                    stoichiometry[m_id] = 1
+                    fragment.biomass_metabolite = m_id
+
+                    sink_rxn = CBReaction('Sink_biomass_{}'.format(org_id), reaction_type=ReactionType.SINK,
+                                          reversible=False)
+                    sink_rxn.stoichiometry = {m_id: -1}
+                    sink_rxn.lb = 0.0
+                    items.append((REACTION, sink_rxn))
+
+                fragment.reactions.append(new_rxn.id)
+                items.append((REACTION, new_rxn))
+
+            else:
+                if is_exchange and merge_ext:
+                    fragment.exchange_reactions[rxn.id] = CommunityNameMapping(
+                        organism_reaction=r_id,
+                        original_reaction=r_id,
+                        extracellular_metabolite=list(rxn.stoichiometry.keys())[0],
+                        original_metabolite=list(rxn.stoichiometry.keys())[0],
+                        organism_metabolite=None)
+                    fragment.reactions.append(rxn.id)
+
+                new_rxn = _clone(rxn, r_id, rxn.name)
+                new_rxn.stoichiometry = OrderedDict(rxn.stoichiometry)
+                new_rxn.reaction_type = ReactionType.EXCHANGE
+                biomass_met = None
+
+                if r_id == model.biomass_reaction and self._create_biomass:
+                    new_rxn.reversible = False
+                    new_rxn.objective = False
+
+                    m_id = _id_pattern('Biomass', org_id)
+                    name = _name_pattern('Biomass', org_id)
+                    comp = 'pool'
+                    biomass_met = Metabolite(m_id, name, comp)
+                    new_rxn.stoichiometry[m_id] = 1
+
+                items.append((SHARED_REACTION, (new_rxn, biomass_met, r_id == model.biomass_reaction)))
+
+        return fragment
+
+    def _stitch_fragment(self, merged_model, fragment, organisms_biomass_metabolites, added=None):
+        """ Add an organism fragment to the merged model, creating the shared pool objects it needs.
+
+        If *added* is given, the (kind, id) of every new reaction, metabolite and compartment is appended to it.
+        """
+
+        if added is None:
+            added = []
+
+        org_id = fragment.org_id
+        self._organisms_reactions[org_id] = list(fragment.reactions)
+        self._organisms_exchange_reactions[org_id] = dict(fragment.exchange_reactions)
+        self._organisms_biomass_reactions[org_id] = fragment.biomass_reaction or {}
+
+        if fragment.biomass_metabolite is not None:
+            organisms_biomass_metabolites[org_id] = fragment.biomass_metabolite
+
+        # fragment objects are copied so that changing a merged model does not affect the cache or other communities
+        for kind, obj in fragment.items:
+            if kind == REACTION:
+                merged_model.add_reaction(_copy_reaction(obj))
+                self._reaction_organisms[obj.id] = org_id
+                added.append((REACTION, obj.id))
+            elif kind == METABOLITE:
+                merged_model.add_metabolite(_copy_object(obj))
+                added.append((METABOLITE, obj.id))
+            elif kind == COMPARTMENT:
+                merged_model.add_compartment(_copy_object(obj))
+                added.append((COMPARTMENT, obj.id))
+            elif kind == POOL or kind == POOL_BLACKLIST:
+                met, exch_id, exch_name = obj
+                if met.id not in merged_model.metabolites:
+                    merged_model.add_metabolite(_copy_object(met))
+                    added.append((METABOLITE, met.id))
+                    if kind == POOL:
+                        exch_rxn = CBReaction(exch_id, name=exch_name, reversible=True,
+                                              reaction_type=ReactionType.EXCHANGE)
+                    else:
+                        exch_rxn = CBReaction(exch_id, name=exch_name, reversible=False,
+                                              reaction_type=ReactionType.SINK)
+                    exch_rxn.stoichiometry[met.id] = -1.0
+                    merged_model.add_reaction(exch_rxn)
+                    added.append((REACTION, exch_rxn.id))
+            elif kind == SHARED_METABOLITE:
+                if obj.id not in merged_model.metabolites:
+                    merged_model.add_metabolite(_copy_object(obj))
+                    added.append((METABOLITE, obj.id))
+            elif kind == SHARED_COMPARTMENT:
+                if obj.id not in merged_model.compartments:
+                    merged_model.add_compartment(_copy_object(obj))
+                    added.append((COMPARTMENT, obj.id))
+            elif kind == SHARED_REACTION:
+                rxn, biomass_met, is_biomass = obj
+                if rxn.id in merged_model.reactions:
+                    continue
+                if biomass_met is not None:
+                    merged_model.add_metabolite(_copy_object(biomass_met))
+                    organisms_biomass_metabolites[org_id] = biomass_met.id
+                    added.append((METABOLITE, biomass_met.id))
+                merged_model.add_reaction(_copy_reaction(rxn))
+                added.append((REACTION, rxn.id))
+                if is_biomass:
+                    self._organisms_biomass_reactions[org_id] = rxn.id
+
     def copy(self, merge_extracellular_compartments=None, copy_models=None, interacting=None, create_biomass=None,
              exchanged_metabolites_blacklist=None):
         """
@@ -487,10 +833,45 @@ class Community(object):
                                    copy_models=copy_models, create_biomass=create_biomass,
                                    merge_extracellular_compartments=merge_extracellular_compartments,
                                    interacting=interacting,
-                                   exchanged_metabolites_blacklist=exchanged_metabolites_blacklist)
+                                   exchanged_metabolites_blacklist=exchanged_metabolites_blacklist,
+                                   fragment_cache=self._fragment_cache)
 
         return copy_community
 
+    def variant(self, merge_extracellular_compartments=None, interacting=None, create_biomass=None):
+        """
+        Get a view of this community with different merging options (e.g. non-interacting).
+
+        Variants share the organism models (and fragment cache) with this community and are cached, so that each
+        variant is merged only once, no matter how many times it is requested (e.g. once per medium).
+
+        Args:
+            merge_extracellular_compartments (bool): Do not create organism specific extracellular compartment
+            interacting (bool): If true models will be able to exchange metabolites
+            create_biomass (bool): create biomass reaction with biomass metabolites as reactants
+        Returns:
+            Community
+        """
+        if merge_extracellular_compartments is None:
+            merge_extracellular_compartments = self._merge_extracellular_compartments
+
+        if interacting is None:
+            interacting = self._interacting
+
+        if create_biomass is None:
+            create_biomass = self._create_biomass
+
+        key = (merge_extracellular_compartments, interacting, create_biomass)
+
+        if key == (self._merge_extracellular_compartments, self._interacting, self._create_biomass):
+            return self
+
+        if key not in self._variants:
+            self._variants[key] = self.copy(copy_models=False, interacting=interacting, create_biomass=create_biomass,
+                                            merge_extracellular_compartments=merge_extracellular_compartments)
+
+        return self._variants[key]
+
     def split_fluxes(self, fluxes):
         """ Decompose a flux balance solution of the merged community into organism-specific flux vectors.
 
@@ -501,10 +882,47 @@ class Community(object):
             dict: community flux distribution as a nested dict
         """
 
-        comm_fluxes = OrderedDict()
+        reaction_organisms = self.reaction_organisms
+        comm_fluxes = OrderedDict((org_id, OrderedDict()) for org_id in self._organisms)
 
-        for org_id, model in self._organisms.items():
-            org_fluxes = [(r_id[:-(1 + len(org_id))], val) for r_id, val in fluxes.items() if r_id.endswith(org_id)]
-            comm_fluxes[org_id] = OrderedDict(org_fluxes)
+        for r_id, val in fluxes.items():
+            org_id = reaction_organisms.get(r_id)
+            if org_id is not None:
+                comm_fluxes[org_id][r_id[:-(1 + len(org_id))]] = val
+
+        return comm_fluxes
+
+    def split_flux_matrix(self, fluxes, reactions=None):
+        """ Decompose multiple flux balance solutions at once (e.g. a solution pool).
+
+        Args:
+            fluxes (array): flux values with one row per solution and one column per reaction
+            reactions (list): reaction ids of the columns (default: reactions of the merged model, in model order)
+
+        Returns:
+            dict: for each organism, a tuple with the (original) reaction ids and the corresponding columns of *fluxes*
+        """
+
+        fluxes = np.asarray(fluxes)
+
+        if reactions is None:
+            # the columns of each organism are already indexed in the arrays of the merged model
+            arrays = self.arrays
+            columns = OrderedDict()
+            for org_id in self._organisms:
+                index = arrays.organism_columns[org_id]
+                r_ids = [arrays.reactions[j][:-(1 + len(org_id))] for j in index]
+                columns[org_id] = (r_ids, fluxes[:, index])
+            return columns
+
+        reaction_organisms = self.reaction_organisms
+        columns = OrderedDict((org_id, ([], [])) for org_id in self._organisms)
+
+        for j, r_id in enumerate(reactions):
+            org_id = reaction_organisms.get(r_id)
+            if org_id is not None:
+                r_ids, index = columns[org_id]
+                r_ids.append(r_id[:-(1 + len(org_id))])
+                index.append(j)
 
-        return comm_fluxes
\ No newline at end of file
+        return OrderedDict((org_id, (r_ids, fluxes[:, index])) for org_id, (r_ids, index) in columns.items())
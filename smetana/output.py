@@ -0,0 +1,243 @@
+import csv
+import os
+
+
+GLOBAL_COLUMNS = ['community', 'medium', 'size', 'mip', 'mro']
+DEBUG_COLUMNS = ['community', 'medium', 'key1', 'key2', 'data']
+DETAILED_COLUMNS = ['community', 'medium', 'receiver', 'donor', 'compound', 'scs', 'mus', 'mps', 'smetana']
+TIMING_COLUMNS = ['community', 'medium', 'stage', 'time', 'solves', 'status']
+
+# columns that pandas would store as floats (formatted the same way to keep outputs identical)
+FLOAT_COLUMNS = {'mro', 'scs', 'mus', 'smetana'}
+
+
+def format_value(value, is_float=False):
+    if value is None:
+        return ''
+    if is_float and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(float(value))
+    return str(value)
+
+
+class TableWriter(object):
+    """ Appends rows to a tab-separated file, creating it (with header) on the first write. """
+
+    def __init__(self, filename, columns, lazy=False, offset=None):
+        """
+        Args:
+            filename (str): output file
+            columns (list): column names
+            lazy (bool): only create the file when the first rows are written (default: False)
+            offset (int): resume an existing file, discarding anything written after this position (optional)
+        """
+        self.filename = filename
+        self.columns = columns
+        self._float_cols = [col in FLOAT_COLUMNS for col in columns]
+        self._file = None
+        self._writer = None
+        self._resume = offset is not None
+        self._size = offset or 0
+
+        if self._resume and os.path.exists(filename):
+            os.truncate(filename, offset)
+
+        if not lazy:
+            self.open()
+
+    def open(self):
+        self._file = open(self.filename, 'a' if self._resume else 'w', newline='')
+        self._writer = csv.writer(self._file, delimiter='\t', lineterminator='\n')
+        if self._file.tell() == 0:
+            self._writer.writerow(self.columns)
+
+    def write(self, rows):
+        if self._file is None:
+            self.open()
+
+        for row in rows:
+            self._writer.writerow([format_value(x, is_float) for x, is_float in zip(row, self._float_cols)])
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def tell(self):
+        if self._file is not None:
+            return self._file.tell()
+        return self._size
+
+    def close(self):
+        if self._file is not None:
+            self._size = self._file.tell()
+            self._file.close()
+            self._file = None
+
+
+class ResultWriter(object):
+    """
+    Streams results to the output files as they are produced.
+
+    Rows are written (and flushed) as soon as each block of results is available, so memory usage does not grow
+    with the number of communities and partial results survive an interrupted run.
+    """
+
+    def __init__(self, mode, output=None, zeros=False, offsets=None, profile=False, extra_columns=None):
+        """
+        Args:
+            mode (str): running mode (global, detailed, abiotic, ...)
+            output (str): prefix for output files (optional)
+            zeros (bool): keep entries with zero score (only applies to detailed modes)
+            offsets (tuple): file positions to resume from, as returned by *tell* (optional)
+            profile (bool): also write stage timings to a timings file (default: False)
+            extra_columns (list): optional result columns, appended to the standard ones (optional)
+        """
+        prefix = output + '_' if output else ''
+        self.mode = mode
+        self.zeros = zeros
+
+        results_offset, debug_offset = offsets if offsets is not None else (None, None)
+        extra_columns = list(extra_columns or [])
+
+        if mode == "global":
+            self.results = TableWriter(prefix + 'global.tsv', GLOBAL_COLUMNS + extra_columns, offset=results_offset)
+            self.debug = TableWriter(prefix + 'debug.tsv', DEBUG_COLUMNS, lazy=True, offset=debug_offset)
+        else:
+            self.results = TableWriter(prefix + 'detailed.tsv', DETAILED_COLUMNS + extra_columns,
+                                       offset=results_offset)
+            self.debug = None
+
+        self.timings = None
+        if profile:
+            # timings are diagnostic only: when resuming, keep appending to the existing file
+            timings_file = prefix + 'timings.tsv'
+            timings_offset = None
+            if offsets is not None and os.path.exists(timings_file):
+                timings_offset = os.path.getsize(timings_file)
+            self.timings = TableWriter(timings_file, TIMING_COLUMNS, offset=timings_offset)
+
+    def write(self, entries, debug_entries=None, timings=None):
+        """ Write a block of result entries (and optional debug entries).
+
+        Args:
+            entries (list): result tuples
+            debug_entries (list): debug tuples (global mode only)
+            timings (list): stage timing tuples (profiling only)
+        """
+
+        if self.mode != "global" and not self.zeros:
+            # entries that could not be scored ('n/a') are always kept
+            i = DETAILED_COLUMNS.index('smetana')
+            entries = (row for row in entries if not isinstance(row[i], (int, float)) or row[i] > 0)
+
+        self.results.write(entries)
+
+        if self.debug is not None and debug_entries:
+            self.debug.write(debug_entries)
+
+        if self.timings is not None and timings:
+            self.timings.write(timings)
+
+        self.flush()
+
+    def flush(self):
+        self.results.flush()
+        if self.debug is not None:
+            self.debug.flush()
+        if self.timings is not None:
+            self.timings.flush()
+
+    def tell(self):
+        """ Current size of the output files, as a (results, debug) tuple. """
+        debug_size = self.debug.tell() if self.debug is not None else 0
+        return self.results.tell(), debug_size
+
+    def close(self):
+        self.results.close()
+        if self.debug is not None:
+            self.debug.close()
+        if self.timings is not None:
+            self.timings.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Checkpoint(object):
+    """
+    Sidecar index of finished result blocks, used to resume interrupted runs.
+
+    Each line records a (community, medium, perturbation) key together with the size of the output files after the
+    block was written. When resuming, finished keys are skipped and the output files are truncated to the last
+    recorded size, discarding any block that was only partially written.
+
+    A disabled checkpoint does not create any file (finished keys are only kept in memory).
+    """
+
+    def __init__(self, output=None, resume=False, enabled=True):
+        """
+        Args:
+            output (str): prefix for output files (optional)
+            resume (bool): load previously finished keys instead of starting a new index (default: False)
+            enabled (bool): write the checkpoint file (default: True)
+        """
+        prefix = output + '_' if output else ''
+        self.filename = prefix + 'checkpoint.tsv'
+        self.done = set()
+        self.offsets = None
+        self._file = None
+
+        if resume and os.path.exists(self.filename):
+            self._load()
+
+        if enabled:
+            self._file = open(self.filename, 'a' if resume else 'w')
+
+    def _load(self):
+        with open(self.filename, 'rb') as f:
+            lines = f.readlines()
+
+        valid = 0
+        for line in lines:
+            fields = line.decode().rstrip('\n').split('\t')
+            if not line.endswith(b'\n') or len(fields) != 5:
+                break
+            self.done.add(tuple(fields[:3]))
+            self.offsets = (int(fields[3]), int(fields[4]))
+            valid += len(line)
+
+        # drop a trailing line left incomplete by an interrupted run
+        os.truncate(self.filename, valid)
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def add(self, key, offsets):
+        """ Mark a block as finished.
+
+        Args:
+            key (tuple): (community, medium, perturbation) key
+            offsets (tuple): size of the output files after writing the block
+        """
+        self.done.add(key)
+        self.offsets = offsets
+
+        if self._file is not None:
+            self._file.write('\t'.join(map(str, key + tuple(offsets))) + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,87 @@
+from multiprocessing import Pool
+from inspect import signature
+from .session import SolverSession
+
+
+_community = None
+_session = None
+
+
+def _init_worker(community):
+    global _community, _session
+    _community = community
+    _session = SolverSession()
+
+
+def _run_task(task):
+    func, org_id, kwargs, with_stats = task
+    stats = {} if with_stats else None
+    if with_stats:
+        kwargs = dict(kwargs, stats=stats)
+    if 'session' in signature(func).parameters:
+        kwargs = dict(kwargs, session=_session)
+    scores = func(_community, organisms=[org_id], **kwargs)
+    return scores, stats
+
+
+class OrganismPool(object):
+    """
+    Worker pool to solve the per-organism problems of one community in parallel.
+
+    Each worker receives a copy of the community once (when the pool is created) and keeps its own solver session,
+    so problems are built once per worker and reused for all organisms (and media) assigned to it. This is useful
+    for large communities, where the per-organism problems dominate the running time.
+    """
+
+    def __init__(self, community, processes):
+        """
+        Args:
+            community (Community): microbial community
+            processes (int): number of worker processes
+        """
+        self.community = community
+        self.processes = processes
+
+        # build the merged model before starting the workers, so that it is built only once
+        community.merged
+        self._pool = Pool(processes, initializer=_init_worker, initargs=(community,))
+
+    def map(self, func, organisms=None, **kwargs):
+        """ Apply a scoring function to each organism of the community.
+
+        The function is called in the workers as func(community, organisms=[org_id], **kwargs) (plus the session of
+        the worker, if it accepts a *session* argument) and must return a dict keyed by organism. Results are merged in the order of *organisms*, so the output does not
+        depend on which worker finishes first. If a *stats* dict is given, the stats of each call are merged into it.
+
+        Args:
+            func (function): module-level scoring function
+            organisms (list): organisms to score (default: all organisms in the community)
+
+        Returns:
+            dict: merged results
+        """
+
+        if organisms is None:
+            organisms = list(self.community.organisms)
+
+        stats = kwargs.pop('stats', None)
+        tasks = [(func, org_id, kwargs, stats is not None) for org_id in organisms]
+        results = self._pool.map(_run_task, tasks, chunksize=1)
+
+        merged = {}
+        for scores, org_stats in results:
+            merged.update(scores)
+            if stats is not None:
+                stats.update(org_stats)
+
+        return merged
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
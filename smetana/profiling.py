@@ -0,0 +1,97 @@
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+from smetana.session import add_solve_hook, remove_solve_hook
+
+
+class SolverStats(object):
+    """
+    Count the optimization problems solved while active (used as a context manager).
+
+    Registers a solve hook, so every LP/MILP solved by a solver built with session.new_solver (including the problems
+    that reframed functions, such as minimal_medium, solve with it) is counted, together with the status of the
+    solutions. Solution pools count as a single solve.
+    """
+
+    def __init__(self):
+        self.solves = 0
+        self.status = Counter()
+
+    def __enter__(self):
+        add_solve_hook(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_solve_hook(self)
+
+    def before_solve(self, solver):
+        pass
+
+    def after_solve(self, solver, solution):
+        if solution is not None:
+            self.add(solution)
+
+    def add(self, solution):
+        self.solves += 1
+
+        if isinstance(solution, list):
+            status = solution[0].status if solution else None
+        else:
+            status = getattr(solution, 'status', None)
+
+        self.status[status.name if status is not None else 'none'] += 1
+
+    def to_dict(self):
+        return {'solves': self.solves, 'status': dict(self.status)}
+
+
+def format_status(status):
+    """ Format solution status counts as a compact string (e.g. 'OPTIMAL:12,INFEASIBLE:1'). """
+    return ','.join('{}:{}'.format(key, value) for key, value in sorted(status.items()))
+
+
+class Profiler(object):
+    """
+    Records the wall time and the number of optimization problems solved in each stage of a run.
+
+    Each stage is stored as a (community, medium, stage, time, solves, status) row. Rows are accumulated until they
+    are collected with *pop*, so they can be written together with the results of each block.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    @contextmanager
+    def stage(self, comm_id, medium_id, stage):
+        """ Profile a stage (used as a context manager).
+
+        Args:
+            comm_id (str): community id
+            medium_id (str): medium id (None if the stage does not depend on the medium)
+            stage (str): stage name (e.g. load, merge, environment, mip, mro, scs, mus, mps)
+        """
+
+        start = perf_counter()
+
+        with SolverStats() as stats:
+            try:
+                yield stats
+            finally:
+                elapsed = perf_counter() - start
+                self.rows.append((comm_id, medium_id or '', stage, round(elapsed, 6), stats.solves,
+                                  format_status(stats.status)))
+
+    def pop(self):
+        """ Collect (and clear) the rows recorded so far. """
+        rows, self.rows = self.rows, []
+        return rows
+
+
+def profiled(profiler, comm_id, medium_id, stage):
+    """ Profile a stage with *profiler*, or do nothing if *profiler* is None. """
+
+    if profiler is None:
+        return nullcontext()
+
+    return profiler.stage(comm_id, medium_id, stage)
@@ -0,0 +1,284 @@
+from reframed import solver_instance
+from reframed.solvers.solution import Status
+from reframed.solvers.solver import Parameter
+from warnings import warn
+
+
+_solve_hooks = []
+
+
+class SolverSession(object):
+    """
+    Keeps the optimization problems of a community loaded across multiple environments.
+
+    Each scoring function asks the session for its solver under a fixed key. The problem is built only once per
+    model, and afterwards only the flux bounds that differ from the previous call (typically the exchange reactions
+    of the new medium) are updated. Solvers that keep their basis after bound changes (e.g. CPLEX, Gurobi) are
+    therefore warm-started from the previous solution. Models are never modified, bounds only exist in the solver.
+
+    Only problems that are not changed by the scoring functions can be kept in a session (SCS, MUS and MPS). MUS adds
+    the variables of its minimal medium problem once (in *setup*), and removes its integer cuts after each organism.
+    The other minimal media (MIP, MRO) are computed with a new solver for each call, since minimal_medium adds its own
+    variables and constraints to the problem.
+    """
+
+    def __init__(self):
+        self._solvers = {}
+        self._bounds = {}
+
+    def get_solver(self, key, model, bounds=None, setup=None):
+        """ Get a solver instance for a given model.
+
+        Args:
+            key (str): solver identifier (one per scoring step)
+            model (CBModel): model used to build the problem the first time
+            bounds (dict): flux bounds to apply, as a dict of reaction id to (lb, ub) (optional)
+            setup (function): called once with the new solver to add extra variables and constraints (optional)
+
+        Returns:
+            Solver: solver instance
+        """
+
+        if key not in self._solvers or self._solvers[key][0] is not model:
+            solver = new_solver(model)
+            if setup is not None:
+                setup(solver)
+            self._solvers[key] = (model, solver)
+            self._bounds[key] = {}
+
+        solver = self._solvers[key][1]
+
+        if bounds:
+            current = self._bounds[key]
+            changed = {r_id: bound for r_id, bound in bounds.items() if current.get(r_id) != bound}
+            if changed:
+                set_bounds(solver, changed)
+                current.update(changed)
+
+        return solver
+
+    def clear(self):
+        """ Release all solver instances. """
+        self._solvers = {}
+        self._bounds = {}
+
+
+def add_solve_hook(hook):
+    """ Register a hook that is notified of every problem solved by the solvers built with *new_solver*.
+
+    Hooks implement before_solve(solver) and after_solve(solver, solution), where solution is None if the solver
+    raised an exception (or a hook raised one in before_solve).
+
+    Args:
+        hook: hook object
+    """
+    _solve_hooks.append(hook)
+
+
+def remove_solve_hook(hook):
+    """ Unregister a hook added with *add_solve_hook*.
+
+    Args:
+        hook: hook object
+    """
+    _solve_hooks.remove(hook)
+
+
+def new_solver(model):
+    """ Build a solver instance for a model.
+
+    The *solve* method of the instance (not of the solver class) is wrapped, so that the active solve hooks are
+    notified of every problem it solves.
+
+    Args:
+        model (CBModel): model
+
+    Returns:
+        Solver: solver instance
+    """
+
+    solver = solver_instance(model)
+    solve = solver.solve
+
+    def hooked_solve(*args, **kwargs):
+        hooks = list(_solve_hooks)
+        solution = None
+        done = []
+
+        try:
+            for hook in hooks:
+                hook.before_solve(solver)
+                done.append(hook)
+            solution = solve(*args, **kwargs)
+        finally:
+            for hook in reversed(done):
+                hook.after_solve(solver, solution)
+
+        return solution
+
+    solver.solve = hooked_solve
+    return solver
+
+
+def get_solver(session, key, model, bounds=None, setup=None):
+    """ Get a solver from a session, or build a new one if no session is given.
+
+    Args:
+        session (SolverSession): solver session (optional)
+        key (str): solver identifier
+        model (CBModel): model
+        bounds (dict): flux bounds to apply, as a dict of reaction id to (lb, ub) (optional)
+        setup (function): called with a new solver to add extra variables and constraints (optional)
+
+    Returns:
+        Solver: solver instance
+    """
+
+    if session is not None:
+        return session.get_solver(key, model, bounds, setup)
+
+    solver = new_solver(model)
+    if setup is not None:
+        setup(solver)
+
+    if bounds:
+        set_bounds(solver, bounds)
+
+    return solver
+
+
+def set_bounds(solver, bounds):
+    """ Change the flux bounds of a solver problem (they are kept until they are changed again).
+
+    Args:
+        solver (Solver): solver instance
+        bounds (dict): flux bounds, as a dict of reaction id to (lb, ub)
+    """
+
+    solver.update()
+    solver.set_temporary_bounds(bounds)
+
+    if type(solver).__name__ == 'CplexSolver':
+        # CPLEX restores these cached bounds after solving with temporary bounds
+        from reframed.solvers.cplex_solver import infinity_fix
+        for r_id, (lb, ub) in bounds.items():
+            if r_id in solver._cached_lower_bounds:
+                solver._cached_lower_bounds[r_id] = infinity_fix(lb)
+                solver._cached_upper_bounds[r_id] = infinity_fix(ub)
+
+
+def set_random_seed(solver, seed):
+    """ Set the random seed of the underlying solver (supported for CPLEX and Gurobi).
+
+    Args:
+        solver (Solver): solver instance
+        seed (int): random seed
+    """
+
+    solver_name = type(solver).__name__
+
+    if solver_name == 'CplexSolver':
+        solver.problem.parameters.randomseed.set(seed)
+    elif solver_name == 'GurobiSolver':
+        solver.problem.setParam('Seed', seed)
+    else:
+        warn('Setting a random seed is not supported for {}'.format(solver_name))
+
+
+def set_time_limit(solver, seconds):
+    """ Set the time limit for solving a problem (supported for CPLEX, Gurobi and SCIP).
+
+    Args:
+        solver (Solver): solver instance
+        seconds (float): time limit in seconds (None restores the default of the solver, i.e. no limit)
+    """
+
+    solver_name = type(solver).__name__
+
+    if solver_name == 'CplexSolver' and seconds is None:
+        solver.problem.parameters.timelimit.reset()
+    elif solver_name == 'GurobiSolver' and seconds is None:
+        solver.problem.setParam('TimeLimit', float('inf'))
+    elif solver_name == 'SCIPSolver' and seconds is None:
+        solver.problem.resetParam('limits/time')
+    elif solver_name in ('CplexSolver', 'GurobiSolver', 'SCIPSolver'):
+        solver.set_parameter(Parameter.TIME_LIMIT, seconds)
+    elif seconds is not None:
+        warn('Setting a time limit is not supported for {}'.format(solver_name))
+
+
+def hit_time_limit(solver, solution):
+    """ Check if the last problem solved stopped because it reached the time limit.
+
+    The status is read from the problem for CPLEX, Gurobi and SCIP. For other solvers, a solution that is neither
+    optimal nor proven infeasible or unbounded is assumed to have reached the time limit.
+
+    Args:
+        solver (Solver): solver instance
+        solution (Solution): solution returned by the solver (or list of solutions, for a solution pool)
+
+    Returns:
+        bool: True if the time limit was reached
+    """
+
+    solver_name = type(solver).__name__
+
+    if solver_name == 'CplexSolver':
+        # CPX_STAT_ABORT_TIME_LIM, CPXMIP_TIME_LIM_FEAS, CPXMIP_TIME_LIM_INFEAS
+        return solver.problem.solution.get_status() in (11, 107, 108)
+    elif solver_name == 'GurobiSolver':
+        from gurobipy import GRB
+        return solver.problem.Status == GRB.TIME_LIMIT
+    elif solver_name == 'SCIPSolver':
+        return solver.problem.getStatus() == 'timelimit'
+
+    if isinstance(solution, list):
+        solution = solution[0] if solution else None
+
+    status = getattr(solution, 'status', None)
+    return status in (Status.SUBOPTIMAL, Status.UNKNOWN)
+
+
+def supports_indicators(solver):
+    """ Check if a solver supports indicator constraints (CPLEX and Gurobi).
+
+    Args:
+        solver (Solver): solver instance
+
+    Returns:
+        bool: True if *add_indicator_constraint* can be used with this solver
+    """
+
+    return type(solver).__name__ in ('CplexSolver', 'GurobiSolver')
+
+
+def add_indicator_constraint(solver, constr_id, var_id, value, lhs, sense, rhs):
+    """ Add a constraint that is only enforced when a binary variable takes a given value.
+
+    Args:
+        solver (Solver): solver instance (CPLEX or Gurobi)
+        constr_id (str): constraint identifier
+        var_id (str): binary (indicator) variable
+        value (int): value of the indicator variable (0 or 1) for which the constraint is active
+        lhs (dict): left-hand side of the constraint, as a dict of variable id to coefficient
+        sense (str): constraint sense ('<', '=', '>')
+        rhs (float): right-hand side of the constraint
+    """
+
+    solver_name = type(solver).__name__
+
+    if solver_name == 'CplexSolver':
+        senses = {'<': 'L', '=': 'E', '>': 'G'}
+        solver.problem.indicator_constraints.add(
+            lin_expr=[list(lhs.keys()), list(lhs.values())], sense=senses[sense], rhs=rhs,
+            indvar=var_id, complemented=1 - value, name=constr_id)
+
+    elif solver_name == 'GurobiSolver':
+        from gurobipy import GRB, quicksum
+        senses = {'<': GRB.LESS_EQUAL, '=': GRB.EQUAL, '>': GRB.GREATER_EQUAL}
+        problem = solver.problem
+        expr = quicksum(coeff * problem.getVarByName(r_id) for r_id, coeff in lhs.items())
+        problem.addGenConstrIndicator(problem.getVarByName(var_id), value, expr, senses[sense], rhs, name=constr_id)
+
+    else:
+        raise RuntimeError('Indicator constraints are not supported for {}'.format(solver_name))
@@ -1,61 +1,241 @@
-from reframed import minimal_medium, solver_instance, Environment
+from reframed import minimal_medium, Environment
+from reframed.cobra.medium import validate_solution
+from reframed.core.elements import molecular_weight
 from reframed.solvers.solver import VarType
 from reframed.solvers.solution import Status
+from .session import get_solver, set_random_seed, supports_indicators, add_indicator_constraint
 
-from collections import Counter
+from collections import Counter, deque
+from collections.abc import Mapping
+from copy import copy
 from itertools import combinations, chain
 from warnings import warn
 from math import isinf, inf
 
 
-def sc_score(community, environment=None, min_growth=0.1, n_solutions=100, verbose=True, abstol=1e-6, use_pool=False):
+def _env_bounds(environment, model):
+    """ Flux bounds imposed by an environment on a model (as a dict of reaction id to (lb, ub)).
+
+    Bounds are passed to the solver as an overlay, so that the (shared) community model is never changed.
+    """
+    if environment is None:
+        return {}
+    return environment.apply(model, inplace=False, warning=False)
+
+
+class _Convergence(object):
+    """ Tracks the frequencies of items over a sequence of samples (e.g. alternative solutions) to detect when they
+    stop changing: converged once all frequencies changed by less than *tol* over the last *window* samples
+    (so a zero tolerance never converges). """
+
+    def __init__(self, items, tol, window):
+        self.items = list(items)
+        self.tol = tol
+        self.counter = Counter()
+        self.n = 0
+        self.history = deque(maxlen=window + 1)
+
+    def add(self, sample):
+        """ Add a sample (collection of items), and return True if the frequencies converged. """
+
+        self.counter.update(sample)
+        self.n += 1
+        freqs = {x: self.counter[x] / self.n for x in self.items}
+        self.history.append(freqs)
+
+        if len(self.history) < self.history.maxlen:
+            return False
+
+        change = max((abs(freqs[x] - self.history[0][x]) for x in self.items), default=0)
+        return change < self.tol
+
+
+class _BoundedReactions(Mapping):
+    """ Read-only view of the reactions of a model, with some flux bounds replaced. """
+
+    def __init__(self, reactions, bounds):
+        self._reactions = reactions
+        self._bounds = bounds
+
+    def __getitem__(self, r_id):
+        rxn = self._reactions[r_id]
+        if r_id in self._bounds:
+            rxn = copy(rxn)
+            rxn.lb, rxn.ub = self._bounds[r_id]
+        return rxn
+
+    def __iter__(self):
+        return iter(self._reactions)
+
+    def __len__(self):
+        return len(self._reactions)
+
+
+class _ModelView(object):
+    """ Proxy of a model with a different biomass reaction (used to select the organism to grow) and/or flux bounds.
+
+    minimal_medium reads the upper bounds of the exchange reactions from the model, so the bounds of the environment
+    must be visible there as well (the shared model itself is never changed).
+    """
+
+    def __init__(self, model, biomass_reaction=None, bounds=None):
+        self._model = model
+        self.biomass_reaction = biomass_reaction if biomass_reaction is not None else model.biomass_reaction
+        self.reactions = _BoundedReactions(model.reactions, bounds) if bounds else model.reactions
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def _minimal_media_setup(exchange_reactions, max_uptake):
+    """ Set up the minimal medium MILP of reframed's minimal_medium (for uptake) once, to solve it many times.
+
+    Each exchange reaction r gets a binary variable y_r, and a constraint that blocks its uptake when y_r is zero.
+    Variables of the reactions that are not in the objective are free, so they do not restrict the solution.
+    """
+
+    def setup(solver):
+        for r_id in exchange_reactions:
+            solver.add_variable('y_' + r_id, 0, 1, vartype=VarType.BINARY)
+
+        solver.update()
+
+        for r_id in exchange_reactions:
+            solver.add_constraint('c_' + r_id, {r_id: 1, 'y_' + r_id: max_uptake}, '>', 0)
+
+        solver.update()
+
+    return setup
+
+
+def _medium_objective(model, exchange_reactions, min_mol_weight):
+    """ Objective of the minimal medium MILP (number of compounds, or their molecular weight, as in minimal_medium).
+
+    Returns:
+        dict: objective coefficient of each binary variable
+        set: exchange reactions that can be used for uptake (compounds without a valid formula are excluded when
+            minimizing by molecular weight)
+    """
+
+    if not min_mol_weight:
+        return {'y_' + r_id: 1 for r_id in exchange_reactions}, set(exchange_reactions)
+
+    objective = {}
+
+    for r_id in exchange_reactions:
+        compounds = model.reactions[r_id].get_substrates()
+        if len(compounds) != 1:
+            continue
+
+        formula = model.metabolites[compounds[0]].metadata.get('FORMULA')
+        weight = molecular_weight(formula) if formula else None
+
+        if weight is not None:
+            objective['y_' + r_id] = weight
+
+    return objective, {y_id[2:] for y_id in objective}
+
+
+def sc_score(community, environment=None, min_growth=0.1, n_solutions=100, verbose=True, abstol=1e-6, use_pool=False,
+             pool_gap=0.5, seed=None, formulation='full', organisms=None, session=None, stats=None, workers=None,
+             convergence_tol=None, convergence_window=10):
     """
     Calculate frequency of community species dependency on each other
 
     Zelezniak A. et al, Metabolic dependencies drive species co-occurrence in diverse microbial communities (PNAS 2015)
 
+    Alternative donor sets are enumerated either iteratively (adding one integer cut per solution) or, with
+    *use_pool*, in a single call using the solution pool of the MILP solver (CPLEX or Gurobi).
+
+    With the *full* formulation every reaction of an organism is switched off (with big-M constraints) when the
+    organism is absent. The *exchange* formulation only gates the exchange reactions between each organism and the
+    shared pool, which is enough to remove its contribution to the community and results in a much smaller problem.
+    It uses indicator constraints when the solver supports them (CPLEX, Gurobi) and big-M constraints otherwise.
+    The *exchange* formulation is an approximation of the *full* one, and scores can differ: an organism with internal
+    reactions that can not carry zero flux is forced to be present only in the full formulation, internal fluxes of
+    present organisms are only limited by big-M in the full formulation, and alternative solutions may be enumerated
+    in a different order (which matters when there are more than *n_solutions*).
+
+    With *convergence_tol*, the iterative enumeration of each organism stops early once no donor frequency has changed
+    by more than *convergence_tol* over the last *convergence_window* solutions (*n_solutions* is still the maximum).
+
     Args:
         community (Community): microbial community
         environment (Environment): metabolic environment (optional)
         min_growth (float): minimum growth rate (default: 0.1)
         abstol (float): tolerance for detecting a non-zero exchange flux (default: 1e-6)
         n_solutions (int): number of alternative solutions to calculate (default: 100)
+        use_pool (bool): enumerate solutions with the solver solution pool (default: False)
+        pool_gap (float): relative gap to the optimum of solutions kept in the pool (default: 0.5)
+        seed (int): random seed for the solver, to make solution pools reproducible (optional)
+        formulation (str): 'full' or 'exchange' (default: 'full')
+        organisms (list): only calculate scores for these organisms (default: all)
+        session (SolverSession): reuse solver instances across calls (optional)
+        stats (dict): if given, it is filled with the number of solutions used and donor set sizes per organism
+        workers (OrganismPool): solve the problems of each organism in parallel (optional)
+        convergence_tol (float): stop when donor frequencies change less than this (optional, iterative mode only)
+        convergence_window (int): number of solutions over which frequency changes are measured (default: 10)
 
     Returns:
         dict: Keys are dependent organisms, values are dictionaries with required organism frequencies
     """
 
-    community = community.copy(copy_models=False, interacting=True, create_biomass=False,
-                               merge_extracellular_compartments=False)
+    if formulation not in ('full', 'exchange'):
+        raise ValueError("Invalid SCS formulation: {} (options: 'full', 'exchange')".format(formulation))
 
-    if environment:
-        environment.apply(community.merged, inplace=True, warning=False)
+    if workers is not None:
+        return workers.map(sc_score, organisms, environment=environment, min_growth=min_growth,
+                           n_solutions=n_solutions, verbose=verbose, abstol=abstol, use_pool=use_pool,
+                           pool_gap=pool_gap, seed=seed, formulation=formulation, stats=stats,
+                           convergence_tol=convergence_tol, convergence_window=convergence_window)
+
+    community = community.variant(interacting=True, create_biomass=False, merge_extracellular_compartments=False)
+    model = community.merged
+    bounds = _env_bounds(environment, model)
 
     for b in community.organisms_biomass_reactions.values():
-        community.merged.reactions[b].lb = 0
+        bounds[b] = (0, model.reactions[b].ub)
+
+    def setup(solver):
+        for org_id in community.organisms:
+            org_var = 'y_{}'.format(org_id)
+            solver.add_variable(org_var, 0, 1, vartype=VarType.BINARY)
 
-    solver = solver_instance(community.merged)
+        solver.update()
 
-    for org_id in community.organisms:
-        org_var = 'y_{}'.format(org_id)
-        solver.add_variable(org_var, 0, 1, vartype=VarType.BINARY)
+        if formulation == 'full':
+            gated = community.organisms_reactions
+        else:
+            gated = community.organisms_exchange_reactions
+
+        use_indicators = formulation == 'exchange' and supports_indicators(solver)
 
-    solver.update()
+        bigM = 1000
+        for org_id, rxns in gated.items():
+            org_var = 'y_{}'.format(org_id)
+            for r_id in rxns:
+                if r_id == community.organisms_biomass_reactions[org_id]:
+                    continue
+                if use_indicators:
+                    add_indicator_constraint(solver, 'c_{}'.format(r_id), org_var, 0, {r_id: 1}, '=', 0)
+                else:
+                    solver.add_constraint('c_{}_lb'.format(r_id), {r_id: 1, org_var: bigM}, '>', 0)
+                    solver.add_constraint('c_{}_ub'.format(r_id), {r_id: 1, org_var: -bigM}, '<', 0)
 
-    bigM = 1000
-    for org_id, rxns in community.organisms_reactions.items():
-        org_var = 'y_{}'.format(org_id)
-        for r_id in rxns:
-            if r_id == community.organisms_biomass_reactions[org_id]:
-                continue
-            solver.add_constraint('c_{}_lb'.format(r_id), {r_id: 1, org_var: bigM}, '>', 0)
-            solver.add_constraint('c_{}_ub'.format(r_id), {r_id: 1, org_var: -bigM}, '<', 0)
+        solver.update()
 
-    solver.update()
+    key = 'sc' if formulation == 'full' else 'sc_' + formulation
+    solver = get_solver(session, key, model, bounds, setup)
+
+    if seed is not None:
+        set_random_seed(solver, seed)
 
     scores = {}
 
-    for org_id, biomass_id in community.organisms_biomass_reactions.items():
+    if organisms is None:
+        organisms = community.organisms
+
+    for org_id in organisms:
         other = {o for o in community.organisms if o != org_id}
         solver.add_constraint('SMETANA_Biomass', {community.organisms_biomass_reactions[org_id]: 1}, '>', min_growth)
         objective = {"y_{}".format(o): 1.0 for o in other}
@@ -63,18 +243,23 @@ def sc_score(community, environment=None, min_growth=0.1, n_solutions=100, verbo
         if not use_pool:
             previous_constraints = []
             donors_list = []
-            failed = False
+            convergence = None
+
+            if convergence_tol is not None:
+                convergence = _Convergence(other, convergence_tol, convergence_window)
 
             for i in range(n_solutions):
                 sol = solver.solve(objective, minimize=True, get_values=list(objective.keys()))
 
                 if sol.status != Status.OPTIMAL:
-                    failed = i == 0
                     break
 
                 donors = [o for o in other if sol.values["y_{}".format(o)] > abstol]
                 donors_list.append(donors)
 
+                if convergence is not None and convergence.add(donors):
+                    break
+
                 previous_con = 'iteration_{}'.format(i)
                 previous_constraints.append(previous_con)
                 previous_sol = {"y_{}".format(o): 1 for o in donors}
@@ -83,39 +268,49 @@ def sc_score(community, environment=None, min_growth=0.1, n_solutions=100, verbo
             for constr_id in ['SMETANA_Biomass'] + previous_constraints:
                 solver.remove_constraint(constr_id)
 
-            if not failed:
-                donors_list_n = float(len(donors_list))
-                donors_counter = Counter(chain(*donors_list))
-                scores[org_id] = {o: donors_counter[o] / donors_list_n for o in other}
-            else:
-                if verbose:
-                    warn('SCS: Failed to find a solution for growth of ' + org_id)
-                scores[org_id] = None
-
         else:
             sols = solver.solve(objective, minimize=True, get_values=list(objective.keys()),
-                                pool_size=n_solutions, pool_gap=0.5)
+                                pool_size=n_solutions, pool_gap=pool_gap)
             solver.remove_constraint('SMETANA_Biomass')
 
-            if len(sols) == 0:
-                scores[org_id] = None
-                if verbose:
-                    warn('SCS: Failed to find a solution for growth of ' + org_id)
-            else:
-                donor_count = [o for sol in sols for o in other if sol.values["y_{}".format(o)] > abstol]
-                donor_count = Counter(donor_count)
-                scores[org_id] = {o: donor_count[o] / len(sols) for o in other}
+            donors_list = [[o for o in other if sol.values["y_{}".format(o)] > abstol] for sol in sols]
+
+        if len(donors_list) > 0:
+            donors_list_n = float(len(donors_list))
+            donors_counter = Counter(chain(*donors_list))
+            scores[org_id] = {o: donors_counter[o] / donors_list_n for o in other}
+        else:
+            if verbose:
+                warn('SCS: Failed to find a solution for growth of ' + org_id)
+            scores[org_id] = None
+
+        if stats is not None:
+            sizes = [len(donors) for donors in donors_list]
+            stats[org_id] = {
+                'solutions': len(donors_list),
+                'min_donors': min(sizes) if sizes else None,
+                'max_donors': max(sizes) if sizes else None,
+            }
 
     return scores
 
 
 def mu_score(community, environment=None, min_mol_weight=False, min_growth=0.1, max_uptake=10.0,
-             abstol=1e-6, validate=False, n_solutions=100, pool_gap=0.5, verbose=True):
+             abstol=1e-6, validate=False, n_solutions=100, pool_gap=0.5, verbose=True, organisms=None, session=None,
+             workers=None, convergence_tol=None, convergence_window=10, stats=None):
     """
     Calculate frequency of metabolite requirement for species growth
 
     Zelezniak A. et al, Metabolic dependencies drive species co-occurrence in diverse microbial communities (PNAS 2015)
 
+    The minimal medium MILP is built once, and alternative media are enumerated one at a time (adding one integer
+    cut per solution). The cuts of each organism are removed before the next one, so the scores of an organism do
+    not depend on the other organisms scored before it (previous versions kept them, which could restrict the uptake
+    of the organisms scored earlier, and change the media found for the next ones).
+
+    With *convergence_tol*, the enumeration of each organism stops early once all metabolite frequencies changed by
+    less than *convergence_tol* over the last *convergence_window* solutions (*n_solutions* is still the maximum).
+
     Args:
         community (Community): microbial community
         environment (Environment): metabolic environment
@@ -124,30 +319,82 @@ def mu_score(community, environment=None, min_mol_weight=False, min_growth=0.1,
         max_uptake (float): maximum uptake rate (default: 10)
         abstol (float): tolerance for detecting a non-zero exchange flux (default: 1e-6)
         validate (bool): validate solution using FBA (for debugging purposes, default: False)
-        n_solutions (int): number of alternative solutions to calculate (default: 100)
+        n_solutions (int): number of alternative solutions to calculate (maximum with convergence, default: 100)
+        organisms (list): only calculate scores for these organisms (default: all)
+        session (SolverSession): reuse solver instances across calls (optional)
+        workers (OrganismPool): solve the problems of each organism in parallel (optional)
+        convergence_tol (float): stop when metabolite frequencies change less than this (optional)
+        convergence_window (int): number of solutions over which frequency changes are measured (default: 10)
+        stats (dict): if given, it is filled with the number of solutions used per organism
 
     Returns:
         dict: Keys are organism names, values are dictionaries with metabolite frequencies 
         dict: Extra information
     """
 
-    if environment:
-        environment.apply(community.merged, inplace=True, warning=False)
+    if workers is not None:
+        return workers.map(mu_score, organisms, environment=environment, min_mol_weight=min_mol_weight,
+                           min_growth=min_growth, max_uptake=max_uptake, abstol=abstol, validate=validate,
+                           n_solutions=n_solutions, pool_gap=pool_gap, verbose=verbose,
+                           convergence_tol=convergence_tol, convergence_window=convergence_window, stats=stats)
 
     max_uptake = max_uptake * len(community.organisms)
+    model = community.merged
     scores = {}
-    solver = solver_instance(community.merged)
 
-    for org_id in community.organisms:
+    all_exchange = [r_id for exchange_rxns in community.organisms_exchange_reactions.values() for r_id in exchange_rxns]
+    bounds = _env_bounds(environment, model)
+    key = 'mu_{}'.format(max_uptake)
+    solver = get_solver(session, key, model, bounds, _minimal_media_setup(all_exchange, max_uptake))
+
+    if organisms is None:
+        organisms = community.organisms
+
+    for org_id in organisms:
         exchange_rxns = community.organisms_exchange_reactions[org_id]
+        exchange = list(exchange_rxns)
         biomass_reaction = community.organisms_biomass_reactions[org_id]
-        community.merged.biomass_reaction = biomass_reaction
+        objective, valid = _medium_objective(model, exchange, min_mol_weight)
+
+        # uptake is limited to *max_uptake* (bounds of the environment still apply to secretion)
+        constraints = {r_id: (-max_uptake if r_id in valid else 0, bounds[r_id][1] if r_id in bounds
+                              else model.reactions[r_id].ub) for r_id in exchange}
+        constraints[biomass_reaction] = (min_growth, inf)
+
+        medium_list = []
+        cuts = []
+        convergence = None
+
+        if convergence_tol is not None:
+            convergence = _Convergence(exchange_rxns, convergence_tol, convergence_window)
+
+        for i in range(n_solutions):
+            sol = solver.solve(objective, minimize=True, constraints=constraints, get_values=exchange)
+
+            if sol.status != Status.OPTIMAL:
+                break
+
+            medium = {r_id for r_id in exchange if sol.values[r_id] < -abstol}
+
+            if validate:
+                validate_solution(_ModelView(model, biomass_reaction, bounds), medium, exchange, -1, min_growth,
+                                  max_uptake)
+
+            medium_list.append(medium)
+
+            if not medium or (convergence is not None and convergence.add(medium)):
+                break
+
+            # exclude this medium (and its supersets) from the next solutions
+            cut = 'mus_cut_{}'.format(i)
+            cuts.append(cut)
+            solver.add_constraint(cut, {'y_' + r_id: 1 for r_id in medium}, '<', len(medium) - 1)
 
-        medium_list, sols = minimal_medium(community.merged, exchange_reactions=list(exchange_rxns.keys()),
-                                           min_mass_weight=min_mol_weight, min_growth=min_growth,
-                                           n_solutions=n_solutions, max_uptake=max_uptake, validate=validate,
-                                           abstol=abstol, use_pool=False, pool_gap=pool_gap, solver=solver,
-                                           warnings=False)
+        for cut in cuts:
+            solver.remove_constraint(cut)
+
+        if stats is not None:
+            stats[org_id] = {'solutions': len(medium_list)}
 
         if medium_list:
             counter = Counter(chain(*medium_list))
@@ -162,18 +409,25 @@ def mu_score(community, environment=None, min_mol_weight=False, min_growth=0.1,
     return scores
 
 
-def mp_score(community, environment=None, abstol=1e-3):
+def mp_score(community, environment=None, abstol=1e-3, session=None, stats=None):
     """
     Discover metabolites which species can produce in community
 
     Zelezniak A. et al, Metabolic dependencies drive species co-occurrence in diverse microbial communities (PNAS 2015)
 
+    Producibility is checked for the exchange reactions of all organisms at once: first by maximizing the sum of all
+    unresolved exchange fluxes (repeatedly), and then by maximizing each remaining candidate individually. The latter
+    step (flux variability style) reuses the same solver, and candidates that carry flux in any of these solutions
+    are resolved without solving their own LP.
+
     Args:
         community (Community): community object
         environment (Environment): Metabolic environment in which the SMETANA score is colulated
         min_growth (float): minimum growth rate (default: 0.1)
         max_uptake (float): maximum uptake rate (default: 10)
         abstol (float): tolerance for detecting a non-zero exchange flux (default: 1e-6)
+        session (SolverSession): reuse solver instances across calls (optional)
+        stats (dict): if given, it is filled with the number of LPs solved ('lps') and saved ('lps_saved')
 
     Returns:
         dict: Keys are model names, values are list with produced compounds
@@ -181,52 +435,71 @@ def mp_score(community, environment=None, abstol=1e-3):
     """
 
     if environment:
-        environment.apply(community.merged, inplace=True, warning=False)
         env_compounds = environment.get_compounds(fmt_func=lambda x: x[5:-5])
     else:
         env_compounds = set()
 
+    bounds = _env_bounds(environment, community.merged)
+
     for exchange_rxns in community.organisms_exchange_reactions.values():
         for r_id in exchange_rxns.keys():
             rxn = community.merged.reactions[r_id]
             if isinf(rxn.ub):
-                rxn.ub = 1000
+                bounds[r_id] = (rxn.lb, 1000)
 
-    solver = solver_instance(community.merged)
+    solver = get_solver(session, 'mp', community.merged, bounds)
 
-    scores = {}
+    candidates = {org_id: [r_id for r_id, cnm in exchange_rxns.items() if cnm.original_metabolite not in env_compounds]
+                  for org_id, exchange_rxns in community.organisms_exchange_reactions.items()}
 
-    for org_id, exchange_rxns in community.organisms_exchange_reactions.items():
-        scores[org_id] = {}
+    produced = set()
+    n_lps = 0
+    n_saved = 0
 
-        remaining = [r_id for r_id, cnm in exchange_rxns.items() if cnm.original_metabolite not in env_compounds]
+    remaining = [r_id for org_id in community.organisms_exchange_reactions for r_id in candidates[org_id]]
 
-        while len(remaining) > 0:
-            sol = solver.solve(objective={r_id: 1 for r_id in remaining}, minimize=False, get_values=remaining)
+    while len(remaining) > 0:
+        sol = solver.solve(objective={r_id: 1 for r_id in remaining}, minimize=False, get_values=remaining)
+        n_lps += 1
 
-            if sol.status != Status.OPTIMAL:
-                break
+        if sol.status != Status.OPTIMAL:
+            break
 
-            blocked = [r_id for r_id in remaining if sol.values[r_id] < abstol]
+        blocked = [r_id for r_id in remaining if sol.values[r_id] < abstol]
 
-            if len(blocked) == len(remaining):
-                break
+        if len(blocked) == len(remaining):
+            break
+
+        produced.update(r_id for r_id in remaining if sol.values[r_id] >= abstol)
+        remaining = blocked
+
+    pending = set(remaining)
+
+    for r_id in remaining:
+        if r_id not in pending:
+            n_saved += 1
+            continue
 
-            for r_id in remaining:
-                if sol.values[r_id] >= abstol:
-                    cnm = exchange_rxns[r_id]
-                    scores[org_id][cnm.original_metabolite] = 1
+        pending.discard(r_id)
+        sol = solver.solve(objective={r_id: 1}, minimize=False, get_values=[r_id] + sorted(pending))
+        n_lps += 1
 
-            remaining = blocked
+        if sol.status == Status.OPTIMAL:
+            if sol.fobj > abstol:
+                produced.add(r_id)
 
-        for r_id in remaining:
-            sol = solver.solve(objective={r_id: 1}, minimize=False, get_values=False)
-            cnm = exchange_rxns[r_id]
+            resolved = [other for other in pending if sol.values[other] > abstol]
+            produced.update(resolved)
+            pending.difference_update(resolved)
+
+    scores = {}
+
+    for org_id, exchange_rxns in community.organisms_exchange_reactions.items():
+        scores[org_id] = {exchange_rxns[r_id].original_metabolite: int(r_id in produced) for r_id in candidates[org_id]}
 
-            if sol.status == Status.OPTIMAL and sol.fobj > abstol:
-                scores[org_id][cnm.original_metabolite] = 1
-            else:
-                scores[org_id][cnm.original_metabolite] = 0
+    if stats is not None:
+        stats['lps'] = n_lps
+        stats['lps_saved'] = n_saved
 
     return scores
 
@@ -250,18 +523,22 @@ def mip_score(community, environment=None, min_mol_weight=False, min_growth=0.1,
         float: MIP score
     """
 
-    noninteracting = community.copy(copy_models=False, interacting=False)
+    noninteracting = community.variant(interacting=False)
     exch_reactions = set(community.merged.get_exchange_reactions())
     max_uptake = max_uptake * len(community.organisms)
 
     if environment:
-        environment.apply(noninteracting.merged, inplace=True, warning=False)
         exch_reactions &= set(environment)
 
-    noninteracting_medium, sol1 = minimal_medium(noninteracting.merged, exchange_reactions=exch_reactions,
+    # minimal_medium adds its own variables and constraints to the solver: use a new one for each call
+    bounds = _env_bounds(environment, noninteracting.merged)
+    solver = get_solver(None, 'mip_ni', noninteracting.merged, bounds)
+    model = _ModelView(noninteracting.merged, bounds=bounds)
+
+    noninteracting_medium, sol1 = minimal_medium(model, exchange_reactions=exch_reactions,
                                                  direction=direction, min_mass_weight=min_mol_weight,
                                                  min_growth=min_growth, max_uptake=max_uptake, validate=validate,
-                                                 warnings=False, milp=(not use_lp))
+                                                 warnings=False, milp=(not use_lp), solver=solver)
     if noninteracting_medium is None:
         if verbose:
             warn('MIP: Failed to find a valid solution for non-interacting community')
@@ -269,11 +546,13 @@ def mip_score(community, environment=None, min_mol_weight=False, min_growth=0.1,
 
     # anabiotic environment is limited to non-interacting community minimal media
     noninteracting_env = Environment.from_reactions(noninteracting_medium, max_uptake=max_uptake)
-    noninteracting_env.apply(community.merged, inplace=True)
+    bounds = _env_bounds(noninteracting_env, community.merged)
+    solver = get_solver(None, 'mip_i', community.merged, bounds)
+    model = _ModelView(community.merged, bounds=bounds)
 
-    interacting_medium, sol2 = minimal_medium(community.merged, direction=direction, exchange_reactions=noninteracting_medium,
+    interacting_medium, sol2 = minimal_medium(model, direction=direction, exchange_reactions=noninteracting_medium,
                                               min_mass_weight=min_mol_weight, min_growth=min_growth, milp=(not use_lp),
-                                              max_uptake=max_uptake, validate=validate, warnings=False)
+                                              max_uptake=max_uptake, validate=validate, warnings=False, solver=solver)
 
     if interacting_medium is None:
         if verbose:
@@ -299,7 +578,7 @@ def mip_score(community, environment=None, min_mol_weight=False, min_growth=0.1,
 
 
 def mro_score(community, environment=None, direction=-1, min_mol_weight=False, min_growth=0.1, max_uptake=10,
-              validate=False, verbose=True, use_lp=False, exclude=None):
+              validate=False, verbose=True, use_lp=False, exclude=None, workers=None):
     """
     Implements the metabolic resource overlap (MRO) score as defined in (Zelezniak et al, 2015).
 
@@ -311,6 +590,7 @@ def mro_score(community, environment=None, direction=-1, min_mol_weight=False, m
         min_mol_weight (bool): minimize by molecular weight of nutrients (default: False)
         min_growth (float): minimum growth rate (default: 0.1)
         max_uptake (float): maximum uptake rate (default: 10)
+        workers (OrganismPool): calculate the individual media of each organism in parallel (optional)
 
     Returns:
         float: MRO score
@@ -320,12 +600,16 @@ def mro_score(community, environment=None, direction=-1, min_mol_weight=False, m
     max_uptake = max_uptake * len(community.organisms)
 
     if environment:
-        environment.apply(community.merged, inplace=True, warning=False)
         exch_reactions &= set(environment)
 
-    medium, sol = minimal_medium(community.merged, exchange_reactions=exch_reactions, direction=direction,
+    # minimal_medium adds its own variables and constraints to the solver: use a new one for each call
+    bounds = _env_bounds(environment, community.merged)
+    solver = get_solver(None, 'mro', community.merged, bounds)
+    model = _ModelView(community.merged, bounds=bounds)
+
+    medium, sol = minimal_medium(model, exchange_reactions=exch_reactions, direction=direction,
                                  min_mass_weight=min_mol_weight, min_growth=min_growth, max_uptake=max_uptake,
-                                 validate=validate,  warnings=False, milp=(not use_lp))
+                                 validate=validate,  warnings=False, milp=(not use_lp), solver=solver)
 
     if sol.status != Status.OPTIMAL:
         if verbose:
@@ -333,29 +617,25 @@ def mro_score(community, environment=None, direction=-1, min_mol_weight=False, m
         return None, None
 
     interacting_env = Environment.from_reactions(medium, max_uptake=max_uptake)
-    interacting_env.apply(community.merged, inplace=True)
 
     if exclude is None:
         exclude = set()
 
     medium = {x[7:-7] for x in medium} - exclude
-    individual_media = {}
-    solver = solver_instance(community.merged)
 
-    for org_id in community.organisms:
-        biomass_reaction = community.organisms_biomass_reactions[org_id]
-        community.merged.biomass_reaction = biomass_reaction
-        org_interacting_exch = community.organisms_exchange_reactions[org_id]
+    kwargs = dict(environment=interacting_env, direction=direction, min_mol_weight=min_mol_weight,
+                  min_growth=min_growth, max_uptake=max_uptake, validate=validate, use_lp=use_lp, exclude=exclude)
 
-        medium_i, sol = minimal_medium(community.merged, exchange_reactions=org_interacting_exch, direction=direction,
-                                     min_mass_weight=min_mol_weight, min_growth=min_growth, max_uptake=max_uptake,
-                                     validate=validate, solver=solver, warnings=False, milp=(not use_lp))
+    if workers is not None:
+        individual_media = workers.map(_individual_media, **kwargs)
+    else:
+        individual_media = _individual_media(community, **kwargs)
 
-        if sol.status != Status.OPTIMAL:
-            warn('MRO: Failed to find a valid solution for: ' + org_id)
-            return None, None
+    failed = [org_id for org_id in community.organisms if individual_media.get(org_id) is None]
 
-        individual_media[org_id] = {org_interacting_exch[r].original_metabolite[2:-2] for r in medium_i} - exclude
+    if failed:
+        warn('MRO: Failed to find a valid solution for: ' + failed[0])
+        return None, None
 
     pairwise = {(o1, o2): individual_media[o1] & individual_media[o2] for o1, o2 in combinations(community.organisms, 2)}
 
@@ -371,24 +651,60 @@ def mro_score(community, environment=None, direction=-1, min_mol_weight=False, m
     return score, extras
 
 
+def _individual_media(community, environment, direction, min_mol_weight, min_growth, max_uptake, validate, use_lp,
+                      exclude, organisms=None):
+    """ Minimal media of each organism (within a community, in the given environment), used by MRO.
+
+    Returns:
+        dict: Keys are organisms, values are the set of compounds in each medium (or None if no solution was found)
+    """
+
+    bounds = _env_bounds(environment, community.merged)
+    solver = get_solver(None, 'mro_org', community.merged, bounds)
+    individual_media = {}
+
+    if organisms is None:
+        organisms = community.organisms
+
+    for org_id in organisms:
+        biomass_reaction = community.organisms_biomass_reactions[org_id]
+        org_model = _ModelView(community.merged, biomass_reaction, bounds)
+        org_interacting_exch = community.organisms_exchange_reactions[org_id]
+
+        medium_i, sol = minimal_medium(org_model, exchange_reactions=org_interacting_exch, direction=direction,
+                                     min_mass_weight=min_mol_weight, min_growth=min_growth, max_uptake=max_uptake,
+                                     validate=validate, solver=solver, warnings=False, milp=(not use_lp))
+
+        if sol.status != Status.OPTIMAL:
+            individual_media[org_id] = None
+            break
+
+        individual_media[org_id] = {org_interacting_exch[r].original_metabolite[2:-2] for r in medium_i} - exclude
+
+    return individual_media
+
+
 def minimal_environment(community, aerobic=None, min_mol_weight=False, min_growth=0.1, max_uptake=10,
                         validate=False, verbose=True, use_lp=False):
 
     exch_reactions = set(community.merged.get_exchange_reactions())
 
     exch_reactions -= {"R_EX_M_h2o_e_pool"}
-    community.merged.set_flux_bounds("R_EX_M_h2o_e_pool", -inf, inf)
+    bounds = {"R_EX_M_h2o_e_pool": (-inf, inf)}
 
     if aerobic is not None:
         exch_reactions -= {"R_EX_M_o2_e_pool"}
         if aerobic:
-            community.merged.set_flux_bounds("R_EX_M_o2_e_pool", -max_uptake, inf)
+            bounds["R_EX_M_o2_e_pool"] = (-max_uptake, inf)
         else:
-            community.merged.set_flux_bounds("R_EX_M_o2_e_pool", 0, inf)
+            bounds["R_EX_M_o2_e_pool"] = (0, inf)
+
+    bounds = {r_id: bound for r_id, bound in bounds.items() if r_id in community.merged.reactions}
+    solver = get_solver(None, 'env', community.merged, bounds)
 
     ex_rxns, sol = minimal_medium(community.merged, exchange_reactions=exch_reactions,
         min_mass_weight=min_mol_weight, min_growth=min_growth, milp=(not use_lp),
-        max_uptake=max_uptake, validate=validate, warnings=False)
+        max_uptake=max_uptake, validate=validate, warnings=False, solver=solver)
 
     if ex_rxns is None:
         if verbose:
@@ -0,0 +1,330 @@
+import json
+import os
+from collections import OrderedDict
+from math import isnan
+
+import numpy as np
+from reframed import load_cbmodel
+from reframed.core.cbmodel import CBModel, CBReaction
+from reframed.core.model import Compartment, Metabolite, ReactionType
+
+from smetana.cache import file_digest
+
+
+INDEX_FILE = 'index.json'
+STORE_FORMAT = 1
+
+ARRAYS = {
+    'lb': 'f8',
+    'ub': 'f8',
+    'objective': 'f8',
+    'indptr': 'i8',
+    'indices': 'i4',
+    'data': 'f8',
+}
+
+
+def _bound(value):
+    return np.nan if value is None else value
+
+
+def _unbound(value):
+    value = float(value)
+    return None if isnan(value) else value
+
+
+def build_store(models, store_dir, ids=None, flavor=None, verbose=False):
+    """ Convert a collection of SBML models into a binary model store.
+
+    Numeric data of all models (flux bounds, objective coefficients and the sparse stoichiometry in CSR format) is
+    concatenated into flat binary arrays, and the id tables of each model (compartments, metabolites and reactions)
+    are saved in a small JSON file. Only the parts of the models used by SMETANA are stored (gene associations are
+    not included).
+
+    Args:
+        models (list): SBML files
+        store_dir (str): output directory
+        ids (list): model ids (default: file names without extension)
+        flavor (str): SBML flavor (default: fbc2)
+        verbose (bool): print progress
+    """
+
+    from smetana.interface import extract_id_from_filepath
+
+    if ids is None:
+        ids = [extract_id_from_filepath(filename) for filename in models]
+
+    if not flavor:
+        flavor = 'fbc2'
+
+    os.makedirs(os.path.join(store_dir, 'models'), exist_ok=True)
+    files = {name: open(os.path.join(store_dir, name + '.bin'), 'wb') for name in ARRAYS}
+
+    index = []
+    digests = {}
+    n_reactions = 0
+    nnz = 0
+
+    try:
+        for i, (org_id, filename) in enumerate(zip(ids, models)):
+            if verbose:
+                print('Indexing model {} ({} of {})...'.format(org_id, i + 1, len(models)))
+
+            model = load_cbmodel(filename, flavor=flavor)
+            met_index = {m_id: j for j, m_id in enumerate(model.metabolites)}
+
+            lb, ub, objective, indptr, indices, data = [], [], [], [], [], []
+
+            for rxn in model.reactions.values():
+                lb.append(_bound(rxn.lb))
+                ub.append(_bound(rxn.ub))
+                objective.append(rxn.objective or 0)
+                indptr.append(nnz)
+                for m_id, coeff in rxn.stoichiometry.items():
+                    indices.append(met_index[m_id])
+                    data.append(coeff)
+                    nnz += 1
+
+            values = {'lb': lb, 'ub': ub, 'objective': objective, 'indptr': indptr, 'indices': indices, 'data': data}
+            for name, dtype in ARRAYS.items():
+                np.asarray(values[name], dtype=dtype).tofile(files[name])
+
+            entry = {
+                'id': org_id,
+                'model_id': model.id,
+                'name': getattr(model, 'name', None),
+                'source': os.path.abspath(filename),
+                'offset': n_reactions,
+                'biomass_reaction': model.biomass_reaction,
+                'compartments': [[c_id, comp.name, comp.external, getattr(comp, 'size', 1.0)]
+                                 for c_id, comp in model.compartments.items()],
+                'metabolites': [[m_id, met.name, met.compartment] for m_id, met in model.metabolites.items()],
+                'reactions': [[r_id, rxn.name, rxn.reversible, rxn.reaction_type.name if rxn.reaction_type else None]
+                              for r_id, rxn in model.reactions.items()],
+                'metabolite_metadata': {m_id: dict(met.metadata)
+                                        for m_id, met in model.metabolites.items() if met.metadata},
+                'reaction_metadata': {r_id: dict(rxn.metadata)
+                                      for r_id, rxn in model.reactions.items() if rxn.metadata},
+            }
+
+            with open(os.path.join(store_dir, 'models', org_id + '.json'), 'w') as f:
+                json.dump(entry, f)
+
+            index.append(org_id)
+            digests[org_id] = file_digest(filename)
+            n_reactions += len(model.reactions)
+
+        np.asarray([nnz], dtype=ARRAYS['indptr']).tofile(files['indptr'])
+
+    finally:
+        for f in files.values():
+            f.close()
+
+    with open(os.path.join(store_dir, INDEX_FILE), 'w') as f:
+        json.dump({'format': STORE_FORMAT, 'arrays': ARRAYS, 'models': index, 'digests': digests}, f, indent=1)
+
+
+class ModelStore(object):
+    """
+    Read models from a binary model store (see *build_store*).
+
+    Numeric arrays are memory-mapped, so they are loaded lazily and shared (through the page cache) by all processes
+    reading the same store. Models are rebuilt on every call to *get_model*, wrap the store in a BoundedModelCache to
+    keep them in memory. Genes and gene-protein-reaction associations are not stored, so models have no GPRs.
+    Provides the same interface as reframed's ModelCache.
+    """
+
+    def __init__(self, store_dir, post_processing=None):
+        """
+        Args:
+            store_dir (str): store directory
+            post_processing (function): called with each model after loading (optional)
+        """
+        self.store_dir = store_dir
+        self.post_processing = post_processing
+
+        with open(os.path.join(store_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+
+        if index['format'] != STORE_FORMAT:
+            raise IOError('Unsupported model store format: {}'.format(index['format']))
+
+        self._ids = index['models']
+        self._digests = index['digests']
+        self._arrays = {}
+
+        for name, dtype in index['arrays'].items():
+            filename = os.path.join(store_dir, name + '.bin')
+            if os.path.getsize(filename) > 0:
+                self._arrays[name] = np.memmap(filename, dtype=dtype, mode='r')
+            else:
+                self._arrays[name] = np.zeros(0, dtype=dtype)
+
+    @staticmethod
+    def is_store(path):
+        return os.path.isdir(path) and os.path.exists(os.path.join(path, INDEX_FILE))
+
+    def get_ids(self):
+        return list(self._ids)
+
+    def _entry(self, org_id):
+        with open(os.path.join(self.store_dir, 'models', org_id + '.json')) as f:
+            return json.load(f)
+
+    def digests(self):
+        """ Digests of the original model files (dict of model id to digest). """
+        return dict(self._digests)
+
+    def get_model(self, org_id, reset_id=False):
+        """ Load a model from the store.
+
+        Args:
+            org_id (str): model id
+            reset_id (bool): use the store id as model id (default: False)
+
+        Returns:
+            CBModel: model
+        """
+
+        if org_id not in self._digests:
+            raise KeyError('Model not in store: {}'.format(org_id))
+
+        entry = self._entry(org_id)
+        model = CBModel(org_id if reset_id else entry['model_id'])
+        if entry['name'] is not None:
+            model.name = entry['name']
+
+        for c_id, name, external, size in entry['compartments']:
+            model.add_compartment(Compartment(c_id, name, external, size))
+
+        met_ids = []
+        met_metadata = entry['metabolite_metadata']
+        for m_id, name, compartment in entry['metabolites']:
+            met = Metabolite(m_id, name, compartment)
+            met.metadata.update(met_metadata.get(m_id, {}))
+            model.add_metabolite(met)
+            met_ids.append(m_id)
+
+        start = entry['offset']
+        end = start + len(entry['reactions'])
+        lb = self._arrays['lb'][start:end]
+        ub = self._arrays['ub'][start:end]
+        objective = self._arrays['objective'][start:end]
+        indptr = self._arrays['indptr'][start:end + 1]
+        indices = self._arrays['indices'][indptr[0]:indptr[-1]]
+        data = self._arrays['data'][indptr[0]:indptr[-1]]
+        indptr = indptr - indptr[0]
+
+        rxn_metadata = entry['reaction_metadata']
+        for i, (r_id, name, reversible, reaction_type) in enumerate(entry['reactions']):
+            stoichiometry = OrderedDict((met_ids[j], float(coeff))
+                                        for j, coeff in zip(indices[indptr[i]:indptr[i + 1]],
+                                                            data[indptr[i]:indptr[i + 1]]))
+            rxn = CBReaction(r_id, name=name, reversible=reversible, stoichiometry=stoichiometry,
+                             lb=_unbound(lb[i]), ub=_unbound(ub[i]), objective=float(objective[i]),
+                             reaction_type=ReactionType[reaction_type] if reaction_type else None)
+            rxn.metadata.update(rxn_metadata.get(r_id, {}))
+            model.add_reaction(rxn)
+
+        model.biomass_reaction = entry['biomass_reaction']
+
+        if self.post_processing is not None:
+            self.post_processing(model)
+
+        return model
+
+
+class SBMLLoader(object):
+    """ Load models directly from SBML files (without caching). Provides the same interface as ModelCache. """
+
+    def __init__(self, ids, paths, load_args=None, post_processing=None):
+        """
+        Args:
+            ids (list): model ids
+            paths (list): SBML files
+            load_args (dict): extra arguments for load_cbmodel (optional)
+            post_processing (function): called with each model after loading (optional)
+        """
+        self._paths = OrderedDict(zip(ids, paths))
+        self.load_args = load_args or {}
+        self.post_processing = post_processing
+
+    def get_ids(self):
+        return list(self._paths.keys())
+
+    def get_model(self, org_id, reset_id=False):
+        model = load_cbmodel(self._paths[org_id], **self.load_args)
+
+        if reset_id:
+            model.id = org_id
+
+        if self.post_processing is not None:
+            self.post_processing(model)
+
+        return model
+
+
+def estimate_model_size(model):
+    """ Rough estimate of the memory used by a model (in bytes), based on the number of model elements. """
+
+    nnz = sum(len(rxn.stoichiometry) for rxn in model.reactions.values())
+    return 2000 * len(model.reactions) + 1000 * len(model.metabolites) + 200 * nnz
+
+
+class BoundedModelCache(object):
+    """
+    Model cache with bounded memory usage.
+
+    Keeps the most recently used models (loaded from *source*, e.g. an SBMLLoader or a ModelStore) and evicts the
+    least recently used ones when the number of models or their estimated size exceeds the given limits (without
+    limits, all models are kept). Provides the same interface as ModelCache.
+    """
+
+    def __init__(self, source, max_models=None, max_size=None):
+        """
+        Args:
+            source: object used to load models (with *get_ids* and *get_model* methods)
+            max_models (int): maximum number of models in memory (optional)
+            max_size (float): maximum (estimated) size of models in memory in MB (optional)
+        """
+        self.source = source
+        self.max_models = max_models
+        self.max_size = max_size * 1024 * 1024 if max_size is not None else None
+        self.hits = 0
+        self.misses = 0
+        self._models = OrderedDict()
+        self._size = 0
+
+    @property
+    def bounded(self):
+        return self.max_models is not None or self.max_size is not None
+
+    def get_ids(self):
+        return self.source.get_ids()
+
+    def get_model(self, org_id, reset_id=False):
+        if org_id in self._models:
+            self.hits += 1
+            self._models.move_to_end(org_id)
+            model = self._models[org_id][0]
+        else:
+            self.misses += 1
+            model = self.source.get_model(org_id, reset_id=reset_id)
+            size = estimate_model_size(model)
+            self._models[org_id] = (model, size)
+            self._size += size
+            self._evict()
+
+        # the id is set by the source when the model is loaded (cached models are shared, they are never changed)
+        return model
+
+    def _evict(self):
+        # the most recently loaded model is always kept
+        while len(self._models) > 1 and (
+                (self.max_models is not None and len(self._models) > self.max_models) or
+                (self.max_size is not None and self._size > self.max_size)):
+            _, (_, size) = self._models.popitem(last=False)
+            self._size -= size
+
+    def __len__(self):
+        return len(self._models)
@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
+import tempfile
 import unittest
 from smetana.interface import main
 import pandas as pd
 
 
+def temp_dir(test):
+    """ Create a temporary directory that is removed when *test* finishes. """
+    tmpdir = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+    return tmpdir
+
+
 class TestGlobal(unittest.TestCase):
     def test_global(self):
         main(["tests/data/ec_*_ko.xml"], mode="global", output="tests/output/test", media="M9,LB",
@@ -22,3 +32,690 @@ class TestDetailed(unittest.TestCase):
         df = pd.read_csv("tests/output/test_detailed.tsv")
         self.assertGreater(df.shape[0], 5)
         self.assertLess(df.shape[0], 15)
+
+
+class TestConvergence(unittest.TestCase):
+
+    def setUp(self):
+        from reframed import Environment, load_cbmodel
+        from smetana.interface import load_media_db
+        from smetana.legacy import Community
+
+        # three copies of each species, so that each species has alternative donors (without ATP maintenance,
+        # otherwise every species must be present to carry its maintenance flux)
+        models = []
+        for name in ['glc', 'nh4']:
+            base = load_cbmodel("tests/data/ec_{}_ko.xml".format(name), flavor='fbc2')
+            base.reactions.R_ATPM.lb = 0
+            for i in range(3):
+                model = base.copy()
+                model.id = '{}{}'.format(name, i + 1)
+                models.append(model)
+
+        self.community = Community('test', models, copy_models=False)
+        media_db = load_media_db("tests/data/media_db.tsv")
+        self.env = Environment.from_compounds(media_db['M9'], fmt_func=lambda x: "R_EX_M_{}_e_pool".format(x),
+                                              max_uptake=10.0 * len(models))
+
+    def test_scs_convergence(self):
+        from smetana.smetana import sc_score
+
+        full_stats, zero_stats, tol_stats = {}, {}, {}
+        full = sc_score(self.community, self.env, verbose=False, stats=full_stats)
+
+        # a zero tolerance never stops early
+        zero = sc_score(self.community, self.env, verbose=False, stats=zero_stats, convergence_tol=0,
+                        convergence_window=1)
+        self.assertEqual(zero, full)
+        self.assertEqual(zero_stats, full_stats)
+
+        tol = 0.6
+        scores = sc_score(self.community, self.env, verbose=False, stats=tol_stats, convergence_tol=tol,
+                          convergence_window=1)
+        used = {org_id: stats['solutions'] for org_id, stats in tol_stats.items()}
+        total = {org_id: stats['solutions'] for org_id, stats in full_stats.items()}
+        self.assertTrue(all(used[org_id] <= total[org_id] for org_id in total))
+        self.assertLess(sum(used.values()), sum(total.values()))
+
+        for org_id, donors in full.items():
+            for donor, value in (donors or {}).items():
+                self.assertLess(abs(scores[org_id][donor] - value), tol)
+
+    def test_mus_convergence(self):
+        from smetana.smetana import mu_score
+
+        full_stats, zero_stats, tol_stats = {}, {}, {}
+        full = mu_score(self.community, self.env, verbose=False, n_solutions=20, stats=full_stats)
+        total = {org_id: stats['solutions'] for org_id, stats in full_stats.items()}
+        self.assertTrue(all(0 < n <= 20 for n in total.values()))
+
+        # a zero tolerance never stops early
+        zero = mu_score(self.community, self.env, verbose=False, n_solutions=20, stats=zero_stats,
+                        convergence_tol=0, convergence_window=1)
+        self.assertEqual(zero, full)
+        self.assertEqual(zero_stats, full_stats)
+
+        mu_score(self.community, self.env, verbose=False, n_solutions=20, stats=tol_stats, convergence_tol=0.6,
+                 convergence_window=1)
+        used = {org_id: stats['solutions'] for org_id, stats in tol_stats.items()}
+        self.assertTrue(all(used[org_id] <= total[org_id] for org_id in total))
+        self.assertLess(sum(used.values()), sum(total.values()))
+
+    def test_mus_independent(self):
+        from smetana.smetana import mu_score
+
+        # the cuts of each organism are removed before the next one: scoring an organism alone gives the same media
+        full = mu_score(self.community, self.env, verbose=False, n_solutions=20)
+
+        for org_id in ['glc1', 'nh43']:
+            alone = mu_score(self.community, self.env, verbose=False, n_solutions=20, organisms=[org_id])
+            self.assertEqual(alone[org_id], full[org_id])
+
+    def test_mus_column(self):
+        tmpdir = temp_dir(self)
+        output = os.path.join(tmpdir, 'mus_tol')
+        main(["tests/data/ec_*.xml"], mode="detailed", output=output, media="M9", mediadb="tests/data/media_db.tsv",
+             exclude="tests/data/inorganic.txt", mus_tol=0.01, mus_max_solutions=50)
+        df = pd.read_csv(output + '_detailed.tsv', sep='\t')
+        self.assertIn('mus_solutions', df.columns)
+        self.assertTrue((df['mus_solutions'] <= 50).all())
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_processes(self):
+        tmpdir = temp_dir(self)
+        communities = os.path.join(tmpdir, 'communities.tsv')
+        with open(communities, 'w') as f:
+            f.write('c1\tec_glc_ko\nc1\tec_nh4_ko\nc2\tec_nh4_ko\nc2\tec_glc_ko\n')
+
+        kwargs = dict(communities=communities, mode="global", media="M9,LB", mediadb="tests/data/media_db.tsv",
+                      exclude="tests/data/inorganic.txt")
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'serial'), **kwargs)
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'parallel'), processes=2, **kwargs)
+
+        with open(os.path.join(tmpdir, 'serial_global.tsv')) as f1, \
+                open(os.path.join(tmpdir, 'parallel_global.tsv')) as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def test_organism_processes(self):
+        tmpdir = temp_dir(self)
+        kwargs = dict(mode="detailed", media="M9,LB", mediadb="tests/data/media_db.tsv",
+                      exclude="tests/data/inorganic.txt")
+        main(["tests/data/ec_*.xml"], output=os.path.join(tmpdir, 'serial'), **kwargs)
+        main(["tests/data/ec_*.xml"], output=os.path.join(tmpdir, 'parallel'), organism_processes=2, **kwargs)
+
+        with open(os.path.join(tmpdir, 'serial_detailed.tsv')) as f1, \
+                open(os.path.join(tmpdir, 'parallel_detailed.tsv')) as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+
+class TestPairwise(unittest.TestCase):
+
+    def test_pairwise(self):
+        tmpdir = temp_dir(self)
+        communities = os.path.join(tmpdir, 'communities.tsv')
+        with open(communities, 'w') as f:
+            f.write('ec_glc_ko_ec_nh4_ko\tec_glc_ko\nec_glc_ko_ec_nh4_ko\tec_nh4_ko\n')
+
+        kwargs = dict(mode="global", media="M9,LB", mediadb="tests/data/media_db.tsv",
+                      exclude="tests/data/inorganic.txt")
+        main(["tests/data/ec_glc_ko.xml", "tests/data/ec_nh4_ko.xml"], communities=communities,
+             output=os.path.join(tmpdir, 'communities'), **kwargs)
+        main(["tests/data/ec_glc_ko.xml", "tests/data/ec_nh4_ko.xml"], pairwise=True,
+             output=os.path.join(tmpdir, 'pairwise'), **kwargs)
+
+        with open(os.path.join(tmpdir, 'communities_global.tsv')) as f1, \
+                open(os.path.join(tmpdir, 'pairwise_global.tsv')) as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+
+    def test_warm_fragments(self):
+        from smetana.interface import build_cache, warm_fragments
+        from smetana.legacy import Community, FragmentCache
+
+        model_cache = build_cache(["tests/data/ec_glc_ko.xml", "tests/data/ec_nh4_ko.xml"])
+        org_ids = model_cache.get_ids()
+        fragments = FragmentCache()
+        warm_fragments(model_cache, fragments, org_ids, 'detailed')
+        self.assertEqual(len(fragments), 2 * len(org_ids))
+
+        # pairs (and the variant used by SCS) are then merged from the fragments built up front
+        models = [model_cache.get_model(org_id, reset_id=True) for org_id in org_ids]
+        community = Community('pair', models, copy_models=False, fragment_cache=fragments)
+        community.merged
+        community.variant(create_biomass=False).merged
+        self.assertEqual(fragments.misses, 2 * len(org_ids))
+        self.assertEqual(fragments.hits, 2 * len(org_ids))
+
+
+class TestCache(unittest.TestCase):
+
+    def test_cache_dir(self):
+        tmpdir = temp_dir(self)
+        kwargs = dict(mode="global", media="M9,LB", mediadb="tests/data/media_db.tsv",
+                      exclude="tests/data/inorganic.txt", cache_dir=os.path.join(tmpdir, 'cache'))
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'run1'), **kwargs)
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'run2'), **kwargs)
+
+        with open(os.path.join(tmpdir, 'run1_global.tsv')) as f1, open(os.path.join(tmpdir, 'run2_global.tsv')) as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def test_cache_hit(self):
+        tmpdir = temp_dir(self)
+        kwargs = dict(mode="detailed", exclude="tests/data/inorganic.txt", cache_dir=os.path.join(tmpdir, 'cache'),
+                      profile=True)
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'run1'), **kwargs)
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'run2'), **kwargs)
+
+        output1, output2 = os.path.join(tmpdir, 'run1_detailed.tsv'), os.path.join(tmpdir, 'run2_detailed.tsv')
+        with open(output1) as f1, open(output2) as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+        # the second run (minimal medium included) is read from the cache, without loading or solving anything
+        timings1 = pd.read_csv(os.path.join(tmpdir, 'run1_timings.tsv'), sep='\t')
+        timings2 = pd.read_csv(os.path.join(tmpdir, 'run2_timings.tsv'), sep='\t')
+        self.assertGreater(timings1.query('stage == "environment"')['solves'].sum(), 0)
+        self.assertFalse({'load', 'merge', 'environment'} & set(timings2['stage']))
+        self.assertEqual(timings2['solves'].sum(), 0)
+
+
+    def test_cache_shared(self):
+        from smetana.cache import ResultCache
+
+        # two processes writing to the same cache directory keep it within the size limit together
+        cache_dir = os.path.join(temp_dir(self), 'cache')
+        cache1, cache2 = ResultCache(cache_dir, {}, max_size=0.01), ResultCache(cache_dir, {}, max_size=0.01)
+        value = {'M_glc__D_e': 1.0, 'data': 'x' * 1000}
+
+        for i in range(12):
+            (cache1 if i < 9 else cache2).put('key{}'.format(i), value)
+
+        size = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+        self.assertLessEqual(size, 0.01 * 1024 * 1024)
+        self.assertEqual(cache1.get('key11'), value)
+
+
+class TestProfile(unittest.TestCase):
+
+    def test_profile(self):
+        tmpdir = temp_dir(self)
+        output = os.path.join(tmpdir, 'profile')
+        main(["tests/data/ec_*_ko.xml"], mode="global", media="M9,LB", mediadb="tests/data/media_db.tsv",
+             exclude="tests/data/inorganic.txt", output=output, profile=True)
+
+        timings = pd.read_csv(output + '_timings.tsv', sep='\t', keep_default_na=False)
+        self.assertEqual(list(timings.columns), ['community', 'medium', 'stage', 'time', 'solves', 'status'])
+        self.assertEqual(set(timings['stage']), {'load', 'merge', 'environment', 'mip', 'mro'})
+        self.assertTrue((timings.query('stage == "mip"')['solves'] > 0).all())
+
+
+class TestTimeLimits(unittest.TestCase):
+
+    def test_community_time_limit(self):
+        tmpdir = temp_dir(self)
+        output = os.path.join(tmpdir, 'limits')
+        main(["tests/data/ec_*_ko.xml"], mode="global", media="M9,LB", mediadb="tests/data/media_db.tsv",
+             exclude="tests/data/inorganic.txt", output=output, community_time_limit=1e-9)
+
+        df = pd.read_csv(output + '_global.tsv', sep='\t', keep_default_na=False)
+        self.assertEqual(list(df.columns), ['community', 'medium', 'size', 'mip', 'mro', 'reason'])
+        self.assertEqual(len(df), 2)
+        self.assertTrue((df['mip'] == 'n/a').all())
+        self.assertTrue((df['reason'] == 'community time limit').all())
+
+    def test_solve_time_limit(self):
+        tmpdir = temp_dir(self)
+        kwargs = dict(mode="detailed", media="M9", mediadb="tests/data/media_db.tsv",
+                      exclude="tests/data/inorganic.txt")
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'unlimited'), **kwargs)
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'limited'), solve_time_limit=1000, **kwargs)
+
+        # a time limit that is never reached does not change the results
+        df1 = pd.read_csv(os.path.join(tmpdir, 'unlimited_detailed.tsv'), sep='\t')
+        df2 = pd.read_csv(os.path.join(tmpdir, 'limited_detailed.tsv'), sep='\t')
+        self.assertTrue(df2['reason'].isna().all())
+        pd.testing.assert_frame_equal(df1, df2.drop(columns='reason'))
+
+    def test_budget_hooks(self):
+        from reframed import load_cbmodel
+        from reframed.solvers.solution import Status
+        from smetana.budget import TimeBudget, TimeLimitExceeded
+        from smetana.session import get_solver
+
+        model = load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')
+        solver = get_solver(None, 'test', model)
+        objective = {model.biomass_reaction: 1}
+
+        with TimeBudget(total_limit=0):
+            self.assertRaises(TimeLimitExceeded, solver.solve, objective, minimize=False)
+
+        # once the budget is stopped, the solver is no longer limited
+        self.assertEqual(solver.solve(objective, minimize=False).status, Status.OPTIMAL)
+
+
+class TestAbiotic(unittest.TestCase):
+
+    def test_abiotic(self):
+        from reframed import Environment
+        from smetana.interface import load_communities, load_media, run_detailed
+        from smetana.legacy import Community
+        from smetana.output import ResultWriter
+
+        tmpdir = temp_dir(self)
+        compounds = os.path.join(tmpdir, 'compounds.txt')
+        with open(compounds, 'w') as f:
+            f.write('adn\nala__L\ngly\n')
+
+        kwargs = dict(media="M9", mediadb="tests/data/media_db.tsv", exclude="tests/data/inorganic.txt")
+        main(["tests/data/ec_*_ko.xml"], mode="abiotic", output=os.path.join(tmpdir, 'abiotic'), other=compounds,
+             n=0, zeros=True, **kwargs)
+
+        # reference: every environment is built from scratch and scored without sharing any solver
+        model_cache, comm_dict, _ = load_communities(["tests/data/ec_*_ko.xml"], None, None, None)
+        media, media_db, excluded_mets, other_mets = load_media("M9", kwargs['mediadb'], kwargs['exclude'], compounds)
+        models = [model_cache.get_model(org_id, reset_id=True) for org_id in comm_dict['all']]
+        max_uptake = 10.0 * len(models)
+
+        def run(medium_id, compounds):
+            env = Environment.from_compounds(compounds, fmt_func=lambda x: "R_EX_M_{}_e_pool".format(x),
+                                             max_uptake=max_uptake)
+            community = Community('all', models, copy_models=False)
+            return run_detailed('all', community, medium_id, excluded_mets, env, False, False, False)
+
+        medium = set(media_db['M9'])
+        with ResultWriter('abiotic', os.path.join(tmpdir, 'reference'), zeros=True) as writer:
+            writer.write(run('M9', medium))
+            for cpd in sorted(other_mets - (medium | excluded_mets)):
+                writer.write(run('M9_' + cpd, list(medium) + [cpd]))
+
+        with open(os.path.join(tmpdir, 'abiotic_detailed.tsv')) as f1, \
+                open(os.path.join(tmpdir, 'reference_detailed.tsv')) as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+
+    def test_session(self):
+        from reframed import Environment, load_cbmodel
+        from smetana.interface import load_media_db, run_detailed
+        from smetana.legacy import Community
+        from smetana.session import SolverSession
+
+        models = [load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2'),
+                  load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')]
+        media_db = load_media_db("tests/data/media_db.tsv")
+        community = Community('test', models, copy_models=False)
+        session = SolverSession()
+        solvers = None
+
+        # perturbed environments reuse the problems loaded for the base environment (including MUS)
+        for compounds in [media_db['M9'], media_db['M9'] + ['gly'], media_db['M9'] + ['adn']]:
+            env = Environment.from_compounds(compounds, fmt_func=lambda x: "R_EX_M_{}_e_pool".format(x),
+                                             max_uptake=20.0)
+            result = run_detailed('test', community, 'M9', set(), env, False, False, False, session)
+            reference = run_detailed('test', Community('test', models, copy_models=False), 'M9', set(), env, False,
+                                     False, False)
+            self.assertEqual(result, reference)
+
+            if solvers is None:
+                solvers = {key: solver for key, (_, solver) in session._solvers.items()}
+                self.assertTrue(any(key.startswith('mu') for key in solvers))
+            else:
+                self.assertEqual(set(session._solvers), set(solvers))
+                self.assertTrue(all(session._solvers[key][1] is solver for key, solver in solvers.items()))
+
+
+class TestSession(unittest.TestCase):
+
+    def test_media(self):
+        from reframed import load_cbmodel
+        from smetana.interface import load_media_db, define_environment
+        from smetana.legacy import Community
+        from smetana.session import SolverSession
+        from smetana.smetana import mip_score, mro_score, mu_score, mp_score
+
+        models = [load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2'),
+                  load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')]
+        media_db = load_media_db("tests/data/media_db.tsv")
+        community = Community('test', models, copy_models=False)
+        session = SolverSession()
+
+        def scores(community, env, session=None):
+            return (mip_score(community, env, verbose=False), mro_score(community, env, verbose=False),
+                    mu_score(community, env, verbose=False, session=session), mp_score(community, env, session=session))
+
+        for medium in ['M9', 'LB']:
+            _, env = define_environment(medium, media_db, community, 'detailed', None, False, False, False)
+            result = scores(community, env, session)
+            self.assertEqual(result, scores(Community('test', models, copy_models=False), env))
+
+            # previous behaviour: the environment was applied to the community model itself
+            reference = Community('test', models, copy_models=False)
+            env.apply(reference.merged, inplace=True, warning=False)
+            self.assertEqual(result, scores(reference, env))
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def test_resume(self):
+        tmpdir = temp_dir(self)
+        kwargs = dict(mode="global", media="M9,LB", mediadb="tests/data/media_db.tsv",
+                      exclude="tests/data/inorganic.txt")
+        main(["tests/data/ec_*_ko.xml"], output=os.path.join(tmpdir, 'full'), **kwargs)
+        self.assertFalse(os.path.exists(os.path.join(tmpdir, 'full_checkpoint.tsv')))
+
+        output = os.path.join(tmpdir, 'resumed')
+        main(["tests/data/ec_*_ko.xml"], output=output, checkpoint=True, **kwargs)
+
+        # simulate an interruption after the first block, in the middle of writing the second one
+        with open(output + '_checkpoint.tsv') as f:
+            first = f.readline()
+        with open(output + '_checkpoint.tsv', 'w') as f:
+            f.write(first + 'ec_glc_ko_ec_nh4_ko\tLB')
+        with open(output + '_global.tsv', 'a') as f:
+            f.write('ec_glc_ko_ec_nh4_ko\tLB\t2\t')
+
+        main(["tests/data/ec_*_ko.xml"], output=output, resume=True, **kwargs)
+
+        with open(os.path.join(tmpdir, 'full_global.tsv')) as f1, open(output + '_global.tsv') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+        with open(output + '_checkpoint.tsv') as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_checkpoint_load(self):
+        from smetana.output import Checkpoint
+
+        tmpdir = temp_dir(self)
+        output = os.path.join(tmpdir, 'test')
+        with Checkpoint(output) as checkpoint:
+            checkpoint.add(('c1', 'M9', ''), (10, 0))
+            checkpoint.add(('c1', 'LB', ''), (20, 5))
+
+        with open(output + '_checkpoint.tsv', 'a') as f:
+            f.write('c2\tM9\t\t3')
+
+        checkpoint = Checkpoint(output, resume=True, enabled=False)
+        self.assertEqual(checkpoint.done, {('c1', 'M9', ''), ('c1', 'LB', '')})
+        self.assertEqual(checkpoint.offsets, (20, 5))
+
+        with open(output + '_checkpoint.tsv') as f:
+            self.assertEqual(f.read(), 'c1\tM9\t\t10\t0\nc1\tLB\t\t20\t5\n')
+
+    def test_table_offset(self):
+        from smetana.output import TableWriter
+
+        filename = os.path.join(temp_dir(self), 'table.tsv')
+        writer = TableWriter(filename, ['a', 'b'])
+        writer.write([(1, 2)])
+        offset = writer.tell()
+        writer.write([(3, 4)])
+        writer.close()
+
+        writer = TableWriter(filename, ['a', 'b'], offset=offset)
+        writer.write([(5, 6)])
+        writer.close()
+
+        with open(filename) as f:
+            self.assertEqual(f.read(), 'a\tb\n1\t2\n5\t6\n')
+
+
+class TestStore(unittest.TestCase):
+
+    def test_store(self):
+        from smetana.store import build_store
+
+        tmpdir = temp_dir(self)
+        store = os.path.join(tmpdir, 'store')
+        models = ["tests/data/ec_glc_ko.xml", "tests/data/ec_nh4_ko.xml"]
+        build_store(models, store)
+
+        kwargs = dict(mode="global", media="M9,LB", mediadb="tests/data/media_db.tsv",
+                      exclude="tests/data/inorganic.txt")
+        main(models, output=os.path.join(tmpdir, 'sbml'), **kwargs)
+        main([store], output=os.path.join(tmpdir, 'store'), **kwargs)
+
+        with open(os.path.join(tmpdir, 'sbml_global.tsv')) as f1, open(os.path.join(tmpdir, 'store_global.tsv')) as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def test_store_cache(self):
+        from smetana.interface import build_cache
+        from smetana.store import build_store
+
+        store = os.path.join(temp_dir(self), 'store')
+        build_store(["tests/data/ec_glc_ko.xml", "tests/data/ec_nh4_ko.xml"], store)
+
+        # models are only rebuilt from the store once
+        cache = build_cache([store])
+        model = cache.get_model('ec_glc_ko', reset_id=True)
+        self.assertIs(cache.get_model('ec_glc_ko', reset_id=True), model)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # the id is only set when the model is loaded, cached models are shared and not changed by later calls
+        self.assertEqual(model.id, 'ec_glc_ko')
+        self.assertEqual(cache.get_model('ec_glc_ko').id, 'ec_glc_ko')
+
+        # gene associations are not stored
+        self.assertTrue(all(rxn.gpr is None for rxn in model.reactions.values()))
+
+
+class TestMemory(unittest.TestCase):
+
+    def test_model_cache(self):
+        from reframed import load_cbmodel
+        from smetana.store import BoundedModelCache, estimate_model_size
+
+        base = load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2')
+
+        class Source(object):
+            def __init__(self):
+                self.loaded = []
+
+            def get_ids(self):
+                return ['m1', 'm2', 'm3']
+
+            def get_model(self, org_id, reset_id=False):
+                self.loaded.append(org_id)
+                return base.copy()
+
+        # least recently used models are evicted first
+        source = Source()
+        cache = BoundedModelCache(source, max_models=2)
+        for org_id in ['m1', 'm2', 'm1', 'm3', 'm2']:
+            cache.get_model(org_id, reset_id=True)
+        self.assertEqual(source.loaded, ['m1', 'm2', 'm3', 'm2'])
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+        size = estimate_model_size(base)
+        self.assertGreater(size, 0)
+
+        source = Source()
+        cache = BoundedModelCache(source, max_size=1.5 * size / (1024 * 1024))
+        for org_id in ['m1', 'm2', 'm1']:
+            cache.get_model(org_id)
+        self.assertEqual(source.loaded, ['m1', 'm2', 'm1'])
+        self.assertEqual(len(cache), 1)
+
+    def test_fragment_cache(self):
+        from reframed import load_cbmodel
+        from smetana.legacy import Community, FragmentCache
+
+        model1 = load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2')
+        model2 = load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')
+
+        fragments = FragmentCache()
+        Community('test', [model1, model2], copy_models=False, fragment_cache=fragments).merged
+        self.assertEqual(len(fragments), 2)
+
+        # only the most recent fragment fits in the memory limit
+        fragments = FragmentCache(max_mb=0.99 * fragments.size / (1024 * 1024))
+        Community('test', [model1, model2], copy_models=False, fragment_cache=fragments).merged
+        self.assertEqual(len(fragments), 1)
+        self.assertEqual(fragments.misses, 2)
+
+        Community('test', [model2], copy_models=False, fragment_cache=fragments).merged
+        self.assertEqual((fragments.hits, fragments.misses), (1, 2))
+
+    def test_order_communities(self):
+        from smetana.interface import order_communities
+
+        comm_dict = {'c1': ['b', 'c'], 'c2': ['a', 'b'], 'c3': ['c', 'b'], 'c4': ['b', 'a']}
+        self.assertEqual(list(order_communities(comm_dict)), ['c2', 'c4', 'c1', 'c3'])
+
+
+class TestCommunity(unittest.TestCase):
+
+    def test_incremental(self):
+        from reframed import load_cbmodel
+        from smetana.legacy import Community
+
+        model1 = load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2')
+        model2 = load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')
+        model1.id, model2.id = 'org1', 'org2'
+
+        community = Community('test', [model1], copy_models=False)
+        original = list(community.merged.reactions)
+
+        community.add_organism(model2, copy=False, incremental=True)
+        merged = Community('test', [model1, model2], copy_models=False).merged
+        self.assertEqual(list(community.merged.reactions), list(merged.reactions))
+        self.assertEqual(list(community.merged.metabolites), list(merged.metabolites))
+
+        community.remove_organism('org2', incremental=True)
+        self.assertEqual(list(community.merged.reactions), original)
+
+    def test_incremental_variants(self):
+        from reframed import load_cbmodel
+        from smetana.legacy import Community
+
+        model1 = load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2')
+        model2 = load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')
+        model1.id, model2.id = 'org1', 'org2'
+
+        community = Community('test', [model1], copy_models=False)
+        community.merged
+        variant = community.variant(interacting=False)
+        original = list(variant.merged.reactions)
+
+        # cached variants are extended (and retracted) with the community instead of being merged again
+        community.add_organism(model2, copy=False, incremental=True)
+        self.assertIs(community.variant(interacting=False), variant)
+        merged = Community('test', [model1, model2], copy_models=False, interacting=False).merged
+        self.assertEqual(list(variant.merged.reactions), list(merged.reactions))
+        self.assertEqual(list(variant.merged.metabolites), list(merged.metabolites))
+
+        other = community.variant(create_biomass=False)
+        community.remove_organism('org2', incremental=True)
+        self.assertIs(community.variant(interacting=False), variant)
+        self.assertEqual(list(variant.merged.reactions), original)
+        self.assertIsNot(community.variant(create_biomass=False), other)
+        self.assertNotIn('org2', community.variant(create_biomass=False).organisms)
+
+    def test_merge_baseline(self):
+        from copy import deepcopy
+        from reframed import load_cbmodel
+        from smetana.legacy import Community, FragmentCache
+        from benchmarks.baseline import generate_merged_model
+
+        def fields(obj):
+            data = dict(vars(obj))
+            if 'gpr' in data:
+                data['gpr'] = str(obj.gpr)
+            return data
+
+        def summary(model):
+            # every attribute of every object, in model order
+            return {
+                'compartments': [(c_id, fields(comp)) for c_id, comp in model.compartments.items()],
+                'metabolites': [(m_id, fields(met)) for m_id, met in model.metabolites.items()],
+                'reactions': [(r_id, fields(rxn)) for r_id, rxn in model.reactions.items()],
+                'biomass_reaction': model.biomass_reaction,
+                'metadata': dict(model.metadata),
+            }
+
+        models = [load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2'),
+                  load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')]
+        originals = [summary(model) for model in models]
+
+        expected = generate_merged_model(Community('test', deepcopy(models), copy_models=False))
+        fragments = FragmentCache()
+        merged = Community('test', models, copy_models=False, fragment_cache=fragments).merged
+
+        self.assertEqual(summary(merged), summary(expected))
+        self.assertEqual([summary(model) for model in models], originals)
+
+        # changing the merged model must not leak into the organism models or the cached fragments
+        for rxn in merged.reactions.values():
+            rxn.lb, rxn.ub = 0, 0
+            rxn.stoichiometry.clear()
+            if rxn.gpr is not None:
+                rxn.gpr.proteins.clear()
+        for obj in list(merged.metabolites.values()) + list(merged.compartments.values()):
+            obj.name = 'changed'
+            obj.metadata['changed'] = 'yes'
+
+        self.assertEqual([summary(model) for model in models], originals)
+        merged = Community('test', models, copy_models=False, fragment_cache=fragments).merged
+        self.assertEqual(summary(merged), summary(expected))
+
+    def test_arrays(self):
+        from reframed import load_cbmodel
+        from smetana.legacy import Community
+
+        models = [load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2'),
+                  load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')]
+        community = Community('test', models, copy_models=False)
+        model = community.merged
+        arrays = community.arrays
+
+        self.assertEqual(arrays.reactions, list(model.reactions))
+        self.assertEqual(arrays.metabolites, list(model.metabolites))
+        self.assertEqual(list(arrays.lb), [rxn.lb for rxn in model.reactions.values()])
+        self.assertEqual(list(arrays.ub), [rxn.ub for rxn in model.reactions.values()])
+
+        stoichiometry = {m_id: {} for m_id in model.metabolites}
+        for r_id, rxn in model.reactions.items():
+            for m_id, coeff in rxn.stoichiometry.items():
+                stoichiometry[m_id][r_id] = coeff
+
+        for i, m_id in enumerate(arrays.metabolites):
+            self.assertEqual(arrays.row(i), stoichiometry[m_id])
+
+        for org_id, rxns in community.organisms_reactions.items():
+            self.assertEqual([arrays.reactions[j] for j in arrays.organism_reactions[org_id]], rxns)
+
+        for org_id, index in arrays.organism_columns.items():
+            expected = [r_id for r_id in model.reactions if community.reaction_organisms.get(r_id) == org_id]
+            self.assertEqual([arrays.reactions[j] for j in index], expected)
+
+    def test_split_fluxes(self):
+        from reframed import load_cbmodel
+        from smetana.legacy import Community
+
+        # organism ids that are suffixes of each other
+        model1 = load_cbmodel("tests/data/ec_glc_ko.xml", flavor='fbc2')
+        model2 = load_cbmodel("tests/data/ec_nh4_ko.xml", flavor='fbc2')
+        model1.id, model2.id = 'a', 'ba'
+
+        community = Community('test', [model1, model2], copy_models=False)
+        reactions = list(community.merged.reactions)
+        fluxes = {r_id: float(j) for j, r_id in enumerate(reactions)}
+
+        split = community.split_fluxes(fluxes)
+        values = [[fluxes[r_id] for r_id in reactions], [-fluxes[r_id] for r_id in reactions]]
+        matrix = community.split_flux_matrix(values)
+        listed = community.split_flux_matrix(values, reactions=reactions)
+
+        for model in [model1, model2]:
+            # organism reactions, plus the sink of the organism biomass
+            r_ids = list(model.reactions) + ['Sink_biomass']
+            expected = {r_id: fluxes['{}_{}'.format(r_id, model.id)] for r_id in r_ids}
+            self.assertEqual(dict(split[model.id]), expected)
+
+            r_ids, values = matrix[model.id]
+            self.assertEqual(set(r_ids), set(expected))
+            self.assertEqual(list(values[0]), [expected[r_id] for r_id in r_ids])
+            self.assertEqual(list(values[1]), [-expected[r_id] for r_id in r_ids])
+
+            # the same columns are found from the arrays of the merged model and from a list of reaction ids
+            r_ids2, values2 = listed[model.id]
+            self.assertEqual(dict(zip(r_ids2, values2[0])), dict(zip(r_ids, values[0])))